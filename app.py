@@ -1,3 +1,6 @@
+import time
+from contextlib import contextmanager
+
 import streamlit as st
 
 # =========================================================
@@ -14,12 +17,44 @@ st.set_page_config(
 # =========================================================
 from logic import (
     registar_utilizador,
-    executar_pericia,
     auth_login,
     auth_get_user,
     auth_logout,
-    get_user_data
+    entrar_com_perfil,
+    get_user_data_cached,
+    atualizar_perfil,
+    invalidar_perfil,
+    geracao_perfis,
+    CachePerfis,
+    buscar_semelhantes,
+    analisar_lote,
+    salvar_pericia,
+    pericia_bem_sucedida,
+    erro_pericia,
+    casos_proximos,
+    previa_evidencia,
+    fila_pericias,
+    enviar_pericia,
+    listar_historico,
+    obter_laudo_historico,
+    CONCLUIDO,
+    ERRO,
+    MAX_WORKERS_LOTE
+)
+from estilos import (
+    css_global,
+    cartoes_planos,
+    cartoes_planos_3d,
+    JS_HASH,
+    CSS_ACESSO_AGENTE,
+    CSS_PLANOS,
+    CSS_PLANOS_3D,
+    HTML_DESTAQUES,
+    HTML_HERO,
+    HTML_RODAPE,
+    PLANOS
 )
+from metricas import metricas
 
 # =========================================================
 # SESSION STATE DEFAULTS
@@ -29,12 +64,22 @@ defaults = {
     "pagina": "Home",
     "usuario_logado": None,
     "resultado": None,
+    "job_atual": None,
+    "proximos": [],
+    "historico_cursores": [None],
+    "historico_paginas": {},
+    "historico_laudos": {},
     "uploader_key": 0
 }
 for k, v in defaults.items():
     if k not in st.session_state:
         st.session_state[k] = v
 
+# Cache de perfil da sessão: reruns leem daqui, depois do cache do processo, e só então do banco.
+# invalidar_perfil() em qualquer sessão sobe a geração e derruba este cache também.
+if "perfis" not in st.session_state:
+    st.session_state.perfis = CachePerfis(ttl=60.0, geracao=geracao_perfis)
+
 # =========================================================
 # FUNÇÕES DE NAVEGAÇÃO / UI
 # =========================================================
@@ -50,111 +95,241 @@ def ir_planos():
 def ir_acesso():
     st.session_state.pagina = "Acesso"
 
+def ir_historico():
+    st.session_state.pagina = "Historico"
+    st.session_state.historico_cursores = [None]
+    st.session_state.historico_paginas = {}
+
+def historico_avancar(cursor):
+    st.session_state.historico_cursores.append(cursor)
+
+def historico_voltar():
+    st.session_state.historico_cursores.pop()
+
 def logout():
+    if st.session_state.usuario_logado:
+        invalidar_perfil(st.session_state.usuario_logado["email"])
     auth_logout()
     st.session_state.clear()
 
+@contextmanager
+def medir_render(secao):
+    """CPU da thread do script por execução completa ou de fragmento."""
+    inicio = time.thread_time()
+    try:
+        yield
+    finally:
+        metricas.observar("visionscan_render_cpu_segundos", time.thread_time() - inicio,
+                          ajuda="CPU do servidor por execução do script ou de um fragmento", secao=secao)
+
+def registrar_saldo(saldo):
+    """Aplica o saldo devolvido pelo débito na sessão e nos caches de perfil."""
+    email = st.session_state.usuario_logado["email"]
+    st.session_state.usuario_logado["credits"] = saldo
+    st.session_state.perfis.atualizar(email, credits=saldo)
+    atualizar_perfil(email, credits=saldo)
+
+@st.fragment(run_every=1.0)
+def acompanhar_job():
+    """Consulta só o status do job em andamento; o resto da página não reexecuta."""
+    job = fila_pericias.obter(st.session_state.job_atual)
+    if job is None:
+        st.session_state.job_atual = None
+        st.rerun()
+
+    if job["status"] not in (CONCLUIDO, ERRO):
+        parcial = job["parcial"]
+        fim_linha = parcial.rfind("\n")
+        if fim_linha > 0:
+            # Uma linha completa por vez, como no streaming direto
+            st.markdown(f"<div class='report-card'>{parcial[:fim_linha]}</div>", unsafe_allow_html=True)
+        else:
+            st.info("🔍 Analisando imagem...")
+        return
+
+    st.session_state.job_atual = None
+    if job["status"] == ERRO:
+        # O worker devolve o crédito reservado no envio; o saldo em cache ficou velho
+        st.session_state.resultado = f"{job['parcial']}\n\n{job['erro']}" if job["parcial"] else job["erro"]
+        email = st.session_state.usuario_logado["email"]
+        st.session_state.perfis.invalidar(email)
+        invalidar_perfil(email)
+    else:
+        st.session_state.resultado = job["resultado"]["relatorio"]
+        localizacao = job["resultado"].get("localizacao")
+        st.session_state.proximos = casos_proximos(
+            localizacao["lat"], localizacao["lon"], excluir=job["resultado"]["sha256"]
+        ) if localizacao else []
+        # O worker já gravou a análise no histórico; a primeira página muda
+        st.session_state.historico_paginas = {}
+    # Rerun completo para o bloco de resultado exibir o laudo
+    st.rerun()
+
+
 # =========================================================
-# TEMA / CORES — REESTRUTURADO PARA CONTRASTE PERFEITO
+# FRAGMENTOS (RERUN PARCIAL)
 # =========================================================
-if st.session_state.tema == "Light":
-    bg = "#FFFFFF"
-    text = "#0F172A"
-    card = "#F8FAFC"
-    border = "#E5E7EB"
-    sub = "#64748B"
-    button_bg = "#EFF6FF"
-    button_text = "#2563EB"
-    button_hover = "#DBEAFE"
-    primary = "#2563EB"
-else:
-    bg = "#0F172A"
-    text = "#F8FAFC"
-    card = "#1E293B"
-    border = "#334155"
-    sub = "#94A3B8"
-    button_bg = "#1E3A8A"
-    button_text = "#BFDBFE"
-    button_hover = "#1D4ED8"
-    primary = "#3B82F6"
+# Upload, análise e compra só reexecutam o próprio fragmento; o restante
+# da página (CSS, cabeçalho, textos estáticos) não é refeito nem reenviado.
+@st.fragment
+def painel_analise():
+    """Upload, análise e laudo do usuário logado."""
+    with medir_render("painel_analise"):
+        file = None
+        db_user = st.session_state.perfis.obter(st.session_state.usuario_logado["email"], get_user_data_cached)
+        if not db_user:
+            st.error("❌ Erro ao carregar seus dados. Faça logout e login novamente.")
+        else:
+            plan = db_user.get("plan", "free")
+            credits = db_user.get("credits", 0)
+            pode_analisar = (plan != "free") or (credits > 0)
+
+            if not pode_analisar:
+                st.error("❌ Sua consulta gratuita já foi utilizada.")
+            else:
+                st.info("🎁 Você possui 1 consulta gratuita disponível.")
+                files = st.file_uploader(
+                    "Arraste suas evidências aqui",
+                    type=["jpg","jpeg","png","webp","heic"],
+                    accept_multiple_files=True,
+                    key=f"upload_file_{st.session_state.uploader_key}"
+                )
+                file = files[0] if len(files) == 1 else None
+
+                if len(files) > 1 and st.button("🔍 EXECUTAR PESQUISA EM LOTE", key="btn_analisar_lote"):
+                    from logic import consumir_creditos, estornar_creditos
+
+                    # Reserva o lote inteiro antes de qualquer análise; o saldo da sessão pode estar velho
+                    saldo = consumir_creditos(len(files))
+                    if saldo is None:
+                        st.error(f"❌ Créditos insuficientes: {len(files)} imagens para {credits} crédito(s).")
+                    else:
+                        registrar_saldo(saldo)
+                        progresso = st.progress(0.0, text=f"🔍 Analisando 0 de {len(files)} imagens...")
+                        status = [st.empty() for _ in files]
+                        for i, arquivo in enumerate(files):
+                            status[i].markdown(f"⏳ {arquivo.name}")
+
+                        resultados = [None] * len(files)
+                        concluidos = 0
+                        try:
+                            for i, resultado in analisar_lote(
+                                files,
+                                st.secrets["GEMINI_API_KEY"],
+                                st.secrets.get("LOTE_CONCORRENCIA", MAX_WORKERS_LOTE)
+                            ):
+                                if isinstance(resultado, dict):
+                                    # Cada análise do lote vai para o histórico, como as da fila
+                                    salvar_pericia(st.session_state.usuario_logado["id"], resultado, files[i].name)
+                                    resultado = resultado["relatorio"]
+                                resultados[i] = resultado
+                                concluidos += 1
+                                icone = "✅" if pericia_bem_sucedida(resultado) else "❌"
+                                status[i].markdown(f"{icone} {files[i].name}")
+                                progresso.progress(concluidos / len(files), text=f"🔍 Analisando {concluidos} de {len(files)} imagens...")
+                        finally:
+                            # Só as análises bem-sucedidas ficam cobradas; as demais voltam ao saldo
+                            sucessos = sum(1 for r in resultados if r is not None and pericia_bem_sucedida(r))
+                            if sucessos < len(files):
+                                saldo_estornado = estornar_creditos(st.session_state.usuario_logado["id"], len(files) - sucessos)
+                                if saldo_estornado is not None:
+                                    registrar_saldo(saldo_estornado)
+
+                        st.session_state.proximos = []
+                        st.session_state.historico_paginas = {}
+                        st.session_state.resultado = f"## 📁 Lote: {sucessos} de {len(files)} imagens analisadas\n\n" + "\n\n---\n\n".join(
+                            f"### {arquivo.name}\n\n{resultado}" for arquivo, resultado in zip(files, resultados)
+                        )
+
+                # Um job por vez: um segundo clique não pode sobrescrever (e órfãzar) o job em andamento
+                if len(files) <= 1 and st.button("🔍 EXECUTAR PESQUISA PROFUNDA", key="btn_analisar",
+                                                 disabled=bool(st.session_state.job_atual)):
+                    if file is None:
+                        st.error("❌ Nenhuma imagem foi fornecida para análise.")
+                    else:
+                        semelhantes = buscar_semelhantes(file)
+                        if semelhantes:
+                            st.info(f"🔁 Esta evidência já foi analisada antes em {len(semelhantes)} versão(ões) recomprimida(s) ou redimensionada(s).")
+                        # A análise roda na fila com o crédito já reservado; o script só guarda o id e acompanha o status
+                        try:
+                            job_id, saldo = enviar_pericia(
+                                file,
+                                st.secrets["GEMINI_API_KEY"],
+                                st.session_state.usuario_logado["id"]
+                            )
+                            if job_id is None:
+                                st.error("❌ Não foi possível reservar um crédito para esta análise. Verifique seu saldo.")
+                            else:
+                                st.session_state.job_atual = job_id
+                                st.session_state.resultado = None
+                                st.session_state.proximos = []
+                                registrar_saldo(saldo)
+                        except Exception as e:
+                            st.error(erro_pericia(e, st.secrets["GEMINI_API_KEY"]))
+
+                if st.session_state.job_atual:
+                    acompanhar_job()
+
+        if file:
+            # Só a miniatura em cache vai ao navegador; o original fica fora da renderização
+            previa = previa_evidencia(file)
+            if previa is not None:
+                st.image(previa, use_container_width=True)
+
+        if st.session_state.resultado:
+            st.markdown(
+                f"<div class='report-card'>{st.session_state.resultado}</div>",
+                unsafe_allow_html=True
+            )
+            if st.session_state.proximos:
+                st.markdown(f"#### 📍 {len(st.session_state.proximos)} caso(s) analisado(s) nas proximidades")
+                for caso in st.session_state.proximos:
+                    origem = "GPS do EXIF" if caso["origem"] == "exif" else "estimativa do modelo"
+                    st.caption(f"• {caso['distancia_km']:.2f} km — evidência {caso['ref'][:12]} ({origem})")
+
+@st.fragment
+def secao_planos(css, cartoes):
+    """Cartões de compra; `css` e `cartoes` são os blocos já montados em estilos.py."""
+    with medir_render("planos"):
+        st.markdown(css, unsafe_allow_html=True)
+
+        cols = st.columns(2)
+        for i, ((nome, _, link, _), cartao) in enumerate(zip(PLANOS, cartoes)):
+            col = cols[i % 2]
+            with col:
+                st.markdown(cartao, unsafe_allow_html=True)
+
+                if st.session_state.usuario_logado:
+                    if st.button(
+                        "Comprar agora",
+                        key=f"comprar_{nome.replace(' ', '_')}",
+                        use_container_width=True,
+                        help="Clique para ser redirecionado ao checkout"
+                    ):
+                        st.markdown(f'<script>window.open("{link}", "_blank");</script>', unsafe_allow_html=True)
+                else:
+                    if st.button(
+                        "Comprar agora",
+                        key=f"login_{nome.replace(' ', '_')}",
+                        use_container_width=True,
+                        help="Faça login para comprar"
+                    ):
+                        st.session_state.pagina = "Acesso"
+                        # Troca de página pede a execução completa, não só a do fragmento
+                        st.rerun()
+
+                st.markdown("</div>", unsafe_allow_html=True)
 
 # =========================================================
-# CSS GLOBAL
+# CSS GLOBAL (UM BLOCO PRONTO POR TEMA)
 # =========================================================
-st.markdown(f"""
-<style>
-.stApp {{
-    background-color: {bg} !important;
-    color: {text} !important;
-}}
-button[kind="secondary"] {{
-    background-color: {button_bg} !important;
-    color: {button_text} !important;
-    border: 1px solid {border} !important;
-    border-radius: 8px !important;
-    padding: 0.4rem 1rem !important;
-    font-weight: 600 !important;
-    font-size: 0.95rem !important;
-    transition: all 0.2s ease !important;
-}}
-button[kind="secondary"]:hover {{
-    background-color: {button_hover} !important;
-    transform: translateY(-1px) !important;
-    box-shadow: 0 2px 6px rgba(0,0,0,0.15) !important;
-}}
-header {{
-    background-color: {bg} !important;
-    color: {text} !important;
-}}
-.hero, .plano-card-3d, .report-card, .pricing-card {{
-    background-color: {card} !important;
-    color: {text} !important;
-    border: 1px solid {border} !important;
-}}
-input, select {{
-    background-color: {card} !important;
-    color: {text} !important;
-    border: 1px solid {border} !important;
-}}
-.stTextInput > label,
-.stPasswordInput > label {{
-    color: {text} !important;
-    font-weight: 600 !important;
-    display: block !important;
-    margin-bottom: 0.5rem !important;
-}}
-div[data-testid="stNotification"] {{
-    color: {text} !important;
-}}
-.hero h1 {{
-    font-size: 2.8rem;
-    font-weight: 800;
-    line-height: 1.2;
-    color: {text} !important;
-}}
-.hero p {{
-    color: {sub} !important;
-    font-size: 1.15rem;
-}}
-</style>
-""", unsafe_allow_html=True)
+_inicio_render = time.thread_time()
+st.markdown(css_global(st.session_state.tema), unsafe_allow_html=True)
 
 # =========================================================
 # JAVASCRIPT PARA CONVERSÃO DE HASH
 # =========================================================
-st.markdown("""
-<script>
-const url = new URL(window.location);
-if (url.hash && url.hash.startsWith('#')) {
-    const hashParams = new URLSearchParams(url.hash.substring(1));
-    for (const [key, value] of hashParams) {
-        url.searchParams.set(key, value);
-    }
-    url.hash = '';
-    window.history.replaceState({}, '', url.toString());
-}
-</script>
-""", unsafe_allow_html=True)
+st.markdown(JS_HASH, unsafe_allow_html=True)
 
 # =========================================================
 # HEADER
@@ -181,28 +356,19 @@ with header_cols[1]:
 
 with header_cols[2]:
     if st.session_state.usuario_logado:
-        col_user, col_logout = st.columns([3, 1])
+        col_user, col_historico, col_logout = st.columns([3, 1, 1])
         with col_user:
             st.markdown(f"<span style='font-size: 1.1rem; font-weight: 500; color: #475569;'>👤 {st.session_state.usuario_logado['name']}</span>", unsafe_allow_html=True)
+        with col_historico:
+            st.button("📂", key="nav_historico", on_click=ir_historico, help="Histórico de análises",
+                     type="secondary",
+                     use_container_width=True)
         with col_logout:
             st.button("🚪", key="nav_logout", on_click=logout, help="Sair da conta", 
                      type="secondary", 
                      use_container_width=True)
     else:
-        st.markdown("""
-        <style>
-        .access-agent-button button {
-            background-color: #235EE6 !important;
-            color: white !important;
-            border: none !important;
-        }
-        .access-agent-button button:hover {
-            background-color: #235EE6 !important;
-            transform: translateY(-1px) !important;
-            box-shadow: 0 2px 6px rgba(0,0,0,0.15) !important;
-        }
-        </style>
-        """, unsafe_allow_html=True)
+        st.markdown(CSS_ACESSO_AGENTE, unsafe_allow_html=True)
         st.markdown('<div class="access-agent-button">', unsafe_allow_html=True)
         st.button(
             "🔑 Acesso Agente",
@@ -225,236 +391,69 @@ st.markdown('<div class="main-content">', unsafe_allow_html=True)
 # HOME
 # =========================================================
 if st.session_state.pagina == "Home":
-    st.markdown("""
-    <div style="text-align: center; padding: 60px 20px; background: linear-gradient(135deg, #f8fafc 0%, #f1f5f9 100%); border-radius: 16px; margin-bottom: 40px;">
-        <h1 style="font-size: 2.8rem; font-weight: 800; color: #0f172a; line-height: 1.2;">Transforme pixels em evidências.</h1>
-        <p style="font-size: 1.2rem; color: #64748b; max-width: 600px; margin: 20px auto;">Análise pericial OSINT com IA multimodal. Geolocalização, busca ativa e laudos estruturados — tudo em segundos.</p>
-    </div>
-    """, unsafe_allow_html=True)
+    st.markdown(HTML_HERO, unsafe_allow_html=True)
 
     if st.session_state.usuario_logado is None:
         st.info("🔑 Faça login para usar sua consulta gratuita.")
+        st.session_state.resultado = None
     else:
-        db_user = get_user_data(st.session_state.usuario_logado["email"])
-        if not db_user:
-            st.error("❌ Erro ao carregar seus dados. Faça logout e login novamente.")
-        else:
-            plan = db_user.get("plan", "free")
-            credits = db_user.get("credits", 0)
-            pode_analisar = (plan != "free") or (credits > 0)
-
-            if not pode_analisar:
-                st.error("❌ Sua consulta gratuita já foi utilizada.")
-            else:
-                st.info("🎁 Você possui 1 consulta gratuita disponível.")
-                file = st.file_uploader(
-                    "Arraste sua evidência aqui",
-                    type=["jpg","jpeg","png","webp","heic"],
-                    key=f"upload_file_{st.session_state.uploader_key}"
-                )
-
-                if st.button("🔍 EXECUTAR PESQUISA PROFUNDA", key="btn_analisar"):
-                    with st.spinner("🔍 Analisando imagem..."):
-                        resultado = executar_pericia(file, st.secrets["GEMINI_API_KEY"])
-                        from logic import consumir_credito, get_user_data
-        
-                        sucesso = consumir_credito(st.session_state.usuario_logado["id"])
-                        if sucesso:
-                            db_user_atualizado = get_user_data(st.session_state.usuario_logado["email"])
-                            if db_user_atualizado:
-                                st.session_state.usuario_logado["credits"] = db_user_atualizado.get("credits", 0)
-                            st.session_state.resultado = resultado
-                        else:
-                            st.warning("⚠️ Análise concluída, mas houve erro ao registrar uso.")
-                            st.session_state.resultado = resultado
-
-    if 'file' in locals() and file:
-        st.image(file, use_container_width=True)
-
-    if st.session_state.resultado:
-        if st.session_state.usuario_logado is None:
-            st.session_state.resultado = None
-        else:
-            st.markdown(
-                f"<div class='report-card'>{st.session_state.resultado}</div>",
-                unsafe_allow_html=True
-            )
+        painel_analise()
 
     st.markdown("## 🔍 Por que usar o VisionScan Pro?")
     cols = st.columns(3)
-
-    with cols[0]:
-        st.markdown("""
-        <div style="padding:20px; background:#f8fafc; border-radius:12px; border-left:4px solid #2563eb; height:100%;">
-            <h3 style="color:#0f172a; font-size:1.2rem; margin-bottom:10px;">🌐 Busca Ativa</h3>
-            <p style="color:#64748b; font-size:0.95rem;">Validação em tempo real. Rastreamento automático em redes sociais, fóruns, marketplaces e mais.</p>
-        </div>
-        """, unsafe_allow_html=True)
-
-    with cols[1]:
-        st.markdown("""
-        <div style="padding:20px; background:#f8fafc; border-radius:12px; border-left:4px solid #10b981; height:100%;">
-            <h3 style="color:#0f172a; font-size:1.2rem; margin-bottom:10px;">📍 Geolocalização</h3>
-            <p style="color:#64748b; font-size:0.95rem;">Análise contextual avançada. Identificação de ruas, placas, vegetação, sombras e clima — até mesmo em fotos desfocadas.</p>
-        </div>
-        """, unsafe_allow_html=True)
-
-    with cols[2]:
-        st.markdown("""
-        <div style="padding:20px; background:#f8fafc; border-radius:12px; border-left:4px solid #8b5cf6; height:100%;">
-            <h3 style="color:#0f172a; font-size:1.2rem; margin-bottom:10px;">🛡️ Rigor Técnico</h3>
-            <p style="color:#64748b; font-size:0.95rem;">Laudos estruturados, com nível de confiança e hipóteses alternativas — prontos para uso em processos legais.</p>
-        </div>
-        """, unsafe_allow_html=True)
+    for col, destaque in zip(cols, HTML_DESTAQUES):
+        with col:
+            st.markdown(destaque, unsafe_allow_html=True)
 
     st.markdown("## 📊 Planos de Investigação")
     st.markdown("Créditos não expiram. Acumulam. Uso sob demanda.")
 
-    planos = [
-        ("10 Consultas", "R$ 29,90", "https://checkout.exemplo/10", "#F59E0B"),
-        ("25 Consultas", "R$ 59,90", "https://checkout.exemplo/25", "#10B981"),
-        ("50 Consultas", "R$ 69,90", "https://checkout.exemplo/50", "#3B82F6"),
-        ("100 Consultas", "R$ 89,90", "https://checkout.exemplo/100", "#8B5CF6"),
-    ]
+    secao_planos(CSS_PLANOS_3D, cartoes_planos_3d())
 
-    st.markdown("""
-    <style>
-    .plano-card-3d {
-        background: white;
-        border-radius: 16px;
-        padding: 24px;
-        position: relative;
-        overflow: hidden;
-        transition: all 0.4s cubic-bezier(0.175, 0.885, 0.32, 1.275);
-        box-shadow: 
-            0 10px 20px rgba(0,0,0,0.08),
-            0 4px 6px rgba(0,0,0,0.05);
-        transform-style: preserve-3d;
-        backface-visibility: hidden;
-    }
-    
-    .plano-card-3d::before {
-        content: '';
-        position: absolute;
-        top: 0;
-        left: 0;
-        right: 0;
-        height: 4px;
-        background: var(--primary-color);
-        transform: scaleX(0);
-        transform-origin: left;
-        transition: transform 0.5s ease;
-    }
-    
-    .plano-card-3d:hover {
-        transform: translateY(-8px) rotateX(2deg);
-        box-shadow: 
-            0 20px 40px rgba(0,0,0,0.15),
-            0 8px 16px rgba(0,0,0,0.1);
-        z-index: 10;
-    }
-    
-    .plano-card-3d:hover::before {
-        transform: scaleX(1);
-    }
-    
-    .plano-card-3d .glow {
-        position: absolute;
-        top: -50%;
-        left: -50%;
-        width: 200%;
-        height: 200%;
-        background: radial-gradient(circle, var(--primary-color)20%, transparent 70%);
-        opacity: 0;
-        transition: opacity 0.4s ease;
-        pointer-events: none;
-        z-index: -1;
-    }
-    
-    .plano-card-3d:hover .glow {
-        opacity: 0.15;
-    }
-    
-    .btn-comprar-plano {
-        display: block;
-        width: 100%;
-        padding: 12px;
-        text-align: center;
-        border-radius: 10px;
-        font-weight: 600;
-        cursor: pointer;
-        transition: all 0.3s ease;
-        border: none;
-        outline: none;
-        margin-top: 16px;
-        font-size: 0.95rem;
-    }
-    
-    .btn-comprar-plano.logado {
-        background: var(--primary-color);
-        color: white;
-    }
-    
-    .btn-comprar-plano.logado:hover {
-        background: var(--primary-color-dark);
-        transform: translateY(-2px);
-        box-shadow: 0 4px 12px rgba(0,0,0,0.15);
-    }
-    
-    .btn-comprar-plano.deslogado {
-        background: #f3f4f6;
-        color: #6b7280;
-        border: 1px solid #d1d5db;
-    }
-    
-    .btn-comprar-plano.deslogado:hover {
-        background: #e5e7eb;
-        transform: translateY(-1px);
-    }
-    </style>
-    """, unsafe_allow_html=True)
-
-    cols = st.columns(2)
-    for i, (nome, preco, link, cor) in enumerate(planos):
-        col = cols[i % 2]
-        with col:
-            st.markdown(f"""
-            <div class="plano-card-3d" style="--primary-color: {cor}; --primary-color-dark: {cor}dd;">
-                <div class="glow"></div>
-                <div style="display:flex; align-items:center; gap:10px; margin-bottom:16px;">
-                    <div style="width:10px; height:10px; background:{cor}; border-radius:50%;"></div>
-                    <h3 style="font-size:1.25rem; font-weight:700; color:#0f172a; margin:0;">{nome}</h3>
-                </div>
-                <div style="font-size:1.8rem; font-weight:800; color:{cor}; margin:16px 0;">{preco}</div>
-                <p style="color:#64748b; font-size:0.9rem; margin-bottom:20px;">Créditos não expiram</p>
-            """, unsafe_allow_html=True)
-
-            if st.session_state.usuario_logado:
-                if st.button(
-                    "Comprar agora",
-                    key=f"comprar_{nome.replace(' ', '_')}",
-                    use_container_width=True,
-                    help="Clique para ser redirecionado ao checkout"
-                ):
-                    st.markdown(f'<script>window.open("{link}", "_blank");</script>', unsafe_allow_html=True)
-            else:
-                if st.button(
-                    "Comprar agora",
-                    key=f"login_{nome.replace(' ', '_')}",
-                    use_container_width=True,
-                    help="Faça login para comprar"
-                ):
-                    st.session_state.pagina = "Acesso"
+    st.markdown("---")
+    st.markdown(HTML_RODAPE, unsafe_allow_html=True)
 
-            st.markdown("</div>", unsafe_allow_html=True)
 
-    st.markdown("---")
-    st.markdown("""
-    <div style="text-align:center; padding:30px; background:#f8fafc; border-radius:16px; margin-top:40px;">
-        <h3 style="color:#0f172a; font-size:1.4rem; margin-bottom:10px;">✅ Já utilizado por mais de 500 agentes de investigação</h3>
-        <p style="color:#64748b; font-size:1rem;">Tecnologia confiável, resultados precisos e laudos admissíveis em tribunal.</p>
-    </div>
-    """, unsafe_allow_html=True)
+# =========================================================
+# HISTÓRICO
+# =========================================================
+elif st.session_state.pagina == "Historico":
+    st.button("⬅️ Voltar", key="voltar_home_historico", on_click=ir_home)
+    st.markdown("## 📂 Histórico de análises")
+
+    if st.session_state.usuario_logado is None:
+        st.info("🔑 Faça login para ver seu histórico.")
+    else:
+        user_id = st.session_state.usuario_logado["id"]
+        cursor = st.session_state.historico_cursores[-1]
+        # Cada página é buscada uma vez por visita; reruns (ex.: abrir um laudo) não repetem a consulta
+        pagina = st.session_state.historico_paginas.get(cursor)
+        if pagina is None:
+            pagina = st.session_state.historico_paginas[cursor] = listar_historico(user_id, cursor)
+        itens, proximo = pagina
+
+        if not itens:
+            st.info("Nenhuma análise registrada ainda.")
+        for item in itens:
+            with st.container(border=True):
+                data = item["created_at"][:16].replace("T", " ")
+                st.markdown(f"**{item['nome_arquivo'] or item['sha256'][:12]}** · {data} · {item['modelo'] or '-'}")
+                st.caption(item["resumo"] or "")
+
+                # Laudo completo só quando o usuário pede
+                laudo = st.session_state.historico_laudos.get(item["id"])
+                if laudo is None and st.button("📄 Abrir laudo", key=f"historico_{item['id']}"):
+                    laudo = st.session_state.historico_laudos[item["id"]] = obter_laudo_historico(user_id, item["id"])
+                if laudo:
+                    st.markdown(f"<div class='report-card'>{laudo['relatorio']}</div>", unsafe_allow_html=True)
+
+        col_anterior, col_proxima = st.columns(2)
+        with col_anterior:
+            if len(st.session_state.historico_cursores) > 1:
+                st.button("⬅️ Mais recentes", key="historico_anterior", on_click=historico_voltar)
+        with col_proxima:
+            if proximo:
+                st.button("Mais antigas ➡️", key="historico_proxima", on_click=historico_avancar, args=(proximo,))
 
 # =========================================================
 # PLANOS
@@ -467,110 +466,16 @@ elif st.session_state.pagina == "Planos":
     - Uso sob demanda  
     """)
 
-    planos = [
-        ("10 Consultas", "R$ 29,90", "https://checkout.exemplo/10", "#F59E0B"),
-        ("25 Consultas", "R$ 59,90", "https://checkout.exemplo/25", "#10B981"),
-        ("50 Consultas", "R$ 69,90", "https://checkout.exemplo/50", "#3B82F6"),
-        ("100 Consultas", "R$ 89,90", "https://checkout.exemplo/100", "#8B5CF6"),
-    ]
-
-    st.markdown("""
-    <style>
-    .plano-card {
-        background: white;
-        border-radius: 16px;
-        padding: 20px;
-        box-shadow: 0 4px 12px rgba(0,0,0,0.05);
-        transition: transform 0.2s ease, box-shadow 0.2s ease;
-        margin-bottom: 20px;
-        border: 2px solid transparent;
-    }
-    .plano-card:hover {
-        transform: translateY(-4px);
-        box-shadow: 0 8px 20px rgba(0,0,0,0.1);
-        border-color: var(--primary-color);
-    }
-    .plano-title {
-        font-size: 1.4rem;
-        font-weight: 700;
-        color: #1e293b;
-        margin-bottom: 8px;
-    }
-    .plano-preco {
-        font-size: 1.6rem;
-        font-weight: 800;
-        color: var(--primary-color);
-        margin: 12px 0;
-    }
-    .btn-comprar {
-        display: block;
-        width: 100%;
-        padding: 12px;
-        text-align: center;
-        border-radius: 8px;
-        font-weight: 600;
-        cursor: pointer;
-        transition: background-color 0.2s ease, transform 0.1s ease;
-        border: none;
-        outline: none;
-    }
-    .btn-comprar:hover {
-        transform: scale(1.02);
-    }
-    .btn-comprar.deslogado {
-        background: #f3f4f6;
-        color: #6b7280;
-        border: 1px solid #d1d5db;
-    }
-    .btn-comprar.deslogado:hover {
-        background: #e5e7eb;
-    }
-    .btn-comprar.logado {
-        background: var(--primary-color);
-        color: white;
-    }
-    .btn-comprar.logado:hover {
-        background: var(--primary-color-dark);
-    }
-    </style>
-    """, unsafe_allow_html=True)
-
     if not st.session_state.usuario_logado:
         st.info("🔒 Faça login para comprar créditos e acessar planos premium.")
         st.markdown("---")
 
-    cols = st.columns(2)
-    for i, (nome, preco, link, cor) in enumerate(planos):
-        col = cols[i % 2]
-        with col:
-            st.markdown(f"""
-            <div class="plano-card" style="--primary-color: {cor}; --primary-color-dark: {cor}dd;">
-                <div class="plano-title">🎟️ {nome}</div>
-                <div class="plano-preco">{preco}</div>
-            """, unsafe_allow_html=True)
-
-            if st.session_state.usuario_logado:
-                if st.button(
-                    "Comprar agora",
-                    key=f"comprar_{nome.replace(' ', '_')}",
-                    use_container_width=True,
-                    help="Clique para ser redirecionado ao checkout"
-                ):
-                    st.markdown(f'<script>window.open("{link}", "_blank");</script>', unsafe_allow_html=True)
-            else:
-                if st.button(
-                    "Comprar agora",
-                    key=f"login_{nome.replace(' ', '_')}",
-                    use_container_width=True,
-                    help="Faça login para comprar"
-                ):
-                    st.session_state.pagina = "Acesso"
-
-            st.markdown("</div>", unsafe_allow_html=True)
+    secao_planos(CSS_PLANOS, cartoes_planos())
 
     st.markdown("---")
     st.button("⬅️ Voltar", key="voltar_home", on_click=ir_home)
 
+
 # =========================================================
 # LOGIN / CADASTRO 
 # =========================================================
@@ -601,34 +506,19 @@ elif st.session_state.pagina == "Acesso":
 
         if st.button("Entrar", key="btn_login_manual"):
             try:
-                from logic import supabase
-                res = supabase.auth.sign_in_with_password({
-                    "email": email,
-                    "password": senha
-                })
-                
-                if not getattr(res.user, 'email_confirmed_at', None):
+                db_user = entrar_com_perfil(email, senha)
+
+                if db_user == "not_confirmed":
                     st.warning("⚠️ E-mail não confirmado. Verifique sua caixa de entrada.")
                     st.stop()
-                    
-                db_user = get_user_data(res.user.email)
-                
-                if not db_user:
-                    name = res.user.user_metadata.get("name") if res.user.user_metadata else res.user.email.split("@")[0]
-                    supabase.table("users").insert({
-                        "id": res.user.id,
-                        "email": res.user.email,
-                        "name": name,
-                        "plan": "free",
-                        "credits": 1
-                    }).execute()
-                    db_user = get_user_data(res.user.email)
-                
+
                 if db_user:
+                    # O perfil veio do banco agora: a sessão parte dele sem reler
+                    st.session_state.perfis.gravar(db_user["email"], db_user)
                     st.session_state.usuario_logado = {
                         "id": db_user["id"],
                         "email": db_user["email"],
-                        "name": db_user.get("name", res.user.email.split("@")[0]),
+                        "name": db_user.get("name") or db_user["email"].split("@")[0],
                         "plan": db_user.get("plan", "free"),
                         "credits": db_user.get("credits", 0)
                     }
@@ -636,7 +526,7 @@ elif st.session_state.pagina == "Acesso":
                     st.rerun()
                 else:
                     st.error("Erro ao carregar dados do usuário.")
-                    
+
             except Exception as auth_error:
                 error_msg = str(auth_error).lower()
                 if "invalid credentials" in error_msg or "user not found" in error_msg:
@@ -679,3 +569,7 @@ elif st.session_state.pagina == "Acesso":
             window.open("mailto:suporte@visionscanpro.com?subject=Recuperação%20de%20Senha%20-%20VisionScan%20Pro&body=Olá%2C%0D%0A%0D%0APreciso%20recuperar%20minha%20senha%20para%20acessar%20o%20VisionScan%20Pro.%0D%0A%0D%0ADados%20para%20verificação%3A%0D%0A%E2%80%A2%20E-mail%20cadastrado%3A%20%0D%0A%E2%80%A2%20Nome%20completo%3A%20%0D%0A%0D%0AObrigado!", "_blank");
             </script>
             ''', unsafe_allow_html=True)
+
+# Só execuções completas chegam aqui (st.rerun/st.stop interrompem antes)
+metricas.observar("visionscan_render_cpu_segundos", time.thread_time() - _inicio_render,
+                  ajuda="CPU do servidor por execução do script ou de um fragmento", secao="pagina")
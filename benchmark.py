@@ -0,0 +1,332 @@
+"""
+Micro-benchmark por etapa do executar_pericia, com genai e Supabase falsos.
+
+Uso:
+    python benchmark.py -o bench.json
+    python benchmark.py --rapido --comparar bench_base.json
+
+Gera um corpus sintético (1–50 MP; JPEG/PNG/WebP; com e sem EXIF/GPS),
+mede cada etapa isoladamente e grava p50/p95, pico de RSS e pico de
+alocações Python em JSON, para comparar commits.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import PIL.Image
+
+import pericia
+from geoindice import IndiceGeografico
+from hash_perceptual import IndiceHamming, phash_bytes
+
+TAMANHOS_MP = [1, 12, 24, 50]
+TAMANHOS_MP_RAPIDO = [1, 12]
+FORMATOS = ["JPEG", "PNG", "WEBP"]
+API_KEY_FALSA = "bench"
+
+
+# =========================================================
+# DUBLÊS (genai / Supabase)
+# =========================================================
+class _Modelo:
+    def __init__(self, name):
+        self.name = name
+        self.supported_generation_methods = ["generateContent"]
+
+
+class _Resposta:
+    text = "## 1. CONCLUSÃO TÉCNICA\nLaudo sintético de benchmark.\n"
+    usage_metadata = None
+
+
+class _GenerativeModelFalso:
+    def __init__(self, model_name=None, **kwargs):
+        self.model_name = model_name
+
+    def generate_content(self, conteudo, stream=False, **kwargs):
+        # Força a serialização que o SDK faria da parte de imagem
+        for parte in conteudo:
+            if isinstance(parte, PIL.Image.Image):
+                parte.save(io.BytesIO(), format="JPEG")
+        return [_Resposta()] if stream else _Resposta()
+
+
+class GenaiFalso:
+    GenerativeModel = _GenerativeModelFalso
+
+    def configure(self, **kwargs):
+        pass
+
+    def list_models(self):
+        return [_Modelo("models/gemini-1.5-flash"), _Modelo("models/gemini-1.5-pro")]
+
+
+class _ConsultaFalsa:
+    def __init__(self, dados):
+        self._dados = dados
+
+    def __getattr__(self, _nome):
+        return lambda *a, **k: self
+
+    def execute(self):
+        return type("Resposta", (), {"data": self._dados})()
+
+
+class SupabaseFalso:
+    def __init__(self):
+        self.credits = 10 ** 9
+
+    def rpc(self, _nome, params):
+        self.credits -= params["p_quantidade"]
+        return _ConsultaFalsa(self.credits)
+
+    def table(self, _nome):
+        return _ConsultaFalsa([{"id": "0", "email": "bench@x", "name": "b", "plan": "free", "credits": self.credits}])
+
+
+class _CacheNulo:
+    def obter(self, chave):
+        return None
+
+    def gravar(self, chave, relatorio):
+        pass
+
+
+# =========================================================
+# CORPUS SINTÉTICO
+# =========================================================
+def _exif_com_gps():
+    exif = PIL.Image.Exif()
+    exif[0x010F] = "BenchCam"  # Make
+    exif[0x0110] = "Modelo 1"  # Model
+    exif[0x0132] = "2024:05:01 12:00:00"  # DateTime
+    gps = exif.get_ifd(0x8825)
+    gps[1] = "S"
+    gps[2] = (23.0, 33.0, 1.0)
+    gps[3] = "W"
+    gps[4] = (46.0, 38.0, 2.0)
+    return exif
+
+
+def gerar_imagem(megapixels: int, formato: str, com_exif: bool) -> bytes:
+    largura = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    altura = int(largura * 3 / 4)
+    # Gradiente + ruído leve: comprime como foto, não como cor sólida
+    x = np.linspace(0, 255, largura, dtype=np.float32)
+    y = np.linspace(0, 255, altura, dtype=np.float32)[:, None]
+    ruido = np.random.default_rng(megapixels).integers(0, 24, (altura, largura), dtype=np.uint8)
+    r = (x[None, :] * 0.7 + ruido).astype(np.uint8)
+    g = (y * 0.7 + ruido).astype(np.uint8)
+    b = ((x[None, :] + y) * 0.35).astype(np.uint8)
+    img = PIL.Image.fromarray(np.dstack([r, g, b]))
+
+    saida = io.BytesIO()
+    opcoes = {"exif": _exif_com_gps()} if com_exif else {}
+    if formato == "PNG":
+        opcoes["compress_level"] = 1
+    else:
+        opcoes["quality"] = 90
+    img.save(saida, format=formato, **opcoes)
+    return saida.getvalue()
+
+
+def gerar_corpus(tamanhos):
+    for mp in tamanhos:
+        for formato in FORMATOS:
+            for com_exif in (False, True):
+                nome = f"{mp}MP-{formato}{'-exif' if com_exif else ''}"
+                yield nome, gerar_imagem(mp, formato, com_exif)
+
+
+# =========================================================
+# ETAPAS
+# =========================================================
+def _abrir(conteudo):
+    return PIL.Image.open(io.BytesIO(conteudo))
+
+
+def _carregado(conteudo):
+    img = _abrir(conteudo)
+    img.load()
+    return img
+
+
+def _rgb(conteudo):
+    img = _carregado(conteudo)
+    return img if img.mode == "RGB" else img.convert("RGB")
+
+
+def _redimensionar(img):
+    pixels = img.width * img.height
+    if pixels <= pericia.MAX_PIXELS:
+        return img
+    ratio = (pericia.MAX_PIXELS / pixels) ** 0.5
+    return img.resize((int(img.width * ratio), int(img.height * ratio)), PIL.Image.LANCZOS)
+
+
+# (nome, preparo fora da medição, etapa medida)
+ETAPAS = [
+    ("abertura_cabecalho", lambda c: c, _abrir),
+    ("exif", lambda c: c, pericia._extrair_exif),
+    ("exif_pil", _abrir, lambda img: (img.getexif(), img.getexif().get_ifd(0x8825))),
+    ("decode", _abrir, lambda img: img.load()),
+    ("conversao_rgb", _carregado, lambda img: img.convert("RGB")),
+    ("resize_lanczos", _rgb, _redimensionar),
+    ("codificacao_payload", lambda c: _redimensionar(_rgb(c)), pericia.codificar_imagem),
+    ("preparo_imagem", lambda c: c, lambda c: pericia._preparar_imagem(_abrir(c), c)),
+    ("hash_perceptual", lambda c: c, phash_bytes),
+    ("selecao_modelo", lambda c: None, lambda _: pericia.catalogo_modelos.escolher(API_KEY_FALSA)),
+    ("pipeline_completo", lambda c: c, lambda c: pericia.analisar_evidencia(io.BytesIO(c), API_KEY_FALSA)),
+]
+
+
+def _zerar_pico_rss():
+    # Linux: "5" em clear_refs zera o VmHWM do processo
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _pico_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for linha in f:
+                if linha.startswith("VmHWM:"):
+                    return int(linha.split()[1]) / 1024
+    except OSError:
+        pass
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024) if sys.platform == "darwin" else maxrss / 1024
+
+
+def medir(preparar, etapa, conteudo, repeticoes):
+    tempos = []
+    pico_rss = 0.0
+    for _ in range(repeticoes):
+        estado = preparar(conteudo)
+        _zerar_pico_rss()
+        inicio = time.perf_counter()
+        etapa(estado)
+        tempos.append((time.perf_counter() - inicio) * 1000)
+        pico_rss = max(pico_rss, _pico_rss_mb())
+        del estado
+
+    # tracemalloc distorce o tempo; as alocações são medidas numa rodada à parte
+    estado = preparar(conteudo)
+    tracemalloc.start()
+    etapa(estado)
+    pico_py = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    tempos.sort()
+    return {
+        "n": repeticoes,
+        "p50_ms": round(statistics.median(tempos), 3),
+        "p95_ms": round(tempos[min(len(tempos) - 1, int(len(tempos) * 0.95))], 3),
+        "rss_pico_mb": round(pico_rss, 1),
+        "py_alocado_pico_kb": round(pico_py / 1024, 1)
+    }
+
+
+def instalar_dubles():
+    pericia.genai = GenaiFalso()
+    pericia.cache_resultados = _CacheNulo()
+    pericia.indice_perceptual = IndiceHamming(arquivo=None)
+    pericia.indice_geografico = IndiceGeografico(arquivo=None)
+    pericia.catalogo_modelos.invalidar()
+    pericia.pool_modelos.invalidar()
+
+
+def medir_debito(repeticoes):
+    """Débito de crédito com Supabase falso (requer streamlit instalado para importar logic)."""
+    try:
+        import logic
+    except ImportError:
+        return None
+    falso = SupabaseFalso()
+    logic.cliente_sessao = lambda: falso
+    return medir(lambda c: None, lambda _: logic.consumir_credito(), None, repeticoes)
+
+
+def _commit_atual():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def comparar(atual, base_caminho):
+    with open(base_caminho, encoding="utf-8") as f:
+        base = {(r["imagem"], r["etapa"]): r for r in json.load(f)["resultados"]}
+    print(f"{'imagem':<18} {'etapa':<20} {'p50 base':>10} {'p50 atual':>10} {'razão':>7}")
+    for r in atual["resultados"]:
+        anterior = base.get((r["imagem"], r["etapa"]))
+        if not anterior or not anterior["p50_ms"]:
+            continue
+        razao = r["p50_ms"] / anterior["p50_ms"]
+        alerta = " ⚠️" if razao > 1.1 else ""
+        print(f"{r['imagem']:<18} {r['etapa']:<20} {anterior['p50_ms']:>10.2f} {r['p50_ms']:>10.2f} {razao:>7.2f}{alerta}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark por etapa do executar_pericia")
+    parser.add_argument("-o", "--saida", help="arquivo JSON de resultados (padrão: stdout)")
+    parser.add_argument("-n", "--repeticoes", type=int, default=5)
+    parser.add_argument("--rapido", action="store_true", help="só imagens de 1 e 12 MP")
+    parser.add_argument("--etapa", action="append", help="medir só as etapas informadas")
+    parser.add_argument("--comparar", help="JSON de uma execução anterior para comparação")
+    args = parser.parse_args(argv)
+
+    instalar_dubles()
+    etapas = [e for e in ETAPAS if not args.etapa or e[0] in args.etapa]
+
+    resultados = []
+    # Logs do pipeline vão para stderr para não misturar com o JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        for nome, conteudo in gerar_corpus(TAMANHOS_MP_RAPIDO if args.rapido else TAMANHOS_MP):
+            for etapa, preparar, executar in etapas:
+                r = medir(preparar, executar, conteudo, args.repeticoes)
+                resultados.append({"imagem": nome, "bytes": len(conteudo), "etapa": etapa, **r})
+                print(f"{nome:<18} {etapa:<20} p50={r['p50_ms']:>9.2f} ms  p95={r['p95_ms']:>9.2f} ms")
+
+        if not args.etapa or "debito_credito" in args.etapa:
+            r = medir_debito(args.repeticoes)
+            if r:
+                resultados.append({"imagem": "-", "bytes": 0, "etapa": "debito_credito", **r})
+
+    relatorio = {
+        "commit": _commit_atual(),
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "rss_pico_por_etapa": _zerar_pico_rss(),
+        "resultados": resultados
+    }
+    texto = json.dumps(relatorio, ensure_ascii=False, indent=2)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            f.write(texto)
+    else:
+        print(texto)
+
+    if args.comparar:
+        comparar(relatorio, args.comparar)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+
+from metricas import metricas
+
+log = logging.getLogger(__name__)
+
+# =========================================================
+# CACHE DE RESULTADOS (ENDEREÇADO POR CONTEÚDO)
+# =========================================================
+DIRETORIO_PADRAO = os.path.join(tempfile.gettempdir(), "visionscan_cache", "resultados")
+
+
+class CacheResultados:
+    """
+    Cache de laudos em duas camadas: LRU em memória (limitado por entradas)
+    e disco (limitado por bytes, entradas comprimidas com zlib).
+    A chave combina o hash da imagem, a versão do prompt e o modelo.
+    """
+
+    def __init__(self, diretorio: str = DIRETORIO_PADRAO, max_memoria: int = 256,
+                 max_bytes_disco: int = 256 * 1024 * 1024):
+        self.diretorio = diretorio
+        self.max_memoria = max_memoria
+        self.max_bytes_disco = max_bytes_disco
+        self._memoria = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits_memoria = 0
+        self.hits_disco = 0
+        self.misses = 0
+        self.gravacoes = 0
+
+        os.makedirs(self.diretorio, exist_ok=True)
+        self._bytes_disco = sum(tamanho for _, tamanho, _ in self._listar_disco())
+
+    @staticmethod
+    def chave(conteudo: bytes, versao_prompt: str, modelo: str) -> str:
+        h = hashlib.sha256(conteudo)
+        h.update(b"\0" + versao_prompt.encode() + b"\0" + modelo.encode())
+        return h.hexdigest()
+
+    def _caminho(self, chave: str) -> str:
+        return os.path.join(self.diretorio, chave[:2], f"{chave}.z")
+
+    def _listar_disco(self):
+        for raiz, _, arquivos in os.walk(self.diretorio):
+            for nome in arquivos:
+                if not nome.endswith(".z"):
+                    continue
+                caminho = os.path.join(raiz, nome)
+                try:
+                    info = os.stat(caminho)
+                except OSError:
+                    continue
+                yield caminho, info.st_size, info.st_mtime
+
+    def _lembrar(self, chave: str, relatorio: str):
+        self._memoria[chave] = relatorio
+        self._memoria.move_to_end(chave)
+        while len(self._memoria) > self.max_memoria:
+            self._memoria.popitem(last=False)
+
+    def obter(self, chave: str) -> str | None:
+        """Retorna o laudo em cache ou None."""
+        with self._lock:
+            relatorio = self._memoria.get(chave)
+            if relatorio is not None:
+                self._memoria.move_to_end(chave)
+                self.hits_memoria += 1
+                return relatorio
+
+        caminho = self._caminho(chave)
+        try:
+            with open(caminho, "rb") as f:
+                relatorio = zlib.decompress(f.read()).decode("utf-8")
+            # Atualiza o mtime para a evicção do disco seguir a ordem de uso
+            os.utime(caminho)
+        except (OSError, zlib.error, UnicodeDecodeError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits_disco += 1
+            self._lembrar(chave, relatorio)
+        return relatorio
+
+    def gravar(self, chave: str, relatorio: str):
+        """Grava o laudo nas duas camadas."""
+        with self._lock:
+            self._lembrar(chave, relatorio)
+            self.gravacoes += 1
+
+        dados = zlib.compress(relatorio.encode("utf-8"), 6)
+        caminho = self._caminho(chave)
+        try:
+            os.makedirs(os.path.dirname(caminho), exist_ok=True)
+            anterior = os.path.getsize(caminho) if os.path.exists(caminho) else 0
+            # Escrita atômica: arquivo temporário + rename
+            fd, temporario = tempfile.mkstemp(dir=os.path.dirname(caminho), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(dados)
+            os.replace(temporario, caminho)
+        except OSError as e:
+            metricas.contar("visionscan_falhas_total", ajuda="Erros tratados sem interromper o fluxo, por etapa",
+                            etapa="cache_disco")
+            log.warning("Falha ao gravar cache em disco: %s", e)
+            return
+
+        with self._lock:
+            self._bytes_disco += len(dados) - anterior
+            excedeu = self._bytes_disco > self.max_bytes_disco
+        if excedeu:
+            self._podar_disco()
+
+    def _podar_disco(self):
+        # Remove as entradas menos usadas até voltar a 90% do limite
+        entradas = sorted(self._listar_disco(), key=lambda e: e[2])
+        total = sum(tamanho for _, tamanho, _ in entradas)
+        alvo = int(self.max_bytes_disco * 0.9)
+        for caminho, tamanho, _ in entradas:
+            if total <= alvo:
+                break
+            try:
+                os.remove(caminho)
+                total -= tamanho
+            except OSError:
+                pass
+        with self._lock:
+            self._bytes_disco = total
+
+    def invalidar(self):
+        """Esvazia as duas camadas."""
+        with self._lock:
+            self._memoria.clear()
+        for caminho, _, _ in list(self._listar_disco()):
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass
+        with self._lock:
+            self._bytes_disco = 0
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            hits = self.hits_memoria + self.hits_disco
+            consultas = hits + self.misses
+            return {
+                "hits_memoria": self.hits_memoria,
+                "hits_disco": self.hits_disco,
+                "misses": self.misses,
+                "gravacoes": self.gravacoes,
+                "taxa_acerto": hits / consultas if consultas else 0.0,
+                "entradas_memoria": len(self._memoria),
+                "bytes_disco": self._bytes_disco
+            }
@@ -0,0 +1,124 @@
+"""
+Perícia em lote pela linha de comando, sem Streamlit.
+
+Uso:
+    python cli.py evidencias/ -o laudos.jsonl -w 8
+    python cli.py manifesto.txt -o laudos.jsonl
+
+A entrada é um diretório (varrido recursivamente) ou um manifesto com um
+caminho por linha. Cada imagem gera um registro JSON Lines gravado assim que
+termina; ao rodar de novo com a mesma saída, imagens cujo sha256 já tem
+registro bem-sucedido são puladas.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from ingestao import abrir_evidencia
+from metricas import metricas
+from pericia import MAX_WORKERS_LOTE, analisar_evidencia
+
+EXTENSOES = {".jpg", ".jpeg", ".png", ".webp", ".heic"}
+
+
+def listar_imagens(entrada: str):
+    """Caminhos de imagem de um diretório (recursivo) ou de um manifesto."""
+    if os.path.isdir(entrada):
+        for raiz, _, arquivos in os.walk(entrada):
+            for nome in sorted(arquivos):
+                if os.path.splitext(nome)[1].lower() in EXTENSOES:
+                    yield os.path.join(raiz, nome)
+        return
+
+    base = os.path.dirname(os.path.abspath(entrada))
+    with open(entrada, encoding="utf-8") as f:
+        for linha in f:
+            caminho = linha.strip()
+            if caminho and not caminho.startswith("#"):
+                yield caminho if os.path.isabs(caminho) else os.path.join(base, caminho)
+
+
+def hashes_concluidos(saida: str) -> set:
+    """sha256 das imagens que já têm registro bem-sucedido na saída."""
+    concluidos = set()
+    if not os.path.exists(saida):
+        return concluidos
+    with open(saida, encoding="utf-8") as f:
+        for linha in f:
+            try:
+                registro = json.loads(linha)
+            except ValueError:
+                # Última linha truncada por uma interrupção
+                continue
+            if registro.get("status") == "ok" and registro.get("sha256"):
+                concluidos.add(registro["sha256"])
+    return concluidos
+
+
+def _processar(caminho: str, api_key: str, concluidos: set):
+    inicio = time.perf_counter()
+    try:
+        with open(caminho, "rb") as f:
+            # mmap do arquivo: nem o hash de retomada nem a perícia copiam o conteúdo
+            with abrir_evidencia(f) as conteudo:
+                if hashlib.sha256(conteudo).hexdigest() in concluidos:
+                    return None
+            resultado = analisar_evidencia(f, api_key)
+        return {"arquivo": caminho, "status": "ok", **resultado}
+    except Exception as e:
+        return {
+            "arquivo": caminho,
+            "status": "erro",
+            "erro": str(e),
+            "tempos": {"total_s": round(time.perf_counter() - inicio, 4)}
+        }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="VisionScan Pro — perícia OSINT em lote")
+    parser.add_argument("entrada", help="diretório de evidências ou manifesto (um caminho por linha)")
+    parser.add_argument("-o", "--saida", default="laudos.jsonl", help="arquivo JSON Lines de saída")
+    parser.add_argument("-w", "--workers", type=int, default=MAX_WORKERS_LOTE, help="análises simultâneas")
+    parser.add_argument("--metricas", help="grava as métricas em texto Prometheus neste arquivo ao final")
+    parser.add_argument("--api-key", default=os.environ.get("GEMINI_API_KEY"),
+                        help="chave do Gemini (padrão: $GEMINI_API_KEY)")
+    args = parser.parse_args(argv)
+
+    if not args.api_key:
+        parser.error("informe --api-key ou defina GEMINI_API_KEY")
+
+    concluidos = hashes_concluidos(args.saida)
+    caminhos = list(listar_imagens(args.entrada))
+    print(f"🔍 {len(caminhos)} imagens, {len(concluidos)} já concluídas em {args.saida}", file=sys.stderr)
+
+    feitos = pulados = erros = 0
+    with open(args.saida, "a", encoding="utf-8") as saida, \
+            ThreadPoolExecutor(max_workers=max(1, args.workers), thread_name_prefix="pericia-cli") as pool:
+        futuros = [pool.submit(_processar, c, args.api_key, concluidos) for c in caminhos]
+        for futuro in as_completed(futuros):
+            registro = futuro.result()
+            if registro is None:
+                pulados += 1
+                continue
+            # Só a thread principal escreve; flush a cada registro para sobreviver a interrupções
+            saida.write(json.dumps(registro, ensure_ascii=False) + "\n")
+            saida.flush()
+            if registro["status"] == "ok":
+                feitos += 1
+            else:
+                erros += 1
+                print(f"❌ {registro['arquivo']}: {registro['erro']}", file=sys.stderr)
+            print(f"   {feitos + erros + pulados}/{len(caminhos)}", file=sys.stderr)
+
+    print(f"✅ {feitos} analisadas, {pulados} puladas, {erros} com erro", file=sys.stderr)
+    if args.metricas:
+        metricas.gravar_prometheus(args.metricas)
+    return 1 if erros else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,354 @@
+import functools
+
+# =========================================================
+# HTML/CSS ESTÁTICO DA INTERFACE
+# =========================================================
+# Montado uma vez por processo (o CSS global, uma vez por tema): os reruns
+# do Streamlit reenviam strings prontas em vez de refazer f-strings grandes.
+TEMAS = {
+    "Light": {
+        "bg": "#FFFFFF",
+        "text": "#0F172A",
+        "card": "#F8FAFC",
+        "border": "#E5E7EB",
+        "sub": "#64748B",
+        "button_bg": "#EFF6FF",
+        "button_text": "#2563EB",
+        "button_hover": "#DBEAFE",
+        "primary": "#2563EB"
+    },
+    "Dark": {
+        "bg": "#0F172A",
+        "text": "#F8FAFC",
+        "card": "#1E293B",
+        "border": "#334155",
+        "sub": "#94A3B8",
+        "button_bg": "#1E3A8A",
+        "button_text": "#BFDBFE",
+        "button_hover": "#1D4ED8",
+        "primary": "#3B82F6"
+    }
+}
+
+PLANOS = [
+    ("10 Consultas", "R$ 29,90", "https://checkout.exemplo/10", "#F59E0B"),
+    ("25 Consultas", "R$ 59,90", "https://checkout.exemplo/25", "#10B981"),
+    ("50 Consultas", "R$ 69,90", "https://checkout.exemplo/50", "#3B82F6"),
+    ("100 Consultas", "R$ 89,90", "https://checkout.exemplo/100", "#8B5CF6"),
+]
+
+# Modelo do CSS global; as chaves vêm de TEMAS
+_CSS_GLOBAL = """
+<style>
+.stApp {{
+    background-color: {bg} !important;
+    color: {text} !important;
+}}
+button[kind="secondary"] {{
+    background-color: {button_bg} !important;
+    color: {button_text} !important;
+    border: 1px solid {border} !important;
+    border-radius: 8px !important;
+    padding: 0.4rem 1rem !important;
+    font-weight: 600 !important;
+    font-size: 0.95rem !important;
+    transition: all 0.2s ease !important;
+}}
+button[kind="secondary"]:hover {{
+    background-color: {button_hover} !important;
+    transform: translateY(-1px) !important;
+    box-shadow: 0 2px 6px rgba(0,0,0,0.15) !important;
+}}
+header {{
+    background-color: {bg} !important;
+    color: {text} !important;
+}}
+.hero, .plano-card-3d, .report-card, .pricing-card {{
+    background-color: {card} !important;
+    color: {text} !important;
+    border: 1px solid {border} !important;
+}}
+input, select {{
+    background-color: {card} !important;
+    color: {text} !important;
+    border: 1px solid {border} !important;
+}}
+.stTextInput > label,
+.stPasswordInput > label {{
+    color: {text} !important;
+    font-weight: 600 !important;
+    display: block !important;
+    margin-bottom: 0.5rem !important;
+}}
+div[data-testid="stNotification"] {{
+    color: {text} !important;
+}}
+.hero h1 {{
+    font-size: 2.8rem;
+    font-weight: 800;
+    line-height: 1.2;
+    color: {text} !important;
+}}
+.hero p {{
+    color: {sub} !important;
+    font-size: 1.15rem;
+}}
+</style>
+"""
+
+JS_HASH = """
+<script>
+const url = new URL(window.location);
+if (url.hash && url.hash.startsWith('#')) {
+    const hashParams = new URLSearchParams(url.hash.substring(1));
+    for (const [key, value] of hashParams) {
+        url.searchParams.set(key, value);
+    }
+    url.hash = '';
+    window.history.replaceState({}, '', url.toString());
+}
+</script>
+"""
+
+CSS_ACESSO_AGENTE = """
+<style>
+.access-agent-button button {
+    background-color: #235EE6 !important;
+    color: white !important;
+    border: none !important;
+}
+.access-agent-button button:hover {
+    background-color: #235EE6 !important;
+    transform: translateY(-1px) !important;
+    box-shadow: 0 2px 6px rgba(0,0,0,0.15) !important;
+}
+</style>
+"""
+
+HTML_HERO = """
+<div style="text-align: center; padding: 60px 20px; background: linear-gradient(135deg, #f8fafc 0%, #f1f5f9 100%); border-radius: 16px; margin-bottom: 40px;">
+    <h1 style="font-size: 2.8rem; font-weight: 800; color: #0f172a; line-height: 1.2;">Transforme pixels em evidências.</h1>
+    <p style="font-size: 1.2rem; color: #64748b; max-width: 600px; margin: 20px auto;">Análise pericial OSINT com IA multimodal. Geolocalização, busca ativa e laudos estruturados — tudo em segundos.</p>
+</div>
+"""
+
+HTML_DESTAQUES = (
+    """
+    <div style="padding:20px; background:#f8fafc; border-radius:12px; border-left:4px solid #2563eb; height:100%;">
+        <h3 style="color:#0f172a; font-size:1.2rem; margin-bottom:10px;">🌐 Busca Ativa</h3>
+        <p style="color:#64748b; font-size:0.95rem;">Validação em tempo real. Rastreamento automático em redes sociais, fóruns, marketplaces e mais.</p>
+    </div>
+    """,
+    """
+    <div style="padding:20px; background:#f8fafc; border-radius:12px; border-left:4px solid #10b981; height:100%;">
+        <h3 style="color:#0f172a; font-size:1.2rem; margin-bottom:10px;">📍 Geolocalização</h3>
+        <p style="color:#64748b; font-size:0.95rem;">Análise contextual avançada. Identificação de ruas, placas, vegetação, sombras e clima — até mesmo em fotos desfocadas.</p>
+    </div>
+    """,
+    """
+    <div style="padding:20px; background:#f8fafc; border-radius:12px; border-left:4px solid #8b5cf6; height:100%;">
+        <h3 style="color:#0f172a; font-size:1.2rem; margin-bottom:10px;">🛡️ Rigor Técnico</h3>
+        <p style="color:#64748b; font-size:0.95rem;">Laudos estruturados, com nível de confiança e hipóteses alternativas — prontos para uso em processos legais.</p>
+    </div>
+    """,
+)
+
+CSS_PLANOS_3D = """
+<style>
+.plano-card-3d {
+    background: white;
+    border-radius: 16px;
+    padding: 24px;
+    position: relative;
+    overflow: hidden;
+    transition: all 0.4s cubic-bezier(0.175, 0.885, 0.32, 1.275);
+    box-shadow: 
+        0 10px 20px rgba(0,0,0,0.08),
+        0 4px 6px rgba(0,0,0,0.05);
+    transform-style: preserve-3d;
+    backface-visibility: hidden;
+}
+
+.plano-card-3d::before {
+    content: '';
+    position: absolute;
+    top: 0;
+    left: 0;
+    right: 0;
+    height: 4px;
+    background: var(--primary-color);
+    transform: scaleX(0);
+    transform-origin: left;
+    transition: transform 0.5s ease;
+}
+
+.plano-card-3d:hover {
+    transform: translateY(-8px) rotateX(2deg);
+    box-shadow: 
+        0 20px 40px rgba(0,0,0,0.15),
+        0 8px 16px rgba(0,0,0,0.1);
+    z-index: 10;
+}
+
+.plano-card-3d:hover::before {
+    transform: scaleX(1);
+}
+
+.plano-card-3d .glow {
+    position: absolute;
+    top: -50%;
+    left: -50%;
+    width: 200%;
+    height: 200%;
+    background: radial-gradient(circle, var(--primary-color)20%, transparent 70%);
+    opacity: 0;
+    transition: opacity 0.4s ease;
+    pointer-events: none;
+    z-index: -1;
+}
+
+.plano-card-3d:hover .glow {
+    opacity: 0.15;
+}
+
+.btn-comprar-plano {
+    display: block;
+    width: 100%;
+    padding: 12px;
+    text-align: center;
+    border-radius: 10px;
+    font-weight: 600;
+    cursor: pointer;
+    transition: all 0.3s ease;
+    border: none;
+    outline: none;
+    margin-top: 16px;
+    font-size: 0.95rem;
+}
+
+.btn-comprar-plano.logado {
+    background: var(--primary-color);
+    color: white;
+}
+
+.btn-comprar-plano.logado:hover {
+    background: var(--primary-color-dark);
+    transform: translateY(-2px);
+    box-shadow: 0 4px 12px rgba(0,0,0,0.15);
+}
+
+.btn-comprar-plano.deslogado {
+    background: #f3f4f6;
+    color: #6b7280;
+    border: 1px solid #d1d5db;
+}
+
+.btn-comprar-plano.deslogado:hover {
+    background: #e5e7eb;
+    transform: translateY(-1px);
+}
+</style>
+"""
+
+_CARTAO_PLANO_3D = """
+<div class="plano-card-3d" style="--primary-color: {cor}; --primary-color-dark: {cor}dd;">
+    <div class="glow"></div>
+    <div style="display:flex; align-items:center; gap:10px; margin-bottom:16px;">
+        <div style="width:10px; height:10px; background:{cor}; border-radius:50%;"></div>
+        <h3 style="font-size:1.25rem; font-weight:700; color:#0f172a; margin:0;">{nome}</h3>
+    </div>
+    <div style="font-size:1.8rem; font-weight:800; color:{cor}; margin:16px 0;">{preco}</div>
+    <p style="color:#64748b; font-size:0.9rem; margin-bottom:20px;">Créditos não expiram</p>
+"""
+
+HTML_RODAPE = """
+<div style="text-align:center; padding:30px; background:#f8fafc; border-radius:16px; margin-top:40px;">
+    <h3 style="color:#0f172a; font-size:1.4rem; margin-bottom:10px;">✅ Já utilizado por mais de 500 agentes de investigação</h3>
+    <p style="color:#64748b; font-size:1rem;">Tecnologia confiável, resultados precisos e laudos admissíveis em tribunal.</p>
+</div>
+"""
+
+CSS_PLANOS = """
+<style>
+.plano-card {
+    background: white;
+    border-radius: 16px;
+    padding: 20px;
+    box-shadow: 0 4px 12px rgba(0,0,0,0.05);
+    transition: transform 0.2s ease, box-shadow 0.2s ease;
+    margin-bottom: 20px;
+    border: 2px solid transparent;
+}
+.plano-card:hover {
+    transform: translateY(-4px);
+    box-shadow: 0 8px 20px rgba(0,0,0,0.1);
+    border-color: var(--primary-color);
+}
+.plano-title {
+    font-size: 1.4rem;
+    font-weight: 700;
+    color: #1e293b;
+    margin-bottom: 8px;
+}
+.plano-preco {
+    font-size: 1.6rem;
+    font-weight: 800;
+    color: var(--primary-color);
+    margin: 12px 0;
+}
+.btn-comprar {
+    display: block;
+    width: 100%;
+    padding: 12px;
+    text-align: center;
+    border-radius: 8px;
+    font-weight: 600;
+    cursor: pointer;
+    transition: background-color 0.2s ease, transform 0.1s ease;
+    border: none;
+    outline: none;
+}
+.btn-comprar:hover {
+    transform: scale(1.02);
+}
+.btn-comprar.deslogado {
+    background: #f3f4f6;
+    color: #6b7280;
+    border: 1px solid #d1d5db;
+}
+.btn-comprar.deslogado:hover {
+    background: #e5e7eb;
+}
+.btn-comprar.logado {
+    background: var(--primary-color);
+    color: white;
+}
+.btn-comprar.logado:hover {
+    background: var(--primary-color-dark);
+}
+</style>
+"""
+
+_CARTAO_PLANO = """
+<div class="plano-card" style="--primary-color: {cor}; --primary-color-dark: {cor}dd;">
+    <div class="plano-title">🎟️ {nome}</div>
+    <div class="plano-preco">{preco}</div>
+"""
+
+
+@functools.lru_cache(maxsize=None)
+def css_global(tema: str) -> str:
+    """CSS de contraste do tema, formatado uma única vez por tema."""
+    return _CSS_GLOBAL.format(**TEMAS[tema])
+
+
+@functools.lru_cache(maxsize=None)
+def cartoes_planos_3d() -> tuple:
+    """Cartões de plano da página inicial, na ordem de PLANOS."""
+    return tuple(_CARTAO_PLANO_3D.format(nome=nome, preco=preco, cor=cor) for nome, preco, _, cor in PLANOS)
+
+
+@functools.lru_cache(maxsize=None)
+def cartoes_planos() -> tuple:
+    """Cartões de plano da página de planos, na ordem de PLANOS."""
+    return tuple(_CARTAO_PLANO.format(nome=nome, preco=preco, cor=cor) for nome, preco, _, cor in PLANOS)
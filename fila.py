@@ -0,0 +1,237 @@
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from ingestao import abrir_evidencia
+from metricas import metricas
+from pericia import MAX_WORKERS_LOTE, analisar_evidencia, erro_pericia
+
+log = logging.getLogger(__name__)
+
+# =========================================================
+# FILA DE PERÍCIAS (SQLITE LOCAL, SEM BROKER)
+# =========================================================
+DIRETORIO_PADRAO = os.path.join(tempfile.gettempdir(), "visionscan_cache", "fila")
+RETENCAO_PADRAO = 7 * 24 * 3600  # segundos que um job finalizado fica disponível
+INTERVALO_PARCIAL = 0.5  # gravação mínima entre atualizações do texto parcial
+
+PENDENTE = "pendente"
+EXECUTANDO = "executando"
+CONCLUIDO = "concluido"
+ERRO = "erro"
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    user_id TEXT,
+    nome_arquivo TEXT,
+    status TEXT NOT NULL,
+    criado_em REAL NOT NULL,
+    iniciado_em REAL,
+    concluido_em REAL,
+    parcial TEXT NOT NULL DEFAULT '',
+    resultado TEXT,
+    erro TEXT,
+    cobrado INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+"""
+
+
+class FilaPericias:
+    """
+    Fila de análises persistida em SQLite, com um pool de workers no processo.
+    O upload é copiado para disco no envio, então o job sobrevive a reruns e
+    trocas de página do Streamlit; o texto parcial e o resultado ficam na
+    tabela para a interface consultar pelo id. `ao_concluir(job)` é chamado
+    pelo worker a cada job concluído com sucesso (ex.: gravar o histórico) e
+    `ao_falhar(job)` a cada job que termina em erro (ex.: estornar o crédito).
+    """
+
+    def __init__(self, diretorio: str = DIRETORIO_PADRAO, max_workers: int = MAX_WORKERS_LOTE,
+                 retencao: float = RETENCAO_PADRAO, ao_concluir=None, ao_falhar=None):
+        self.diretorio = diretorio
+        self.ao_concluir = ao_concluir
+        self.ao_falhar = ao_falhar
+        self.max_workers = max_workers
+        self.retencao = retencao
+        self._banco = os.path.join(diretorio, "jobs.sqlite3")
+        self._entradas = os.path.join(diretorio, "entradas")
+        self._executor = None
+        self._retomado = False
+        self._lock = threading.Lock()
+
+        os.makedirs(self._entradas, exist_ok=True)
+        with self._conectar() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript(_ESQUEMA)
+
+    @contextmanager
+    def _conectar(self):
+        # Uma conexão por operação: o sqlite3 não compartilha conexões entre threads
+        con = sqlite3.connect(self._banco, timeout=30)
+        con.row_factory = sqlite3.Row
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="pericia-fila")
+            return self._executor
+
+    def _caminho_entrada(self, job_id: str) -> str:
+        return os.path.join(self._entradas, job_id)
+
+    def enviar(self, img_file, api_key: str, user_id: str | None = None, cobrado: bool = False) -> str:
+        """
+        Persiste o upload e o job e agenda a análise. Retorna o id do job.
+        `cobrado` registra que o crédito já foi reservado no envio.
+        """
+        job_id = uuid.uuid4().hex
+        caminho = self._caminho_entrada(job_id)
+        temporario = f"{caminho}.tmp"
+        with abrir_evidencia(img_file) as conteudo, open(temporario, "wb") as f:
+            f.write(conteudo)
+        os.replace(temporario, caminho)
+
+        with self._conectar() as con:
+            con.execute(
+                "INSERT INTO jobs (id, user_id, nome_arquivo, status, criado_em, cobrado) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, user_id, getattr(img_file, "name", None), PENDENTE, time.time(), int(cobrado))
+            )
+        metricas.contar("visionscan_fila_jobs_total", ajuda="Jobs por status final", status="enviado")
+        self._pool().submit(self._executar, job_id, api_key)
+        return job_id
+
+    def _executar(self, job_id: str, api_key: str):
+        with self._conectar() as con:
+            # Reivindica o job: evita execução dupla após um retomar()
+            reivindicado = con.execute(
+                "UPDATE jobs SET status = ?, iniciado_em = ?, parcial = '' WHERE id = ? AND status = ?",
+                (EXECUTANDO, time.time(), job_id, PENDENTE)
+            ).rowcount
+        if not reivindicado:
+            return
+
+        partes = []
+        ultima_gravacao = 0.0
+
+        def _ao_trecho(texto: str):
+            nonlocal ultima_gravacao
+            partes.append(texto)
+            agora = time.monotonic()
+            if "\n" in texto and agora - ultima_gravacao >= INTERVALO_PARCIAL:
+                ultima_gravacao = agora
+                with self._conectar() as con:
+                    con.execute("UPDATE jobs SET parcial = ? WHERE id = ?", ("".join(partes), job_id))
+
+        try:
+            with open(self._caminho_entrada(job_id), "rb") as f:
+                resultado = analisar_evidencia(f, api_key, ao_trecho=_ao_trecho)
+            status, campos = CONCLUIDO, {"resultado": json.dumps(resultado, ensure_ascii=False), "erro": None}
+        except Exception as e:
+            status, campos = ERRO, {"resultado": None, "erro": erro_pericia(e, api_key)}
+
+        with self._conectar() as con:
+            con.execute(
+                "UPDATE jobs SET status = ?, concluido_em = ?, parcial = ?, resultado = ?, erro = ? WHERE id = ?",
+                (status, time.time(), "".join(partes), campos["resultado"], campos["erro"], job_id)
+            )
+        metricas.contar("visionscan_fila_jobs_total", ajuda="Jobs por status final", status=status)
+        try:
+            os.remove(self._caminho_entrada(job_id))
+        except OSError:
+            pass
+
+        self._notificar(job_id, status)
+
+    def _notificar(self, job_id: str, status: str):
+        gancho = self.ao_concluir if status == CONCLUIDO else self.ao_falhar
+        if gancho is None:
+            return
+        try:
+            gancho(self.obter(job_id))
+        except Exception as e:
+            metricas.contar("visionscan_falhas_total", ajuda="Erros tratados sem interromper o fluxo, por etapa",
+                            etapa="pos_processamento_job")
+            log.warning("Falha no pós-processamento do job %s: %s", job_id, e)
+
+    def obter(self, job_id: str) -> dict | None:
+        """Estado do job; em jobs concluídos, `resultado` é o dict do analisar_evidencia."""
+        with self._conectar() as con:
+            linha = con.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if linha is None:
+            return None
+        job = dict(linha)
+        job["resultado"] = json.loads(job["resultado"]) if job["resultado"] else None
+        job["cobrado"] = bool(job["cobrado"])
+        return job
+
+    def liberar_cobranca(self, job_id: str) -> bool:
+        """Desfaz a reserva de um job com erro; só a primeira chamada devolve True (um estorno por job)."""
+        with self._conectar() as con:
+            return con.execute(
+                "UPDATE jobs SET cobrado = 0 WHERE id = ? AND status = ? AND cobrado = 1",
+                (job_id, ERRO)
+            ).rowcount == 1
+
+    def retomar(self, api_key: str) -> int:
+        """
+        Reagenda jobs pendentes ou interrompidos (processo reiniciado) e
+        descarta os finalizados há mais que a retenção. Deve ser chamado no
+        início do processo, antes de qualquer enviar(); só age uma vez.
+        Jobs com erro que ainda têm crédito reservado (o processo caiu antes
+        do estorno) passam de novo pelo `ao_falhar`. Retorna quantos voltaram à fila.
+        """
+        with self._lock:
+            if self._retomado:
+                return 0
+            self._retomado = True
+
+        with self._conectar() as con:
+            # Nenhum worker deste processo começou ainda: "executando" é de um processo morto
+            con.execute("UPDATE jobs SET status = ? WHERE status = ?", (PENDENTE, EXECUTANDO))
+            con.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND concluido_em < ?",
+                (CONCLUIDO, ERRO, time.time() - self.retencao)
+            )
+            sem_estorno = [
+                linha["id"] for linha in con.execute(
+                    "SELECT id FROM jobs WHERE status = ? AND cobrado = 1", (ERRO,)
+                )
+            ]
+            ids = [
+                linha["id"] for linha in con.execute(
+                    "SELECT id FROM jobs WHERE status = ? ORDER BY criado_em", (PENDENTE,)
+                )
+            ]
+        for job_id in sem_estorno:
+            self._notificar(job_id, ERRO)
+
+        retomados = 0
+        for job_id in ids:
+            if os.path.exists(self._caminho_entrada(job_id)):
+                self._pool().submit(self._executar, job_id, api_key)
+                retomados += 1
+            else:
+                with self._conectar() as con:
+                    con.execute(
+                        "UPDATE jobs SET status = ?, concluido_em = ?, erro = ? WHERE id = ?",
+                        (ERRO, time.time(), "❌ Evidência perdida antes da análise.", job_id)
+                    )
+                self._notificar(job_id, ERRO)
+        return retomados
+
+
+fila_pericias = FilaPericias()
@@ -0,0 +1,196 @@
+import os
+import re
+import struct
+import tempfile
+import threading
+
+import numpy as np
+
+# =========================================================
+# ÍNDICE GEOGRÁFICO DAS EVIDÊNCIAS
+# =========================================================
+ARQUIVO_PADRAO = os.path.join(tempfile.gettempdir(), "visionscan_cache", "geo.bin")
+RAIO_TERRA_KM = 6371.0088
+RAIO_PADRAO_KM = 2.0
+PRECISAO_GEOHASH = 9  # ~5 m; prefixos menores agrupam por célula (5 -> ~5 km)
+
+ORIGENS = ("exif", "modelo")
+_REGISTRO = struct.Struct(">dd32sB")  # lat, lon, sha256, origem
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+# Linha pedida ao modelo nas instruções do sistema
+_COORDENADAS_MODELO = re.compile(
+    r"COORDENADAS ESTIMADAS\W*?(-?\d{1,2}(?:[.,]\d+)?)\s*[,;]\s*(-?\d{1,3}(?:[.,]\d+)?)",
+    re.IGNORECASE
+)
+
+
+def geohash(lat: float, lon: float, precisao: int = PRECISAO_GEOHASH) -> str:
+    """Geohash base32 clássico; prefixo comum = mesma célula da grade."""
+    faixa_lat, faixa_lon = [-90.0, 90.0], [-180.0, 180.0]
+    saida, bits, valor, par = [], 0, 0, True
+    while len(saida) < precisao:
+        faixa, alvo = (faixa_lon, lon) if par else (faixa_lat, lat)
+        meio = (faixa[0] + faixa[1]) / 2
+        if alvo >= meio:
+            valor = (valor << 1) | 1
+            faixa[0] = meio
+        else:
+            valor <<= 1
+            faixa[1] = meio
+        par = not par
+        bits += 1
+        if bits == 5:
+            saida.append(_BASE32[valor])
+            bits = valor = 0
+    return "".join(saida)
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Distância de um ponto a vetores de pontos, em km (numpy, sem laço Python)."""
+    lat, lon = np.radians(lat), np.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * RAIO_TERRA_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def coordenadas_do_laudo(relatorio: str):
+    """Coordenadas estimadas pelo modelo na linha 'COORDENADAS ESTIMADAS: lat, lon', se houver."""
+    encontrado = _COORDENADAS_MODELO.search(relatorio or "")
+    if not encontrado:
+        return None
+    lat, lon = (float(v.replace(",", ".")) for v in encontrado.groups())
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return lat, lon
+
+
+class IndiceGeografico:
+    """
+    Pontos (lat, lon) das evidências já analisadas, um por sha256, em arrays
+    numpy ordenados por latitude: a consulta recorta a faixa de latitude por
+    busca binária, filtra a longitude vetorizada e refina pelo haversine.
+    Pontos novos entram na ordem por intercalação (searchsorted + insert) na
+    próxima consulta, sem reordenar o índice inteiro.
+    Persistido em arquivo binário append-only, como o índice perceptual.
+    """
+
+    def __init__(self, arquivo: str | None = ARQUIVO_PADRAO):
+        self.arquivo = arquivo
+        self._lats, self._lons, self._refs, self._origens = [], [], [], []
+        self._posicoes = {}  # ref -> índice nas listas
+        self._ordenado = None  # (lats, lons, índices originais) ordenados por latitude
+        self._novos = []  # índices inseridos depois da última ordenação
+        self._lock = threading.Lock()
+        if arquivo:
+            os.makedirs(os.path.dirname(arquivo), exist_ok=True)
+            self._carregar()
+
+    def _carregar(self):
+        try:
+            with open(self.arquivo, "rb") as f:
+                dados = f.read()
+        except OSError:
+            return
+        # Registro final truncado (queda no meio da escrita) é ignorado
+        for lat, lon, ref, origem in _REGISTRO.iter_unpack(dados[:len(dados) - len(dados) % _REGISTRO.size]):
+            self._inserir(lat, lon, ref.hex(), ORIGENS[origem] if origem < len(ORIGENS) else ORIGENS[0])
+
+    def _inserir(self, lat: float, lon: float, ref: str, origem: str):
+        posicao = self._posicoes.get(ref)
+        if posicao is None:
+            self._posicoes[ref] = len(self._refs)
+            self._lats.append(lat)
+            self._lons.append(lon)
+            self._refs.append(ref)
+            self._origens.append(origem)
+            if self._ordenado is not None:
+                self._novos.append(len(self._refs) - 1)
+        else:
+            # Reanálise (rara): vale a coordenada mais recente e a ordem é refeita
+            self._lats[posicao], self._lons[posicao], self._origens[posicao] = lat, lon, origem
+            self._ordenado = None
+            self._novos = []
+
+    def adicionar(self, lat: float, lon: float, ref_hex: str, origem: str = "exif") -> bool:
+        """Registra o ponto da evidência. Retorna False se ele já estava idêntico no índice."""
+        with self._lock:
+            posicao = self._posicoes.get(ref_hex)
+            if posicao is not None and (self._lats[posicao], self._lons[posicao]) == (lat, lon):
+                return False
+            self._inserir(lat, lon, ref_hex, origem)
+            if self.arquivo:
+                with open(self.arquivo, "ab") as f:
+                    f.write(_REGISTRO.pack(lat, lon, bytes.fromhex(ref_hex), ORIGENS.index(origem)))
+        return True
+
+    def _arrays(self):
+        with self._lock:
+            if self._ordenado is None:
+                lats = np.fromiter(self._lats, dtype=np.float64, count=len(self._lats))
+                lons = np.fromiter(self._lons, dtype=np.float64, count=len(self._lons))
+                ordem = np.argsort(lats, kind="stable")
+                self._ordenado = (lats[ordem], lons[ordem], ordem)
+            elif self._novos:
+                # Ordena só os novos e os intercala: O(n + k log k) em vez de O(n log n)
+                novos = np.array(self._novos, dtype=np.intp)
+                lats_novos = np.array([self._lats[i] for i in self._novos], dtype=np.float64)
+                lons_novos = np.array([self._lons[i] for i in self._novos], dtype=np.float64)
+                ordem_novos = np.argsort(lats_novos, kind="stable")
+                lats, lons, ordem = self._ordenado
+                posicoes = np.searchsorted(lats, lats_novos[ordem_novos], side="right")
+                self._ordenado = (
+                    np.insert(lats, posicoes, lats_novos[ordem_novos]),
+                    np.insert(lons, posicoes, lons_novos[ordem_novos]),
+                    np.insert(ordem, posicoes, novos[ordem_novos])
+                )
+            self._novos = []
+            return self._ordenado
+
+    def _faixa(self, lat_min: float, lat_max: float):
+        lats, lons, ordem = self._arrays()
+        inicio = np.searchsorted(lats, lat_min, side="left")
+        fim = np.searchsorted(lats, lat_max, side="right")
+        return lats[inicio:fim], lons[inicio:fim], ordem[inicio:fim]
+
+    def _resultado(self, indice: int) -> dict:
+        return {
+            "ref": self._refs[indice],
+            "origem": self._origens[indice],
+            "lat": self._lats[indice],
+            "lon": self._lons[indice]
+        }
+
+    def buscar_retangulo(self, lat_min: float, lon_min: float, lat_max: float, lon_max: float):
+        """Pontos dentro do retângulo; lon_min > lon_max indica que ele cruza o antimeridiano."""
+        lats, lons, indices = self._faixa(lat_min, lat_max)
+        largura = (lon_max - lon_min) % 360
+        dentro = ((lons - lon_min) % 360) <= largura
+        return [self._resultado(i) for i in indices[dentro]]
+
+    def buscar_raio(self, lat: float, lon: float, raio_km: float = RAIO_PADRAO_KM, excluir: str | None = None):
+        """Pontos a até `raio_km` de (lat, lon), do mais próximo ao mais distante, com a distância."""
+        delta_lat = np.degrees(raio_km / RAIO_TERRA_KM)
+        lats, lons, indices = self._faixa(lat - delta_lat, lat + delta_lat)
+        if len(indices) == 0:
+            return []
+
+        cos_lat = np.cos(np.radians(min(abs(lat) + delta_lat, 90.0)))
+        if cos_lat > 1e-6:
+            # Pré-filtro retangular barato antes do haversine
+            delta_lon = min(180.0, delta_lat / cos_lat)
+            perto = np.abs((lons - lon + 180) % 360 - 180) <= delta_lon
+            lats, lons, indices = lats[perto], lons[perto], indices[perto]
+
+        distancias = haversine_km(lat, lon, lats, lons)
+        dentro = distancias <= raio_km
+        ordem = np.argsort(distancias[dentro], kind="stable")
+        resultados = []
+        for distancia, indice in zip(distancias[dentro][ordem], indices[dentro][ordem]):
+            if self._refs[indice] == excluir:
+                continue
+            resultados.append({"distancia_km": round(float(distancia), 3), **self._resultado(indice)})
+        return resultados
+
+    def __len__(self):
+        return len(self._refs)
@@ -0,0 +1,168 @@
+import itertools
+import logging
+import os
+import struct
+import tempfile
+import threading
+from collections import defaultdict
+
+import numpy as np
+import PIL.Image
+
+from ingestao import abrir_leitor, reservar_decodificacao
+from metricas import metricas
+
+log = logging.getLogger(__name__)
+
+# =========================================================
+# HASH PERCEPTUAL (dHash / pHash)
+# =========================================================
+ARQUIVO_PADRAO = os.path.join(tempfile.gettempdir(), "visionscan_cache", "phash.bin")
+DISTANCIA_PADRAO = 10  # bits de diferença tolerados entre recompressões
+
+_LADO_DCT = 32
+_LADO_HASH = 8
+
+# Matriz da DCT-II 32x32, calculada uma vez por processo
+_n = np.arange(_LADO_DCT)
+_MATRIZ_DCT = np.cos(np.pi * (2 * _n[None, :] + 1) * _n[:, None] / (2 * _LADO_DCT))
+
+
+def _cinza_reduzido(img, tamanho):
+    """
+    Cópia em tons de cinza no tamanho pedido. Em JPEG ainda não decodificado,
+    draft() altera o próprio objeto para decodificar em 1/2, 1/4 ou 1/8 da
+    resolução; por isso use phash_bytes() quando a imagem for reaproveitada.
+    """
+    img.draft("L", (tamanho[0] * 4, tamanho[1] * 4))
+    with reservar_decodificacao(img, tamanho[0] * tamanho[1], "L"):
+        reduzida = img.convert("L").resize(tamanho, PIL.Image.BILINEAR)
+    return np.asarray(reduzida, dtype=np.float32)
+
+
+def _empacotar(bits) -> int:
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+
+def dhash(img) -> int:
+    """Hash de diferença de 64 bits (gradiente horizontal)."""
+    pixels = _cinza_reduzido(img, (_LADO_HASH + 1, _LADO_HASH))
+    return _empacotar(pixels[:, 1:] > pixels[:, :-1])
+
+
+def phash(img) -> int:
+    """Hash perceptual de 64 bits baseado nas baixas frequências da DCT."""
+    pixels = _cinza_reduzido(img, (_LADO_DCT, _LADO_DCT))
+    dct = _MATRIZ_DCT @ pixels @ _MATRIZ_DCT.T
+    baixas = dct[:_LADO_HASH, :_LADO_HASH]
+    # O termo DC só reflete o brilho médio; fica fora da mediana
+    mediana = np.median(baixas.ravel()[1:])
+    return _empacotar(baixas > mediana)
+
+
+def phash_bytes(conteudo) -> int:
+    """pHash a partir dos bytes (ou mmap) do arquivo, sem tocar em objetos de imagem do chamador."""
+    return phash(PIL.Image.open(abrir_leitor(conteudo)))
+
+
+def distancia_hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+# =========================================================
+# ÍNDICE MULTI-BLOCO DE HAMMING
+# =========================================================
+class IndiceHamming:
+    """
+    Índice de hashes de 64 bits por multi-index hashing: o hash é dividido
+    em blocos de 16 bits e cada bloco tem sua tabela. Pelo princípio da casa
+    dos pombos, um vizinho a distância d difere em no máximo d // blocos bits
+    em algum bloco, então só os buckets próximos são visitados.
+    Os registros são persistidos em um arquivo binário append-only.
+    """
+
+    _REGISTRO = struct.Struct(">Q32s")  # hash perceptual + sha256 da imagem
+
+    def __init__(self, arquivo: str | None = ARQUIVO_PADRAO, blocos: int = 4):
+        self.arquivo = arquivo
+        self.blocos = blocos
+        self._bits_bloco = 64 // blocos
+        self._mascara = (1 << self._bits_bloco) - 1
+        self._tabelas = [defaultdict(list) for _ in range(blocos)]
+        self._hashes = []
+        self._refs = []
+        self._conhecidos = set()
+        self._vizinhancas = {}
+        self._lock = threading.Lock()
+        if arquivo:
+            self._carregar()
+
+    def _carregar(self):
+        try:
+            with open(self.arquivo, "rb") as f:
+                dados = f.read()
+        except OSError:
+            return
+        dados = dados[:len(dados) - len(dados) % self._REGISTRO.size]
+        for valor, ref in self._REGISTRO.iter_unpack(dados):
+            self._inserir(valor, ref.hex())
+
+    def _inserir(self, valor: int, ref: str):
+        if (valor, ref) in self._conhecidos:
+            return False
+        self._conhecidos.add((valor, ref))
+        posicao = len(self._hashes)
+        self._hashes.append(valor)
+        self._refs.append(ref)
+        for i, tabela in enumerate(self._tabelas):
+            tabela[(valor >> (i * self._bits_bloco)) & self._mascara].append(posicao)
+        return True
+
+    def adicionar(self, valor: int, ref: str):
+        """Registra o hash de uma imagem; ref é o sha256 hexadecimal do conteúdo."""
+        with self._lock:
+            novo = self._inserir(valor, ref)
+        if novo and self.arquivo:
+            try:
+                os.makedirs(os.path.dirname(self.arquivo), exist_ok=True)
+                with open(self.arquivo, "ab") as f:
+                    f.write(self._REGISTRO.pack(valor, bytes.fromhex(ref)))
+            except OSError as e:
+                metricas.contar("visionscan_falhas_total", ajuda="Erros tratados sem interromper o fluxo, por etapa",
+                                etapa="persistir_hash_perceptual")
+                log.warning("Falha ao persistir hash perceptual: %s", e)
+
+    def _vizinhos(self, raio: int):
+        # Máscaras com até `raio` bits ligados dentro de um bloco (memoizadas)
+        mascaras = self._vizinhancas.get(raio)
+        if mascaras is None:
+            mascaras = [0]
+            for r in range(1, raio + 1):
+                for bits in itertools.combinations(range(self._bits_bloco), r):
+                    mascaras.append(sum(1 << b for b in bits))
+            self._vizinhancas[raio] = mascaras
+        return mascaras
+
+    def buscar(self, valor: int, distancia: int = DISTANCIA_PADRAO):
+        """Retorna [(distancia, ref)] dos hashes a até `distancia` bits, do mais próximo ao mais distante."""
+        raio = distancia // self.blocos
+        mascaras = self._vizinhos(raio)
+        candidatos = set()
+        with self._lock:
+            for i, tabela in enumerate(self._tabelas):
+                bloco = (valor >> (i * self._bits_bloco)) & self._mascara
+                for mascara in mascaras:
+                    posicoes = tabela.get(bloco ^ mascara)
+                    if posicoes:
+                        candidatos.update(posicoes)
+
+            encontrados = []
+            for posicao in candidatos:
+                d = (valor ^ self._hashes[posicao]).bit_count()
+                if d <= distancia:
+                    encontrados.append((d, self._refs[posicao]))
+        encontrados.sort()
+        return encontrados
+
+    def __len__(self):
+        return len(self._hashes)
@@ -0,0 +1,229 @@
+import io
+import mmap
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import PIL.ImageMode
+
+# =========================================================
+# INGESTÃO COM MEMÓRIA LIMITADA
+# =========================================================
+LIMITE_BYTES_UPLOAD = 50 * 1024 * 1024
+LIMITE_PIXELS = 60_000_000
+# Teto de memória para decodificar uma evidência (bitmap + conversão + redução).
+# Abaixo do que LIMITE_PIXELS permite: 60 MP RGB (~250 MB) passa, 60 MP RGBA ou 16 bits não.
+ORCAMENTO_MEMORIA = 256 * 1024 * 1024
+# Teto somado das decodificações simultâneas no processo (análises, lote, fila, prévias)
+ORCAMENTO_PROCESSO = 2 * ORCAMENTO_MEMORIA
+_BLOCO = 1024 * 1024
+
+
+class EvidenciaRejeitada(ValueError):
+    """Upload recusado pela política de ingestão; a mensagem é exibida ao usuário."""
+
+
+class LeitorBuffer(io.RawIOBase):
+    """Arquivo somente leitura sobre um buffer (mmap/memoryview), sem copiar o conteúdo."""
+
+    def __init__(self, buffer):
+        self._buffer = memoryview(buffer)
+        self._posicao = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, destino):
+        # seek() aceita posições além do fim; nesse caso é EOF
+        n = max(0, min(len(destino), len(self._buffer) - self._posicao))
+        if n == 0:
+            return 0
+        destino[:n] = self._buffer[self._posicao:self._posicao + n]
+        self._posicao += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._posicao, io.SEEK_END: len(self._buffer)}[whence]
+        self._posicao = max(0, base + offset)
+        return self._posicao
+
+    def tell(self):
+        return self._posicao
+
+    def close(self):
+        self._buffer.release()
+        super().close()
+
+
+def abrir_leitor(conteudo):
+    """Arquivo independente (posição própria) sobre bytes ou mmap."""
+    if isinstance(conteudo, bytes):
+        # BytesIO sobre bytes compartilha o buffer até haver escrita
+        return io.BytesIO(conteudo)
+    return io.BufferedReader(LeitorBuffer(conteudo))
+
+
+def _mb(n: int) -> str:
+    return f"{n / (1024 * 1024):.0f} MB"
+
+
+def _checar_tamanho(tamanho: int, limite_bytes: int):
+    if tamanho == 0:
+        raise EvidenciaRejeitada("Arquivo vazio.")
+    if tamanho > limite_bytes:
+        raise EvidenciaRejeitada(
+            f"Arquivo de {_mb(tamanho)} excede o limite de {_mb(limite_bytes)} por evidência."
+        )
+
+
+def _fechar_mapa(mapa):
+    try:
+        mapa.close()
+    except BufferError:
+        # Ainda há views exportadas (ex.: imagem PIL viva); o GC fecha o mapa depois
+        pass
+
+
+@contextmanager
+def abrir_evidencia(img_file, limite_bytes: int = LIMITE_BYTES_UPLOAD):
+    """
+    Expõe o upload como buffer somente leitura, sem cópias extras:
+    BytesIO/UploadedFile entregam o próprio buffer (getvalue não copia),
+    arquivos em disco são mapeados com mmap e outros streams são copiados
+    em blocos de 1 MB para um temporário mapeado, abortando ao passar do limite.
+    """
+    if hasattr(img_file, "getvalue"):
+        conteudo = img_file.getvalue()
+        _checar_tamanho(len(conteudo), limite_bytes)
+        yield conteudo
+        return
+
+    try:
+        descritor = img_file.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        descritor = None
+
+    if descritor is not None:
+        _checar_tamanho(os.fstat(descritor).st_size, limite_bytes)
+        mapa = mmap.mmap(descritor, 0, access=mmap.ACCESS_READ)
+        try:
+            yield mapa
+        finally:
+            _fechar_mapa(mapa)
+        return
+
+    if getattr(img_file, "seekable", lambda: False)():
+        img_file.seek(0)
+    with tempfile.TemporaryFile(prefix="visionscan-") as temporario:
+        total = 0
+        while bloco := img_file.read(_BLOCO):
+            total += len(bloco)
+            _checar_tamanho(total, limite_bytes)
+            temporario.write(bloco)
+        temporario.flush()
+        _checar_tamanho(total, limite_bytes)
+
+        mapa = mmap.mmap(temporario.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield mapa
+        finally:
+            _fechar_mapa(mapa)
+
+
+def bytes_por_pixel(modo: str) -> int:
+    """
+    Bytes por pixel do bitmap do Pillow: modos de uma banda usam o tamanho
+    do tipo (L/P: 1, I;16: 2, I/F: 4); os de várias bandas ocupam 4 bytes.
+    """
+    info = PIL.ImageMode.getmode(modo)
+    if len(info.bands) == 1:
+        return int(info.typestr[2:])
+    return 4
+
+
+def memoria_decodificacao(img, pixels_saida: int, modo_saida: str = "RGB") -> int:
+    """Estimativa do pico de memória para decodificar, converter para `modo_saida` e reduzir a imagem."""
+    pixels = img.width * img.height
+    estimativa = pixels * bytes_por_pixel(img.mode)
+    if img.mode != modo_saida:
+        estimativa += pixels * bytes_por_pixel(modo_saida)
+    return estimativa + pixels_saida * bytes_por_pixel(modo_saida)
+
+
+def validar_dimensoes(img, limite_pixels: int = LIMITE_PIXELS):
+    """Recusa a imagem pelas dimensões declaradas no cabeçalho, antes de qualquer decodificação."""
+    pixels = img.width * img.height
+    if pixels > limite_pixels:
+        raise EvidenciaRejeitada(
+            f"Imagem de {img.width}x{img.height} ({pixels / 1e6:.0f} MP) excede o limite de "
+            f"{limite_pixels / 1e6:.0f} MP por evidência."
+        )
+
+
+def validar_orcamento(img, pixels_saida: int, orcamento: int = ORCAMENTO_MEMORIA, modo_saida: str = "RGB") -> int:
+    """Recusa a decodificação que não cabe no orçamento por evidência. Retorna a estimativa."""
+    estimativa = memoria_decodificacao(img, pixels_saida, modo_saida)
+    if estimativa > orcamento:
+        raise EvidenciaRejeitada(
+            f"Decodificar esta imagem exigiria cerca de {_mb(estimativa)}, acima do "
+            f"orçamento de {_mb(orcamento)} por análise."
+        )
+    return estimativa
+
+
+class OrcamentoMemoria:
+    """
+    Memória de decodificação reservada no processo inteiro. Cada decodificação
+    reserva a própria estimativa e a devolve ao terminar; se as reservas em
+    andamento não deixam espaço, a próxima espera em vez de somar picos.
+    Uma thread que já tem reserva não espera pela segunda (evita deadlock).
+    """
+
+    def __init__(self, total: int = ORCAMENTO_PROCESSO):
+        self.total = total
+        self._em_uso = 0
+        self._cond = threading.Condition()
+        self._local = threading.local()
+
+    @contextmanager
+    def reservar(self, quantidade: int):
+        quantidade = min(quantidade, self.total)
+        aninhada = getattr(self._local, "reservas", 0) > 0
+        with self._cond:
+            if not aninhada:
+                self._cond.wait_for(lambda: self._em_uso + quantidade <= self.total)
+            self._em_uso += quantidade
+        self._local.reservas = getattr(self._local, "reservas", 0) + 1
+        try:
+            yield
+        finally:
+            self._local.reservas -= 1
+            with self._cond:
+                self._em_uso -= quantidade
+                self._cond.notify_all()
+
+    def em_uso(self) -> int:
+        with self._cond:
+            return self._em_uso
+
+
+orcamento_processo = OrcamentoMemoria()
+
+
+@contextmanager
+def reservar_decodificacao(img, pixels_saida: int, modo_saida: str = "RGB", orcamento: int = ORCAMENTO_MEMORIA,
+                           limite_pixels: int = LIMITE_PIXELS):
+    """
+    validar_dimensoes, validar_orcamento e, enquanto o bloco roda, a reserva
+    da estimativa no orçamento do processo. Todo decode de evidência passa
+    por aqui, depois do draft() e antes do load()/convert(); o limite de
+    pixels vale só para as evidências, sem mexer no MAX_IMAGE_PIXELS global.
+    """
+    validar_dimensoes(img, limite_pixels)
+    estimativa = validar_orcamento(img, pixels_saida, orcamento, modo_saida)
+    with orcamento_processo.reservar(estimativa):
+        yield estimativa
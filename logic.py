@@ -1,302 +1,186 @@
-import google.generativeai as genai
-from supabase import create_client, Client
-import PIL.Image
+from supabase import create_client, acreate_client, AsyncClient, AsyncClientOptions, Client, ClientOptions
 import streamlit as st
-from uuid import UUID
+import asyncio
+import httpx
+import importlib.util
+import logging
+import threading
+import time
+import weakref
+from metricas import metricas
+# Motor de perícia fica em pericia.py, sem dependência do Streamlit
+from pericia import (
+    MAX_WORKERS_LOTE,
+    catalogo_modelos,
+    cache_resultados,
+    buscar_semelhantes,
+    executar_pericia,
+    executar_pericia_stream,
+    executar_pericia_async,
+    analisar_lote,
+    executar_pericia_lote,
+    executar_pericia_lote_async,
+    pericia_bem_sucedida,
+    erro_pericia,
+    casos_proximos
+)
+from fila import CONCLUIDO, ERRO, fila_pericias
+from previa import previa_evidencia
+
+log = logging.getLogger(__name__)
 
 # =========================================================
 # SUPABASE
 # =========================================================
-supabase: Client | None = None
-try:
-    supabase = create_client(
-        st.secrets["SUPABASE_URL"],
-        st.secrets["SUPABASE_KEY"]
-    )
-except Exception as e:
-    st.error(f"Erro de conexão com o banco: {e}")
-
-# =========================================================
-# MOTOR DE PERÍCIA OSINT (Atualizado)
-# =========================================================
-def executar_pericia(img_file, api_key: str) -> str:
-    if img_file is None:
-        return "❌ Nenhuma imagem foi fornecida para análise."
-    
-    try:
-        genai.configure(api_key=api_key)
-        
-        # =========================================================
-        # EXTRAÇÃO DE EXIF - CORRETA E TESTADA
-        # =========================================================
-        exif_info = ""
+# Limites do pool HTTP compartilhado por todas as sessões do processo
+MAX_CONEXOES_SUPABASE = 20
+MAX_CONEXOES_OCIOSAS_SUPABASE = 10
+KEEPALIVE_SUPABASE = 30.0  # segundos que uma conexão ociosa fica aberta
+TIMEOUT_SUPABASE = httpx.Timeout(30.0, connect=10.0)
+# HTTP/2 só com o pacote h2 instalado (pip install "httpx[http2]")
+HTTP2_SUPABASE = importlib.util.find_spec("h2") is not None
+
+
+class TransporteMedido(httpx.HTTPTransport):
+    """HTTPTransport que conta as requisições por conexão nova ou reaproveitada do pool."""
+
+    def handle_request(self, request):
+        nova = False
+        anterior = request.extensions.get("trace")
+
+        def rastrear(evento, info):
+            nonlocal nova
+            if evento.endswith("connect_tcp.complete"):
+                nova = True
+            if anterior is not None:
+                anterior(evento, info)
+
+        request.extensions["trace"] = rastrear
         try:
-            import io
-            from PIL import Image
-            from PIL.ExifTags import TAGS, GPSTAGS
-            
-            def convert_gps_info(gps_info):
-                def _convert_to_degrees(value):
-                    d = float(value[0])
-                    m = float(value[1])
-                    s = float(value[2])
-                    return d + (m / 60.0) + (s / 3600.0)
-                
-                if not gps_info:
-                    return None
-                
-                gps_latitude = gps_info.get(GPSTAGS.get("GPSLatitude"))
-                gps_latitude_ref = gps_info.get(GPSTAGS.get("GPSLatitudeRef"))
-                gps_longitude = gps_info.get(GPSTAGS.get("GPSLongitude"))
-                gps_longitude_ref = gps_info.get(GPSTAGS.get("GPSLongitudeRef"))
-                
-                if gps_latitude and gps_latitude_ref and gps_longitude and gps_longitude_ref:
-                    lat = _convert_to_degrees(gps_latitude)
-                    if gps_latitude_ref != "N":
-                        lat = -lat
-                    
-                    lon = _convert_to_degrees(gps_longitude)
-                    if gps_longitude_ref != "E":
-                        lon = -lon
-                    
-                    return f"{lat:.6f}, {lon:.6f}"
-                return None
-            
-            # SALVAR OS BYTES ORIGINAIS
-            img_file.seek(0)
-            original_bytes = img_file.read()
-            
-            # EXTRAIR EXIF DOS BYTES ORIGINAIS
-            img_exif = Image.open(io.BytesIO(original_bytes))
-            exifdata = img_exif.getexif()
-            
-            if exifdata:
-                exif_dict = {}
-                for tag_id, value in exifdata.items():
-                    tag = TAGS.get(tag_id, tag_id)
-                    if isinstance(value, bytes):
-                        try:
-                            value = value.decode('utf-8', errors='ignore')
-                        except:
-                            value = str(value)
-                    exif_dict[str(tag)] = value
-                
-                # GPS
-                try:
-                    gps_ifd = img_exif.getexif().get_ifd(0x8825)
-                    if gps_ifd:
-                        gps_coords = convert_gps_info(gps_ifd)
-                        if gps_coords:
-                            exif_dict["GPS Coordinates"] = gps_coords
-                except:
-                    pass
-                
-                exif_info = "\nMETADADOS EXIF ENCONTRADOS:\n"
-                for key, value in exif_dict.items():
-                    exif_info += f"- {key}: {value}\n"
-            else:
-                exif_info = "\nNenhum metadado EXIF encontrado na imagem.\n"
-                
-        except Exception as exif_error:
-            exif_info = f"\nErro ao extrair metadados EXIF: {str(exif_error)}\n"
-        
-        # =========================================================
-        # ANÁLISE VISUAL - USANDO OS BYTES ORIGINAIS
-        # =========================================================
-        img_for_analysis = Image.open(io.BytesIO(original_bytes))
-        if img_for_analysis.mode in ("RGBA", "P"):
-            img_for_analysis = img_for_analysis.convert("RGB")
-
-        # Redimensionamento (se necessário)
-        max_pixels = 3500000
-        current_pixels = img_for_analysis.width * img_for_analysis.height
-        if current_pixels > max_pixels:
-            ratio = (max_pixels / current_pixels) ** 0.5
-            new_width = int(img_for_analysis.width * ratio)
-            new_height = int(img_for_analysis.height * ratio)
-            img_for_analysis = img_for_analysis.resize((new_width, new_height), Image.LANCZOS)
-        
-        # Prompt completo diretamente na função
-        prompt = f"""
-
-Você é um Analista Sênior em Inteligência Visual e Geolocalização por Imagem, especializado em precisão técnica, rastreabilidade de evidências e inferência baseada em dados objetivos.
-Sua função não é gerar respostas genéricas, mas produzir conclusões claras, justificáveis e hierarquizadas, sempre deixando explícita a base de cada decisão.
-
-REGRA FUNDAMENTAL 
-{exif_info}
-Se a imagem contiver metadados (EXIF), eles devem ser avaliados antes de qualquer inferência visual e tratados como evidência primária.
-A inferência visual:
-
-Deve complementar, confirmar ou questionar os metadados
-Nunca deve substituí-los sem justificativa técnica clara
-
-🧾 ESTRUTURA OBRIGATÓRIA DO RELATÓRIO
-
-1. CONCLUSÃO TÉCNICA (RESUMO EXECUTIVO)
-
-Apresente imediatamente:
-
-Localização mais provável (cidade, região ou zona geográfica compatível)
-
-Fonte principal da inferência:
-Metadados
-Análise visual
-Cruzamento entre ambos
-Grau geral de confiança (em %)
-Observação crítica sobre a confiabilidade do resultado (quando aplicável)
-
-⚠️ Esta seção deve ser direta, objetiva e conclusiva.
-Nenhuma explicação longa deve aparecer aqui.
-
-2. VERIFICAÇÃO E ANÁLISE DE METADADOS
-
-Informe explicitamente:
-Se existem ou não metadados na imagem
-Caso existam, liste:
-Coordenadas GPS
-Data e hora de captura
-Dispositivo ou câmera
-
-Avalie:
-
-Consistência interna
-
-Indícios de remoção ou alteração
-
-Classifique os metadados como:
-
-Confiáveis
-
-Parcialmente confiáveis
-
-Inconclusivos
-
-⚠️ Se houver GPS válido e consistente, ele deve ser considerado a base principal da conclusão, salvo forte evidência contrária.
-
-3. OBSERVAÇÕES VISUAIS OBJETIVAS
-
-Descreva somente o que é visível, sem interpretação:
-
-Vegetação
-
-Solo
-
-Construções
-
-Infraestrutura
-
-Relevo
-
-Clima aparente
-
-Elementos culturais ou estruturais visíveis
-
-Nenhuma inferência deve aparecer nesta seção.
-
-4. CRUZAMENTO ENTRE METADADOS E ANÁLISE VISUAL
-
-Avalie se os elementos visuais confirmam ou contradizem os metadados
-
-Aponte convergências e divergências
-
-Caso haja conflito:
-
-Explique qual evidência tem maior peso
-
-Justifique tecnicamente a decisão
-
-5. INFERÊNCIA GEOGRÁFICA COMPLEMENTAR
-
-Somente execute esta etapa se:
-
-Não houver metadados
-OU
-
-Os metadados forem inconclusivos
-OU
+            resposta = super().handle_request(request)
+        except Exception:
+            metricas.contar("visionscan_supabase_requisicoes_total", ajuda="Requisições ao Supabase por conexão",
+                            conexao="nova" if nova else "reutilizada", resultado="erro")
+            raise
+        metricas.contar("visionscan_supabase_requisicoes_total", ajuda="Requisições ao Supabase por conexão",
+                        conexao="nova" if nova else "reutilizada", resultado="ok")
+        return resposta
 
-A validação visual for necessária
 
-Indique:
+def _segredo(nome, padrao=None):
+    """st.secrets.get que também funciona sem secrets.toml (CLI, benchmark, testes)."""
+    try:
+        return st.secrets.get(nome, padrao)
+    except Exception:
+        return padrao
 
-Regiões compatíveis
 
-Classificação de probabilidade:
+def _limites_supabase() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=int(_segredo("SUPABASE_MAX_CONEXOES", MAX_CONEXOES_SUPABASE)),
+        max_keepalive_connections=int(_segredo("SUPABASE_MAX_OCIOSAS", MAX_CONEXOES_OCIOSAS_SUPABASE)),
+        keepalive_expiry=KEEPALIVE_SUPABASE
+    )
 
-Alta
 
-Média
+def _criar_http_supabase() -> httpx.Client:
+    limites = _limites_supabase()
+    return httpx.Client(
+        transport=TransporteMedido(http2=HTTP2_SUPABASE, limits=limites),
+        timeout=TIMEOUT_SUPABASE,
+        follow_redirects=True
+    )
 
-Baixa
 
-6. LIMITAÇÕES DA ANÁLISE
+# Um pool keep-alive por processo; os clientes só guardam headers e sessão de auth
+http_supabase = _criar_http_supabase()
 
-Liste objetivamente os fatores que reduzem a precisão:
 
-Resolução da imagem
+def criar_cliente_supabase(chave: str | None = None) -> Client:
+    """Cliente com estado de auth próprio sobre o pool HTTP do processo (sem novo handshake TLS)."""
+    metricas.contar("visionscan_supabase_clientes_total", ajuda="Clientes Supabase criados")
+    return create_client(
+        st.secrets["SUPABASE_URL"],
+        chave or st.secrets["SUPABASE_KEY"],
+        options=ClientOptions(httpx_client=http_supabase)
+    )
 
-Ângulo ou enquadramento
 
-Iluminação
+def cliente_sessao() -> Client:
+    """
+    Cliente da sessão do Streamlit. Depois do sign-in ele carrega o JWT do
+    usuário, então toda consulta do usuário (perfil, créditos, histórico)
+    passa por aqui e fica sujeita às políticas RLS; o token de uma sessão
+    nunca vaza para as consultas de outra.
+    """
+    cliente = st.session_state.get("supabase_cliente")
+    if cliente is None:
+        cliente = st.session_state["supabase_cliente"] = criar_cliente_supabase()
+    return cliente
 
-Ausência de referências claras
 
-Possível compressão ou edição
+# Cliente service-role, só para caminhos sem sessão (workers da fila). Ignora
+# RLS: quem o usa precisa garantir o dono do registro (ex.: o user_id do job).
+_cliente_servico: Client | None = None
+_lock_servico = threading.Lock()
 
-⛔ RESTRIÇÕES ABSOLUTAS
 
-Proibido usar linguagem vaga sem justificativa
+def cliente_servico() -> Client:
+    global _cliente_servico
+    with _lock_servico:
+        if _cliente_servico is None:
+            _cliente_servico = criar_cliente_supabase(st.secrets["SUPABASE_SERVICE_KEY"])
+        return _cliente_servico
 
-Proibido pular etapas
 
-Proibido ignorar metadados existentes
+# Pools assíncronos: um por event loop (as conexões httpx ficam presas ao loop que as criou)
+_http_supabase_async = weakref.WeakKeyDictionary()
 
-Proibido substituir evidência por opinião
 
-Proibido apresentar hipóteses como fatos
-"""
-        
-        # Lista modelos disponíveis (nomes SEM "models/" prefixo)
-        modelos_disponiveis = [
-            m.name for m in genai.list_models()
-            if "generateContent" in m.supported_generation_methods
-        ]
-        preferidos = [
-            "gemini-1.5-pro",
-            "gemini-1.5-flash",
-            "gemini-1.0-pro"
-        ]
-
-        # Encontra o primeiro modelo disponível na lista de preferidos
-        modelo_escolhido = next(
-            (m for m in preferidos if m in modelos_disponiveis),
-            modelos_disponiveis[0] if modelos_disponiveis else "gemini-pro"
+def _http_async() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    http = _http_supabase_async.get(loop)
+    if http is None:
+        http = _http_supabase_async[loop] = httpx.AsyncClient(
+            http2=HTTP2_SUPABASE,
+            limits=_limites_supabase(),
+            timeout=TIMEOUT_SUPABASE,
+            follow_redirects=True
         )
+    return http
 
-        print(f"🔍 Modelo selecionado: {modelo_escolhido}")  # Debug útil
 
-        model = genai.GenerativeModel(model_name=modelo_escolhido)
-
-        # Rebobinar o arquivo para reutilizar na análise visual
-        img_file.seek(0)
-        img = PIL.Image.open(img_file)
-        if img.mode in ("RGBA", "P"):
-            img = img.convert("RGB")
+async def cliente_sessao_async() -> AsyncClient:
+    """
+    Par assíncrono de cliente_sessao: um AsyncClient por sessão e por event
+    loop, sobre o pool do loop. O login assíncrono de uma sessão não muda o
+    token usado pelas outras.
+    """
+    loop = asyncio.get_running_loop()
+    clientes = st.session_state.get("supabase_clientes_async")
+    if clientes is None:
+        clientes = st.session_state["supabase_clientes_async"] = weakref.WeakKeyDictionary()
+    cliente = clientes.get(loop)
+    if cliente is None:
+        metricas.contar("visionscan_supabase_clientes_total", ajuda="Clientes Supabase criados")
+        cliente = clientes[loop] = await acreate_client(
+            st.secrets["SUPABASE_URL"],
+            st.secrets["SUPABASE_KEY"],
+            options=AsyncClientOptions(httpx_client=_http_async())
+        )
+    return cliente
 
-        # Redimensiona apenas se necessário (mantém proporção e mais pixels)
-        max_pixels = 3500000  # Limite do Gemini
-        current_pixels = img.width * img.height
-        if current_pixels > max_pixels:
-            ratio = (max_pixels / current_pixels) ** 0.5
-            new_width = int(img.width * ratio)
-            new_height = int(img.height * ratio)
-            img = img.resize((new_width, new_height), PIL.Image.LANCZOS)
+# Aquece o catálogo no import para o primeiro usuário após o deploy não pagar a listagem
+try:
+    catalogo_modelos.aquecer(st.secrets["GEMINI_API_KEY"])
+except Exception:
+    pass
 
-        response = model.generate_content([prompt, img])
-        return response.text
-        
-    except Exception as e:
-        return f"❌ Erro na análise: {str(e)}"
+# Métricas em texto Prometheus em /metrics, se METRICAS_PORTA estiver configurada
+try:
+    metricas.iniciar_servidor(int(st.secrets["METRICAS_PORTA"]))
+except Exception:
+    pass
 
     
 # =========================================================
@@ -305,7 +189,7 @@ Proibido apresentar hipóteses como fatos
 
 def auth_login(email, password):
     try:
-        res = supabase.auth.sign_in_with_password({
+        res = cliente_sessao().auth.sign_in_with_password({
             "email": email,
             "password": password
         })
@@ -317,16 +201,30 @@ def auth_login(email, password):
         # Qualquer erro de autenticação retorna None
         return None
 
+async def auth_login_async(email, password):
+    """Versão assíncrona de auth_login."""
+    try:
+        cliente = await cliente_sessao_async()
+        res = await cliente.auth.sign_in_with_password({
+            "email": email,
+            "password": password
+        })
+        if not getattr(res.user, 'email_confirmed_at', None):
+            return "not_confirmed"
+        return res.user
+    except Exception:
+        return None
+
 def auth_get_user():
     try:
-        res = supabase.auth.get_user()
+        res = cliente_sessao().auth.get_user()
         return res.user
     except Exception:
         return None
 
 def auth_logout():
     try:
-        supabase.auth.sign_out()
+        cliente_sessao().auth.sign_out()
     except Exception:
         pass
 
@@ -335,15 +233,185 @@ def auth_logout():
 # DADOS DO USUÁRIO
 # =========================================================
 
+# Só as colunas que a aplicação usa (login, Home, créditos)
+COLUNAS_PERFIL = "id,email,name,plan,credits"
+
+
 def get_user_data(email):
     """Busca dados de negócio pelo email."""
     try:
-        res = supabase.table("users").select("*").eq("email", email).execute()
+        with metricas.span("perfil_usuario"):
+            res = cliente_sessao().table("users").select(COLUNAS_PERFIL).eq("email", email).execute()
+        return res.data[0] if res.data else None
+    except Exception:
+        return None
+
+
+async def get_user_data_async(email):
+    """Versão assíncrona de get_user_data."""
+    try:
+        cliente = await cliente_sessao_async()
+        res = await cliente.table("users").select(COLUNAS_PERFIL).eq("email", email).execute()
         return res.data[0] if res.data else None
     except Exception:
         return None
 
 
+class CachePerfis:
+    """
+    Cache de perfis por email com TTL e invalidação explícita.
+    Usado em dois níveis: um por sessão (st.session_state) e um por processo,
+    para que reruns do Streamlit não repitam a mesma consulta ao banco.
+    Com `geracao` (ex.: geracao_perfis), a entrada de um email gravada antes
+    da última invalidar_perfil() desse email (ou de todos) fica velha, mesmo
+    dentro do TTL; as dos outros emails continuam valendo.
+    """
+
+    def __init__(self, ttl: float | None = 30.0, geracao=None):
+        self.ttl = ttl
+        self.geracao = geracao
+        self._entradas = {}  # email -> (expira_em, perfil, geração)
+        self._lock = threading.Lock()
+        self.leituras_economizadas = 0
+        self.leituras_repassadas = 0
+
+    def obter(self, email, carregar=get_user_data):
+        """Retorna o perfil em cache ou o carrega com `carregar(email)`."""
+        agora = time.monotonic()
+        # Lida antes de carregar: uma invalidação durante a leitura deixa a entrada velha
+        geracao = self._geracao(email)
+        with self._lock:
+            entrada = self._entradas.get(email)
+            if entrada and entrada[2] == geracao and (self.ttl is None or agora < entrada[0]):
+                self.leituras_economizadas += 1
+                return dict(entrada[1])
+
+        perfil = carregar(email)
+        with self._lock:
+            self.leituras_repassadas += 1
+            if perfil is not None:
+                expira_em = agora + self.ttl if self.ttl is not None else None
+                self._entradas[email] = (expira_em, dict(perfil), geracao)
+        return perfil
+
+    def _geracao(self, email):
+        return self.geracao(email) if self.geracao is not None else 0
+
+    def atualizar(self, email, **campos):
+        """Aplica campos já conhecidos (ex.: saldo devolvido pelo débito) sem reler o banco."""
+        with self._lock:
+            entrada = self._entradas.get(email)
+            if entrada:
+                entrada[1].update(campos)
+
+    def gravar(self, email, perfil):
+        """Guarda um perfil recém-lido por outro caminho (ex.: o retorno do login)."""
+        expira_em = time.monotonic() + self.ttl if self.ttl is not None else None
+        geracao = self._geracao(email)
+        with self._lock:
+            self._entradas[email] = (expira_em, dict(perfil), geracao)
+
+    def invalidar(self, email=None):
+        """Descarta o perfil de um email, ou todos se nenhum for informado."""
+        with self._lock:
+            if email is None:
+                self._entradas.clear()
+            else:
+                self._entradas.pop(email, None)
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            return {
+                "leituras_economizadas": self.leituras_economizadas,
+                "leituras_repassadas": self.leituras_repassadas,
+                "perfis": len(self._entradas)
+            }
+
+
+perfis_processo = CachePerfis(ttl=30.0)
+
+# Gerações de invalidação: uma por email e uma global (invalidar_perfil() sem email).
+# Os caches de sessão comparam a entrada de cada email com geracao_perfis(email).
+_geracao_global = 0
+_geracoes_perfis = {}  # email -> geração
+_lock_geracao = threading.Lock()
+
+
+def geracao_perfis(email) -> tuple:
+    with _lock_geracao:
+        return _geracao_global, _geracoes_perfis.get(email, 0)
+
+
+def get_user_data_cached(email):
+    """get_user_data atrás do cache de perfis do processo."""
+    return perfis_processo.obter(email)
+
+
+def atualizar_perfil(email, **campos):
+    """Propaga uma mudança conhecida (créditos, plano) para o cache do processo."""
+    perfis_processo.atualizar(email, **campos)
+
+
+def invalidar_perfil(email=None):
+    """
+    Gancho de invalidação para mudanças feitas fora do app (ex.: compra de
+    plano). Limpa o cache do processo e, pela geração do email, o de todas as
+    sessões; sem email, todos os perfis de todas as sessões ficam velhos.
+    """
+    global _geracao_global
+    perfis_processo.invalidar(email)
+    with _lock_geracao:
+        if email is None:
+            _geracao_global += 1
+            _geracoes_perfis.clear()
+        else:
+            _geracoes_perfis[email] = _geracoes_perfis.get(email, 0) + 1
+
+
+# =========================================================
+# LOGIN CONSOLIDADO
+# =========================================================
+
+def _contar_ida(fluxo, destino):
+    metricas.contar("visionscan_idas_rede_total", ajuda="Chamadas de rede por fluxo de autenticação",
+                    fluxo=fluxo, destino=destino)
+
+
+def entrar_com_perfil(email, senha):
+    """
+    Login em duas idas à rede: o sign-in no Auth e a função Postgres
+    `garantir_perfil` (supabase/migrations), que cria o perfil na primeira
+    entrada e devolve a linha atual na mesma instrução.
+    Retorna o perfil, "not_confirmed", ou None se o perfil não puder ser
+    carregado. Erros de credencial do Auth propagam para a interface.
+    """
+    cliente = cliente_sessao()
+    with metricas.span("login") as span:
+        _contar_ida("login", "auth")
+        res = cliente.auth.sign_in_with_password({
+            "email": email,
+            "password": senha
+        })
+        span.anotar(idas=1)
+        if not getattr(res.user, 'email_confirmed_at', None):
+            return "not_confirmed"
+
+        try:
+            # O cliente da sessão já carrega o JWT do usuário: a função lê id/email dele
+            _contar_ida("login", "banco")
+            retorno = cliente.rpc("garantir_perfil", {}).execute()
+            span.anotar(idas=2)
+        except Exception:
+            return None
+
+    if not retorno.data:
+        return None
+    perfil = {coluna: retorno.data[0].get(coluna) for coluna in COLUNAS_PERFIL.split(",")}
+    # O próximo render da Home lê daqui em vez de voltar ao banco
+    perfis_processo.gravar(perfil["email"], perfil)
+    return perfil
+
+
 # =========================================================
 # CADASTRO SEGURO (SÓ NO AUTH)
 # =========================================================
@@ -356,26 +424,20 @@ def registar_utilizador(nome, email, senha):
         return False, "Email inválido"
     
     try:
-        # Tenta fazer login para verificar se usuário existe e está confirmado
-        try:
-            login_result = supabase.auth.sign_in_with_password({
+        # Uma única chamada: o próprio sign_up acusa emails já cadastrados
+        with metricas.span("cadastro"):
+            _contar_ida("cadastro", "auth")
+            auth_response = cliente_sessao().auth.sign_up({
                 "email": email,
-                "password": senha  # Usa a senha que o usuário está tentando cadastrar
+                "password": senha,
+                "options": {"data": {"name": nome}}
             })
-            # Se login funcionou, significa que usuário já existe e está confirmado
-            supabase.auth.sign_out()  # Desloga imediatamente
+
+        # Com confirmação de email ativa, o Auth não devolve erro para emails
+        # existentes: responde com um usuário sem identidades
+        if auth_response.user is not None and auth_response.user.identities == []:
             return False, "Esse email já possui conta, por favor faça login"
-        except Exception:
-            # Login falhou - pode ser senha errada ou usuário não existe
-            pass
-        
-        # Tenta cadastrar
-        auth_response = supabase.auth.sign_up({
-            "email": email,
-            "password": senha,
-            "options": {"data": {"name": nome}}
-        })
-        
+
         return True, "Cadastro realizado com sucesso. Verifique seu e-mail e faça login."
         
     except Exception as e:
@@ -393,30 +455,221 @@ def registar_utilizador(nome, email, senha):
 # CONTROLE DE CRÉDITOS — POR USER.ID (IMUTÁVEL)
 # =========================================================
 
-def consumir_credito(user_id: str):
+def consumir_credito():
+    """
+    Decrementa 1 crédito do usuário logado na sessão.
+    Retorna o novo saldo, ou None se não houver saldo ou em caso de erro.
+    """
+    return consumir_creditos(1)
+
+
+def consumir_creditos(quantidade: int):
     """
-    Decrementa 1 crédito do usuário pelo ID (UUID).
-    Retorna True se bem-sucedido, False caso contrário.
+    Decrementa `quantidade` créditos do usuário logado em uma única ida ao
+    banco, via a função Postgres `consumir_creditos` (supabase/migrations): o
+    teste de saldo e o UPDATE acontecem na mesma instrução, então sessões
+    concorrentes não conseguem gastar o mesmo saldo duas vezes. A conta é a
+    do JWT do cliente da sessão.
+    Retorna o novo saldo, ou None se o saldo não cobre a quantidade.
     """
     try:
-        if isinstance(user_id, str):
-            user_id = UUID(user_id)
+        with metricas.span("debito_credito") as span:
+            span.anotar(quantidade=quantidade)
+            res = cliente_sessao().rpc("consumir_creditos", {
+                "p_quantidade": quantidade
+            }).execute()
+        if res.data is None:
+            metricas.contar("visionscan_debito_recusado_total", ajuda="Débitos recusados por saldo insuficiente")
+        return res.data
 
-        res = supabase.table("users").select("credits").eq("id", user_id).execute()
-        
-        if not res.data:
-            return False
+    except Exception:
+        return None
 
-        current = res.data[0]["credits"]
-        if current <= 0:
-            return False
 
-        supabase.table("users").update({"credits": current - 1}).eq("id", user_id).execute()
-        return True
+def estornar_creditos(user_id: str, quantidade: int = 1):
+    """
+    Devolve créditos reservados para análises que falharam, pela função
+    `estornar_creditos` (supabase/migrations). Só o cliente de serviço pode
+    chamá-la: roda nos workers da fila, nunca a pedido do navegador.
+    Retorna o novo saldo, ou None em caso de erro.
+    """
+    try:
+        with metricas.span("estorno_credito") as span:
+            span.anotar(quantidade=quantidade)
+            res = cliente_servico().rpc("estornar_creditos", {
+                "p_user_id": str(user_id),
+                "p_quantidade": quantidade
+            }).execute()
+        metricas.contar("visionscan_estorno_total", ajuda="Créditos devolvidos por análises com erro")
+        return res.data
+    except Exception as e:
+        metricas.contar("visionscan_falhas_total", ajuda="Erros tratados sem interromper o fluxo, por etapa",
+                        etapa="estorno_credito")
+        log.warning("Falha ao estornar crédito de %s: %s", user_id, e)
+        return None
+
+
+async def consumir_creditos_async(quantidade: int = 1):
+    """Versão assíncrona de consumir_creditos."""
+    try:
+        cliente = await cliente_sessao_async()
+        res = await cliente.rpc("consumir_creditos", {
+            "p_quantidade": quantidade
+        }).execute()
+        return res.data
 
     except Exception:
-        return False
+        return None
     
+# =========================================================
+# HISTÓRICO DE PERÍCIAS
+# =========================================================
+# Colunas da listagem; o laudo completo só é lido em obter_laudo_historico
+COLUNAS_HISTORICO = "id,created_at,nome_arquivo,sha256,modelo,tempo_total_s,resumo"
+TAMANHO_PAGINA_HISTORICO = 20
+TAMANHO_RESUMO = 240
+
+
+def _resumo_laudo(relatorio: str) -> str:
+    """Primeiras linhas com conteúdo do laudo (a conclusão técnica vem no topo)."""
+    linhas = [linha.strip(" #*") for linha in relatorio.splitlines() if linha.strip(" #*")]
+    resumo = " · ".join(linhas)
+    return resumo[:TAMANHO_RESUMO - 1] + "…" if len(resumo) > TAMANHO_RESUMO else resumo
+
+
+def salvar_pericia(user_id: str, resultado: dict, nome_arquivo: str | None = None, cliente: Client | None = None):
+    """
+    Grava uma análise concluída no histórico do usuário. Retorna o id ou None.
+    Por padrão grava pelo cliente da sessão; os workers passam o cliente de serviço.
+    """
+    localizacao = resultado.get("localizacao") or {}
+    try:
+        with metricas.span("historico_gravacao"):
+            res = (cliente or cliente_sessao()).table("pericias").insert({
+                "user_id": str(user_id),
+                "nome_arquivo": nome_arquivo,
+                "sha256": resultado["sha256"],
+                "modelo": resultado.get("modelo"),
+                "tempo_total_s": resultado.get("tempos", {}).get("total_s"),
+                "tempos": resultado.get("tempos"),
+                "exif": resultado.get("exif"),
+                "resumo": _resumo_laudo(resultado["relatorio"]),
+                "relatorio": resultado["relatorio"],
+                "lat": localizacao.get("lat"),
+                "lon": localizacao.get("lon"),
+                "geohash": localizacao.get("geohash"),
+                "origem_localizacao": localizacao.get("origem")
+            }).execute()
+        return res.data[0]["id"] if res.data else None
+    except Exception as e:
+        metricas.contar("visionscan_falhas_total", ajuda="Erros tratados sem interromper o fluxo, por etapa",
+                        etapa="gravar_historico")
+        log.warning("Falha ao gravar histórico: %s", e)
+        return None
+
+
+def _salvar_job_no_historico(job: dict):
+    if job.get("user_id") and job.get("resultado"):
+        # Fora de qualquer sessão: grava pelo cliente de serviço, com o dono registrado no job
+        try:
+            cliente = cliente_servico()
+        except Exception as e:
+            metricas.contar("visionscan_falhas_total", ajuda="Erros tratados sem interromper o fluxo, por etapa",
+                            etapa="gravar_historico")
+            log.warning("Falha ao gravar histórico: %s", e)
+            return
+        salvar_pericia(job["user_id"], job["resultado"], job.get("nome_arquivo"), cliente=cliente)
+
+
+def _estornar_job(job: dict):
+    # liberar_cobranca garante um único estorno por job, mesmo se o gancho repetir
+    if job.get("user_id") and fila_pericias.liberar_cobranca(job["id"]):
+        estornar_creditos(job["user_id"], 1)
+
+
+def enviar_pericia(img_file, api_key: str, user_id: str):
+    """
+    Reserva um crédito e põe a análise na fila. A cobrança acontece no envio,
+    não quando a sessão vê o job concluído: logout, fechar a aba ou um
+    processo reiniciado não deixam análises sem cobrança. Se a análise falhar,
+    o worker devolve o crédito (ao_falhar).
+    Retorna (job_id, novo saldo), ou (None, None) se o crédito não pôde ser reservado.
+    """
+    saldo = consumir_credito()
+    if saldo is None:
+        return None, None
+    try:
+        job_id = fila_pericias.enviar(img_file, api_key, user_id, cobrado=True)
+    except Exception:
+        estornar_creditos(user_id, 1)
+        raise
+    return job_id, saldo
+
+
+# O worker da fila grava o histórico mesmo que o usuário já tenha saído da página
+fila_pericias.ao_concluir = _salvar_job_no_historico
+fila_pericias.ao_falhar = _estornar_job
+
+# Jobs que estavam na fila quando o processo anterior caiu voltam a rodar (já com histórico e estorno ligados)
+try:
+    fila_pericias.retomar(st.secrets["GEMINI_API_KEY"])
+except Exception as e:
+    metricas.contar("visionscan_falhas_total", ajuda="Erros tratados sem interromper o fluxo, por etapa",
+                    etapa="retomar_fila")
+    log.warning("Falha ao retomar a fila de perícias: %s", e)
+
+
+def listar_historico(user_id: str, cursor: tuple | None = None, limite: int = TAMANHO_PAGINA_HISTORICO):
+    """
+    Uma página do histórico, do mais recente ao mais antigo, só com as colunas
+    de resumo. `cursor` é o (created_at, id) do último item da página anterior.
+    Retorna (itens, cursor_da_proxima_pagina ou None).
+    """
+    try:
+        with metricas.span("historico_pagina"):
+            consulta = (
+                cliente_sessao().table("pericias")
+                .select(COLUNAS_HISTORICO)
+                .eq("user_id", str(user_id))
+            )
+            if cursor:
+                criado_em, ultimo_id = cursor
+                # Keyset: (created_at, id) < cursor, na mesma ordem do índice
+                consulta = consulta.or_(
+                    f'created_at.lt."{criado_em}",and(created_at.eq."{criado_em}",id.lt.{ultimo_id})'
+                )
+            # Um item a mais só para saber se existe próxima página
+            res = (
+                consulta.order("created_at", desc=True)
+                .order("id", desc=True)
+                .limit(limite + 1)
+                .execute()
+            )
+        itens = res.data or []
+        if len(itens) <= limite:
+            return itens, None
+        itens = itens[:limite]
+        return itens, (itens[-1]["created_at"], itens[-1]["id"])
+    except Exception:
+        return [], None
+
+
+def obter_laudo_historico(user_id: str, pericia_id: str):
+    """Laudo completo e EXIF de um item do histórico, sob demanda."""
+    try:
+        with metricas.span("historico_laudo"):
+            res = (
+                cliente_sessao().table("pericias")
+                .select("relatorio,exif")
+                .eq("id", pericia_id)
+                .eq("user_id", str(user_id))
+                .execute()
+            )
+        return res.data[0] if res.data else None
+    except Exception:
+        return None
+
+
 # =========================================================
 # RECUPERAÇÃO DE SENHA
 # =========================================================
@@ -424,13 +677,9 @@ def consumir_credito(user_id: str):
 def enviar_link_recuperacao(email):
     """Envia link de recuperação de senha via Supabase Auth"""
     try:
-        from supabase import create_client
-        supabase_local = create_client(
-            st.secrets["SUPABASE_URL"],
-            st.secrets["SUPABASE_KEY"]
-        )
-        # Usa método nativo do Supabase
-        supabase_local.auth.reset_password_email(email)
+        # Cliente da sessão: o fluxo PKCE guarda o code verifier no estado de auth
+        # dele, e a requisição sai pelo pool do processo em vez de uma conexão nova
+        cliente_sessao().auth.reset_password_email(email)
         return True, "Link de recuperação enviado para seu e-mail!"
     except Exception as e:
         error_msg = str(e).lower()
@@ -0,0 +1,215 @@
+import io
+import struct
+from typing import NamedTuple
+
+from PIL.ExifTags import GPSTAGS, TAGS
+
+# =========================================================
+# METADADOS SÓ PELO CABEÇALHO (SEM DECODIFICAR PIXELS)
+# =========================================================
+# Lê EXIF direto dos contêineres (JPEG APP1, PNG eXIf, WebP EXIF, TIFF) e
+# percorre IFD0, o sub-IFD Exif (0x8769) e o GPS (0x8825) numa só passada.
+
+TAG_EXIF_IFD = 0x8769
+TAG_GPS_IFD = 0x8825
+TAG_INTEROP_IFD = 0xA005
+TAGS_PONTEIRO = {TAG_EXIF_IFD, TAG_GPS_IFD, TAG_INTEROP_IFD}
+# Blocos binários grandes e proprietários que não ajudam a perícia
+TAGS_IGNORADAS = {0x927C, 0x8773, 0x02BC, 0x83BB}  # MakerNote, ICC, XMP, IPTC
+MAX_BYTES_VALOR = 256
+
+# tipo TIFF -> (formato struct, tamanho)
+_TIPOS = {
+    1: ("B", 1), 2: ("s", 1), 3: ("H", 2), 4: ("L", 4), 5: ("LL", 8),
+    6: ("b", 1), 7: ("s", 1), 8: ("h", 2), 9: ("l", 4), 10: ("ll", 8),
+    11: ("f", 4), 12: ("d", 8)
+}
+
+
+class Metadados(NamedTuple):
+    """Campos EXIF tipados por IFD; coordenadas em graus decimais quando houver GPS válido."""
+    formato: str | None
+    base: dict
+    exif: dict
+    gps: dict
+    coordenadas: tuple | None
+
+    def vazio(self) -> bool:
+        return not (self.base or self.exif or self.gps)
+
+
+# =========================================================
+# CONTÊINERES
+# =========================================================
+def _tiff_jpeg(f):
+    if f.read(2) != b"\xff\xd8":
+        return None
+    while True:
+        marcador = f.read(2)
+        if len(marcador) < 2 or marcador[0] != 0xFF:
+            return None
+        tipo = marcador[1]
+        if tipo == 0xFF:
+            # Byte de preenchimento: reposiciona e tenta de novo
+            f.seek(-1, io.SEEK_CUR)
+            continue
+        if tipo in (0xD9, 0xDA):  # EOI / SOS: começou a imagem, acabou o cabeçalho
+            return None
+        if 0xD0 <= tipo <= 0xD7 or tipo == 0x01:
+            continue
+        tamanho_bytes = f.read(2)
+        if len(tamanho_bytes) < 2:
+            return None
+        tamanho = struct.unpack(">H", tamanho_bytes)[0] - 2
+        if tipo == 0xE1:
+            dados = f.read(tamanho)
+            if dados.startswith(b"Exif\x00\x00"):
+                return dados[6:]
+        else:
+            f.seek(tamanho, io.SEEK_CUR)
+
+
+def _tiff_png(f):
+    if f.read(8) != b"\x89PNG\r\n\x1a\n":
+        return None
+    while True:
+        cabecalho = f.read(8)
+        if len(cabecalho) < 8:
+            return None
+        tamanho, tipo = struct.unpack(">I4s", cabecalho)
+        if tipo == b"eXIf":
+            return f.read(tamanho)
+        if tipo == b"IEND":
+            return None
+        # Pula dados + CRC sem ler (inclusive IDAT, já que alguns encoders põem eXIf no fim)
+        f.seek(tamanho + 4, io.SEEK_CUR)
+
+
+def _tiff_webp(f):
+    cabecalho = f.read(12)
+    if len(cabecalho) < 12 or cabecalho[:4] != b"RIFF" or cabecalho[8:12] != b"WEBP":
+        return None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            return None
+        tipo, tamanho = struct.unpack("<4sI", chunk)
+        if tipo == b"EXIF":
+            dados = f.read(tamanho)
+            return dados[6:] if dados.startswith(b"Exif\x00\x00") else dados
+        f.seek(tamanho + (tamanho & 1), io.SEEK_CUR)
+
+
+def _detectar(inicio: bytes):
+    if inicio.startswith(b"\xff\xd8"):
+        return "JPEG", _tiff_jpeg
+    if inicio.startswith(b"\x89PNG"):
+        return "PNG", _tiff_png
+    if inicio[:4] == b"RIFF" and inicio[8:12] == b"WEBP":
+        return "WEBP", _tiff_webp
+    if inicio[:4] in (b"II*\x00", b"MM\x00*"):
+        return "TIFF", lambda f: f.read()
+    return None, None
+
+
+# =========================================================
+# TIFF / IFD
+# =========================================================
+def _valor(tiff: bytes, ordem: str, tipo: int, contagem: int, campo: bytes):
+    formato, tamanho = _TIPOS[tipo]
+    total = tamanho * contagem
+    if total > 4:
+        offset = struct.unpack(ordem + "L", campo)[0]
+        if total > MAX_BYTES_VALOR and tipo in (1, 2, 7):
+            return None
+        bruto = tiff[offset:offset + total]
+        if len(bruto) < total:
+            return None
+    else:
+        bruto = campo[:total]
+
+    if tipo == 2:
+        return bruto.split(b"\x00", 1)[0].decode("utf-8", errors="ignore").strip()
+    # UNDEFINED e sequências longas de BYTE costumam ser texto (UserComment, versões)
+    if tipo == 7 or (tipo == 1 and contagem > 4):
+        if bruto[:8] in (b"ASCII\x00\x00\x00", b"UNICODE\x00", b"\x00" * 8):
+            bruto = bruto[8:]
+        texto = bruto.rstrip(b"\x00").decode("utf-8", errors="ignore").strip()
+        return texto if texto.isprintable() else bruto.hex()
+
+    valores = struct.unpack(ordem + formato[-1] * (len(formato) * contagem), bruto)
+    if tipo in (5, 10):
+        valores = tuple(n / d if d else 0.0 for n, d in zip(valores[::2], valores[1::2]))
+    return valores[0] if len(valores) == 1 else valores
+
+
+def _ler_ifd(tiff: bytes, ordem: str, offset: int, nomes: dict, visitados: set):
+    campos, ponteiros = {}, {}
+    if offset in visitados or offset + 2 > len(tiff):
+        return campos, ponteiros
+    visitados.add(offset)
+
+    quantidade = struct.unpack_from(ordem + "H", tiff, offset)[0]
+    for i in range(quantidade):
+        inicio = offset + 2 + i * 12
+        if inicio + 12 > len(tiff):
+            break
+        tag, tipo, contagem = struct.unpack_from(ordem + "HHL", tiff, inicio)
+        campo = tiff[inicio + 8:inicio + 12]
+        if tipo not in _TIPOS or tag in TAGS_IGNORADAS:
+            continue
+        if tag in TAGS_PONTEIRO:
+            ponteiros[tag] = struct.unpack(ordem + "L", campo)[0]
+            continue
+        try:
+            valor = _valor(tiff, ordem, tipo, contagem, campo)
+        except struct.error:
+            continue
+        if valor is not None and valor != "":
+            campos[nomes.get(tag, f"0x{tag:04X}")] = valor
+    return campos, ponteiros
+
+
+def _graus(valor, ref):
+    if not isinstance(valor, tuple) or len(valor) != 3 or not ref:
+        return None
+    graus = valor[0] + valor[1] / 60.0 + valor[2] / 3600.0
+    return -graus if ref in ("S", "W") else graus
+
+
+def ler_tiff(tiff: bytes):
+    """Percorre IFD0, Exif e GPS de um bloco TIFF. Retorna (base, exif, gps)."""
+    if len(tiff) < 8 or tiff[:2] not in (b"II", b"MM"):
+        return {}, {}, {}
+    ordem = "<" if tiff[:2] == b"II" else ">"
+    ifd0 = struct.unpack_from(ordem + "L", tiff, 4)[0]
+    visitados = set()
+
+    base, ponteiros = _ler_ifd(tiff, ordem, ifd0, TAGS, visitados)
+    exif = gps = {}
+    if TAG_EXIF_IFD in ponteiros:
+        exif, _ = _ler_ifd(tiff, ordem, ponteiros[TAG_EXIF_IFD], TAGS, visitados)
+    if TAG_GPS_IFD in ponteiros:
+        gps, _ = _ler_ifd(tiff, ordem, ponteiros[TAG_GPS_IFD], GPSTAGS, visitados)
+    return base, exif, gps
+
+
+def ler_metadados(fonte) -> Metadados:
+    """
+    Extrai metadados de bytes, memoryview ou stream binário com seek, lendo
+    só os cabeçalhos do contêiner. Nunca decodifica pixels.
+    """
+    f = io.BytesIO(fonte) if isinstance(fonte, (bytes, bytearray, memoryview)) else fonte
+    posicao = f.tell()
+    try:
+        formato, extrair = _detectar(f.read(12))
+        f.seek(posicao)
+        tiff = extrair(f) if extrair else None
+    finally:
+        f.seek(posicao)
+
+    base, exif, gps = ler_tiff(tiff) if tiff else ({}, {}, {})
+    lat = _graus(gps.get("GPSLatitude"), gps.get("GPSLatitudeRef"))
+    lon = _graus(gps.get("GPSLongitude"), gps.get("GPSLongitudeRef"))
+    coordenadas = (lat, lon) if lat is not None and lon is not None else None
+    return Metadados(formato, base, exif, gps, coordenadas)
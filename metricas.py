@@ -0,0 +1,207 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# =========================================================
+# MÉTRICAS E SPANS (FORMATO PROMETHEUS)
+# =========================================================
+# Limites dos buckets de latência, em segundos
+BUCKETS_LATENCIA = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BUCKETS_BYTES = (64e3, 256e3, 1e6, 4e6, 16e6, 64e6)
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _rotulos(rotulos: tuple) -> str:
+    if not rotulos:
+        return ""
+    return "{" + ",".join(f'{k}="{_escapar(v)}"' for k, v in rotulos) + "}"
+
+
+class _Histograma:
+    def __init__(self, limites):
+        self.limites = limites
+        self.contagens = [0] * (len(limites) + 1)
+        self.soma = 0.0
+        self.total = 0
+
+    def observar(self, valor: float):
+        self.contagens[bisect.bisect_left(self.limites, valor)] += 1
+        self.soma += valor
+        self.total += 1
+
+    def quantil(self, q: float) -> float | None:
+        """Quantil aproximado pelo limite superior do bucket (como o histogram_quantile)."""
+        if not self.total:
+            return None
+        alvo = q * self.total
+        acumulado = 0
+        for limite, contagem in zip(self.limites, self.contagens):
+            acumulado += contagem
+            if acumulado >= alvo:
+                return limite
+        return float("inf")
+
+
+class Span:
+    """Uma etapa medida; atributos extras entram no registro do span."""
+
+    def __init__(self, etapa: str, rotulos: dict):
+        self.etapa = etapa
+        self.rotulos = rotulos
+        self.atributos = {}
+
+    def anotar(self, **atributos):
+        self.atributos.update({k: v for k, v in atributos.items() if v is not None})
+
+
+class Metricas:
+    """
+    Registro de histogramas e contadores do processo. Spans alimentam o
+    histograma de latência por (etapa, modelo) e o contador de execuções por
+    status; a exposição é em texto Prometheus, por HTTP ou arquivo.
+    """
+
+    def __init__(self, arquivo_spans: str | None = None):
+        self.arquivo_spans = arquivo_spans
+        self._histogramas = {}  # (nome, rótulos) -> _Histograma
+        self._contadores = {}  # (nome, rótulos) -> valor
+        self._ajuda = {}
+        self._lock = threading.Lock()
+
+    def contar(self, nome: str, valor: float = 1, ajuda: str = "", **rotulos):
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self._lock:
+            self._ajuda.setdefault(nome, (ajuda, "counter"))
+            self._contadores[chave] = self._contadores.get(chave, 0) + valor
+
+    def observar(self, nome: str, valor: float, limites=BUCKETS_LATENCIA, ajuda: str = "", **rotulos):
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self._lock:
+            self._ajuda.setdefault(nome, (ajuda, "histogram"))
+            histograma = self._histogramas.get(chave)
+            if histograma is None:
+                histograma = self._histogramas[chave] = _Histograma(limites)
+            histograma.observar(valor)
+
+    def quantil(self, nome: str, q: float, amostras_min: int = 1, **rotulos) -> float | None:
+        """Quantil aproximado de um histograma; None enquanto houver poucas amostras."""
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self._lock:
+            histograma = self._histogramas.get(chave)
+            if histograma is None or histograma.total < amostras_min:
+                return None
+            return histograma.quantil(q)
+
+    @contextmanager
+    def span(self, etapa: str, **rotulos):
+        """Mede a etapa; exceções são contadas como status="erro" e propagadas."""
+        span = Span(etapa, rotulos)
+        inicio = time.perf_counter()
+        status = "ok"
+        try:
+            yield span
+        except BaseException:
+            status = "erro"
+            raise
+        finally:
+            duracao = time.perf_counter() - inicio
+            rotulos = {"etapa": etapa, **span.rotulos}
+            self.observar("visionscan_etapa_segundos", duracao,
+                          ajuda="Latência por etapa do pipeline", **rotulos)
+            self.contar("visionscan_etapa_total", ajuda="Execuções por etapa e status",
+                        status=status, **rotulos)
+            if self.arquivo_spans:
+                self._gravar_span(span, duracao, status)
+
+    def _gravar_span(self, span: Span, duracao: float, status: str):
+        registro = {
+            "ts": time.time(),
+            "etapa": span.etapa,
+            "duracao_s": round(duracao, 6),
+            "status": status,
+            **span.rotulos,
+            **span.atributos
+        }
+        try:
+            with self._lock, open(self.arquivo_spans, "a", encoding="utf-8") as f:
+                f.write(json.dumps(registro, ensure_ascii=False, default=str) + "\n")
+        except OSError:
+            pass
+
+    def exportar_prometheus(self) -> str:
+        linhas = []
+        with self._lock:
+            nomes = sorted(self._ajuda)
+            for nome in nomes:
+                ajuda, tipo = self._ajuda[nome]
+                linhas.append(f"# HELP {nome} {ajuda}")
+                linhas.append(f"# TYPE {nome} {tipo}")
+                if tipo == "counter":
+                    for (n, rotulos), valor in sorted(self._contadores.items()):
+                        if n == nome:
+                            linhas.append(f"{nome}{_rotulos(rotulos)} {valor}")
+                    continue
+                for (n, rotulos), h in sorted(self._histogramas.items(), key=lambda i: i[0]):
+                    if n != nome:
+                        continue
+                    acumulado = 0
+                    for limite, contagem in zip(h.limites + (float("inf"),), h.contagens):
+                        acumulado += contagem
+                        le = "+Inf" if limite == float("inf") else repr(float(limite))
+                        linhas.append(f"{nome}_bucket{_rotulos(rotulos + (('le', le),))} {acumulado}")
+                    linhas.append(f"{nome}_sum{_rotulos(rotulos)} {h.soma}")
+                    linhas.append(f"{nome}_count{_rotulos(rotulos)} {h.total}")
+        return "\n".join(linhas) + "\n"
+
+    def resumo(self) -> dict:
+        """p50/p95/total por etapa e modelo, para inspeção local."""
+        with self._lock:
+            return {
+                ",".join(f"{k}={v}" for k, v in rotulos): {
+                    "total": h.total,
+                    "p50_s": h.quantil(0.5),
+                    "p95_s": h.quantil(0.95)
+                }
+                for (nome, rotulos), h in self._histogramas.items()
+                if nome == "visionscan_etapa_segundos"
+            }
+
+    def gravar_prometheus(self, caminho: str):
+        """Grava o texto Prometheus de forma atômica (textfile collector do node_exporter)."""
+        temporario = f"{caminho}.tmp"
+        with open(temporario, "w", encoding="utf-8") as f:
+            f.write(self.exportar_prometheus())
+        os.replace(temporario, caminho)
+
+    def iniciar_servidor(self, porta: int, host: str = "0.0.0.0"):
+        """Expõe /metrics em uma thread daemon."""
+        metricas = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+                corpo = metricas.exportar_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(corpo)))
+                self.end_headers()
+                self.wfile.write(corpo)
+
+            def log_message(self, *args):
+                pass
+
+        servidor = ThreadingHTTPServer((host, porta), _Handler)
+        threading.Thread(target=servidor.serve_forever, name="metricas-http", daemon=True).start()
+        return servidor
+
+
+metricas = Metricas(arquivo_spans=os.environ.get("VISIONSCAN_SPANS"))
@@ -0,0 +1,938 @@
+import google.generativeai as genai
+from google.generativeai import client as genai_client
+import PIL.Image
+import numpy as np
+import asyncio
+import hashlib
+import io
+import itertools
+import logging
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import NamedTuple
+from cache_resultados import CacheResultados
+from geoindice import RAIO_PADRAO_KM, IndiceGeografico, coordenadas_do_laudo, geohash
+from hash_perceptual import DISTANCIA_PADRAO, IndiceHamming, phash
+from ingestao import EvidenciaRejeitada, abrir_evidencia, abrir_leitor, reservar_decodificacao, validar_dimensoes
+from metadados import ler_metadados
+from metricas import BUCKETS_BYTES, metricas
+from resiliencia import Invocador
+
+log = logging.getLogger(__name__)
+
+# =========================================================
+# CATÁLOGO DE MODELOS (CACHE POR PROCESSO)
+# =========================================================
+MODELOS_PREFERIDOS = [
+    "gemini-1.5-pro",
+    "gemini-1.5-flash",
+    "gemini-1.0-pro"
+]
+MODELO_PADRAO = "gemini-pro"
+# Modelos da geração 1.0 não aceitam system_instruction; neles as instruções vão no prompt
+PREFIXOS_SEM_INSTRUCAO_SISTEMA = ("gemini-1.0", "gemini-pro")
+
+
+def aceita_instrucao_sistema(modelo: str) -> bool:
+    return not modelo.startswith(PREFIXOS_SEM_INSTRUCAO_SISTEMA)
+
+
+class CatalogoModelos:
+    """
+    Catálogo de modelos Gemini compartilhado pelo processo, indexado por API key.
+    Entradas expiradas continuam sendo servidas enquanto uma thread em segundo
+    plano refaz a listagem, então só a primeira resolução paga o list_models().
+    """
+
+    def __init__(self, ttl: float = 900.0, preferidos=None):
+        self.ttl = ttl
+        self.preferidos = list(preferidos or MODELOS_PREFERIDOS)
+        self._entradas = {}  # chave -> (expira_em, modelo_escolhido, modelos)
+        self._atualizando = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _chave(api_key: str) -> str:
+        # Não guarda a API key em claro como chave do dicionário
+        return hashlib.sha256(api_key.encode()).hexdigest()
+
+    def _listar(self, api_key: str):
+        pool_modelos.configurar(api_key)
+        # A API devolve "models/gemini-1.5-pro"; normaliza para comparar com os preferidos
+        return [
+            m.name.removeprefix("models/") for m in genai.list_models()
+            if "generateContent" in m.supported_generation_methods
+        ]
+
+    def _escolher(self, modelos) -> str:
+        return next(
+            (m for m in self.preferidos if m in modelos),
+            modelos[0] if modelos else MODELO_PADRAO
+        )
+
+    def atualizar(self, api_key: str) -> str:
+        """Refaz a listagem de modelos e grava o resultado no catálogo."""
+        chave = self._chave(api_key)
+        try:
+            modelos = self._listar(api_key)
+            escolhido = self._escolher(modelos)
+            with self._lock:
+                self._entradas[chave] = (time.monotonic() + self.ttl, escolhido, modelos)
+            return escolhido
+        finally:
+            with self._lock:
+                self._atualizando.discard(chave)
+
+    def _atualizar_em_segundo_plano(self, api_key: str):
+        chave = self._chave(api_key)
+        with self._lock:
+            if chave in self._atualizando:
+                return
+            self._atualizando.add(chave)
+
+        def _rodar():
+            try:
+                self.atualizar(api_key)
+            except Exception as e:
+                metricas.contar("visionscan_falhas_total", ajuda="Erros tratados sem interromper o fluxo, por etapa",
+                                etapa="catalogo_modelos")
+                log.warning("Falha ao atualizar catálogo de modelos: %s", e)
+
+        threading.Thread(target=_rodar, name="catalogo-modelos", daemon=True).start()
+
+    def escolher(self, api_key: str) -> str:
+        """Retorna o modelo preferido disponível para a API key."""
+        with self._lock:
+            entrada = self._entradas.get(self._chave(api_key))
+        if entrada is None:
+            return self.atualizar(api_key)
+
+        expira_em, escolhido, _ = entrada
+        if time.monotonic() >= expira_em:
+            self._atualizar_em_segundo_plano(api_key)
+        return escolhido
+
+    def aquecer(self, api_key: str):
+        """Dispara a listagem em segundo plano (ex.: no início do processo)."""
+        self._atualizar_em_segundo_plano(api_key)
+
+    def alternativas(self, api_key: str) -> list:
+        """Demais modelos preferidos disponíveis para a API key, na ordem de preferência."""
+        with self._lock:
+            entrada = self._entradas.get(self._chave(api_key))
+        if entrada is None:
+            return []
+        _, escolhido, modelos = entrada
+        return [m for m in self.preferidos if m in modelos and m != escolhido]
+
+    def invalidar(self, api_key: str | None = None):
+        """Descarta o catálogo de uma API key, ou de todas se nenhuma for informada."""
+        with self._lock:
+            if api_key is None:
+                self._entradas.clear()
+            else:
+                self._entradas.pop(self._chave(api_key), None)
+
+
+catalogo_modelos = CatalogoModelos()
+
+# =========================================================
+# PIPELINE DE IMAGEM (DECODIFICAÇÃO ÚNICA)
+# =========================================================
+MAX_PIXELS = 3500000  # Limite do Gemini
+# Bytes enviados ao modelo por imagem; originais acima disso são recodificados
+ORCAMENTO_PAYLOAD = 2 * 1024 * 1024
+# Imagens com muito texto (prints, documentos) ganham mais bytes e qualidade mínima maior
+ORCAMENTO_PAYLOAD_DETALHE = 4 * 1024 * 1024
+QUALIDADE_MAX = 92
+QUALIDADE_MIN = 50
+QUALIDADE_MIN_DETALHE = 80
+# Margem do reduce() antes do LANCZOS final (o mesmo valor usado pelo Image.thumbnail)
+REDUCING_GAP = 3.0
+FORMATOS_REPASSE = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp"
+}
+
+def _formatar_valor(valor) -> str:
+    if isinstance(valor, float):
+        return f"{valor:g}"
+    if isinstance(valor, tuple):
+        return ", ".join(_formatar_valor(v) for v in valor)
+    return str(valor)
+
+
+def _extrair_exif(original_bytes):
+    """
+    Monta o bloco de EXIF do prompt lendo só os cabeçalhos do arquivo (IFD0, Exif e GPS).
+    Retorna (texto, coordenadas GPS ou None).
+    """
+    try:
+        meta = ler_metadados(original_bytes)
+        if meta.vazio():
+            return "\nNenhum metadado EXIF encontrado na imagem.\n", None
+
+        exif_info = "\nMETADADOS EXIF ENCONTRADOS:\n"
+        for campos in (meta.base, meta.exif, meta.gps):
+            for key, value in campos.items():
+                exif_info += f"- {key}: {_formatar_valor(value)}\n"
+        if meta.coordenadas:
+            lat, lon = meta.coordenadas
+            exif_info += f"- GPS Coordinates: {lat:.6f}, {lon:.6f}\n"
+        return exif_info, meta.coordenadas
+
+    except Exception as exif_error:
+        return f"\nErro ao extrair metadados EXIF: {str(exif_error)}\n", None
+
+
+def _mime_repasse(img, original_bytes) -> str | None:
+    """Mime type quando o original já está dentro dos limites e vai sem recodificar."""
+    mime_type = FORMATOS_REPASSE.get(img.format)
+    if (
+        mime_type
+        and img.width * img.height <= MAX_PIXELS
+        and len(original_bytes) <= ORCAMENTO_PAYLOAD
+    ):
+        return mime_type
+    return None
+
+
+def _reduzir_imagem(img):
+    """
+    Decodifica uma única vez e redimensiona para o alvo, desde que a
+    decodificação caiba no orçamento de memória por análise.
+    """
+    current_pixels = img.width * img.height
+    # Tamanho final calculado sobre as dimensões originais (mantém proporção)
+    tamanho_alvo = _tamanho_alvo(img.width, img.height)
+
+    if tamanho_alvo != img.size:
+        # JPEG: o decoder já escala no domínio DCT (1/2, 1/4, 1/8) para perto do alvo
+        img.draft("RGB", tamanho_alvo)
+    modo_saida = img.mode if img.mode in ("RGB", "L") else "RGB"
+
+    # O bitmap completo só existe dentro da reserva; a saída é do tamanho do alvo
+    with reservar_decodificacao(img, tamanho_alvo[0] * tamanho_alvo[1], modo_saida):
+        with metricas.span("decode", formato=img.format or "?") as span:
+            span.anotar(pixels=current_pixels, pixels_decodificados=img.width * img.height)
+            img.load()
+            if img.mode != modo_saida:
+                img = img.convert(modo_saida)
+
+        if img.size != tamanho_alvo:
+            with metricas.span("resize") as span:
+                span.anotar(pixels=img.width * img.height, pixels_saida=tamanho_alvo[0] * tamanho_alvo[1])
+                # reduce() por fator inteiro até ~3x o alvo e só então o LANCZOS
+                img = img.resize(tamanho_alvo, PIL.Image.LANCZOS, reducing_gap=REDUCING_GAP)
+    return img
+
+
+def _imagem_para_hash(img, original_bytes):
+    """
+    A imagem sobre a qual o pHash é calculado: o original no repasse, senão a
+    versão reduzida. Indexação e busca passam por aqui para comparar hashes
+    feitos pelo mesmo caminho.
+    """
+    return img if _mime_repasse(img, original_bytes) else _reduzir_imagem(img)
+
+
+def _preparar_imagem(img, original_bytes):
+    """
+    Retorna (parte de imagem para o generate_content, imagem para o hash).
+    Se o original já está dentro dos limites, repassa os bytes sem decodificar
+    nem recodificar; caso contrário reduz com _reduzir_imagem e recodifica.
+    A imagem devolvida é a mesma de _imagem_para_hash, sem outra decodificação.
+    """
+    mime_type = _mime_repasse(img, original_bytes)
+    if mime_type:
+        return {"mime_type": mime_type, "data": bytes(original_bytes)}, img
+    reduzida = _reduzir_imagem(img)
+    return codificar_imagem(reduzida), reduzida
+
+
+def _tamanho_alvo(largura: int, altura: int):
+    pixels = largura * altura
+    if pixels <= MAX_PIXELS:
+        return largura, altura
+    ratio = (MAX_PIXELS / pixels) ** 0.5
+    return int(largura * ratio), int(altura * ratio)
+
+
+def _parece_texto(img) -> bool:
+    """
+    Heurística barata num recorte central em resolução nativa: prints e
+    documentos têm fundo chapado e bordas abruptas; fotos e ruído, não.
+    """
+    lado_x, lado_y = min(512, img.width), min(512, img.height)
+    x, y = (img.width - lado_x) // 2, (img.height - lado_y) // 2
+    pixels = np.asarray(img.crop((x, y, x + lado_x, y + lado_y)).convert("L"), dtype=np.int16)
+    if pixels.shape[1] < 2:
+        return False
+    gradiente = np.abs(np.diff(pixels, axis=1))
+    return float((gradiente > 96).mean()) > 0.03 and float((gradiente <= 2).mean()) > 0.5
+
+
+def _codificar(img, formato: str, qualidade: int) -> bytes:
+    saida = io.BytesIO()
+    if formato == "WEBP":
+        img.save(saida, format="WEBP", quality=qualidade, method=4)
+    else:
+        img.save(saida, format="JPEG", quality=qualidade, optimize=True)
+    return saida.getvalue()
+
+
+def codificar_imagem(img, alta_definicao: bool | None = None) -> dict:
+    """
+    Codifica a imagem já redimensionada dentro do orçamento de bytes:
+    fotos vão em JPEG e imagens com texto em WebP (bordas nítidas), com a
+    maior qualidade que caiba no orçamento achada por busca binária.
+    """
+    if alta_definicao is None:
+        alta_definicao = _parece_texto(img)
+    formato = "WEBP" if alta_definicao else "JPEG"
+    orcamento = ORCAMENTO_PAYLOAD_DETALHE if alta_definicao else ORCAMENTO_PAYLOAD
+    minima = QUALIDADE_MIN_DETALHE if alta_definicao else QUALIDADE_MIN
+
+    with metricas.span("codificacao", formato=formato) as span:
+        dados = _codificar(img, formato, QUALIDADE_MAX)
+        qualidade, tentativas = QUALIDADE_MAX, 1
+        if len(dados) > orcamento:
+            baixa, alta = minima, QUALIDADE_MAX - 1
+            qualidade, dados = minima, None
+            while baixa <= alta:
+                meio = (baixa + alta) // 2
+                candidato = _codificar(img, formato, meio)
+                tentativas += 1
+                if len(candidato) <= orcamento:
+                    qualidade, dados = meio, candidato
+                    baixa = meio + 1
+                else:
+                    alta = meio - 1
+            if dados is None:
+                # Nem a qualidade mínima coube: segue com ela mesmo assim
+                dados = _codificar(img, formato, minima)
+                tentativas += 1
+
+        pixels_bytes = img.width * img.height * len(img.getbands())
+        span.anotar(qualidade=qualidade, bytes=len(dados), tentativas=tentativas,
+                    razao=round(len(dados) / pixels_bytes, 4), alta_definicao=alta_definicao)
+    metricas.observar("visionscan_payload_bytes", len(dados), limites=BUCKETS_BYTES,
+                      ajuda="Bytes de imagem enviados ao modelo", formato=formato)
+    return {"mime_type": f"image/{formato.lower()}", "data": dados}
+
+
+# =========================================================
+# CACHE DE LAUDOS
+# =========================================================
+# Incrementar sempre que o texto do prompt mudar, para não servir laudos antigos
+PROMPT_VERSAO = "2024.3"
+
+cache_resultados = CacheResultados()
+
+# =========================================================
+# INSTRUÇÕES DO SISTEMA E POOL DE MODELOS
+# =========================================================
+# Parte fixa do prompt (versionada por PROMPT_VERSAO); por análise só vão o EXIF e a imagem
+INSTRUCOES_SISTEMA = """
+Você é um Analista Sênior em Inteligência Visual e Geolocalização por Imagem, especializado em precisão técnica, rastreabilidade de evidências e inferência baseada em dados objetivos.
+Sua função não é gerar respostas genéricas, mas produzir conclusões claras, justificáveis e hierarquizadas, sempre deixando explícita a base de cada decisão.
+
+REGRA FUNDAMENTAL
+Os metadados EXIF extraídos do arquivo acompanham cada imagem, na própria mensagem.
+Se a imagem contiver metadados (EXIF), eles devem ser avaliados antes de qualquer inferência visual e tratados como evidência primária.
+A inferência visual:
+
+Deve complementar, confirmar ou questionar os metadados
+Nunca deve substituí-los sem justificativa técnica clara
+
+🧾 ESTRUTURA OBRIGATÓRIA DO RELATÓRIO
+
+1. CONCLUSÃO TÉCNICA (RESUMO EXECUTIVO)
+
+Apresente imediatamente:
+
+Localização mais provável (cidade, região ou zona geográfica compatível)
+
+Coordenadas estimadas, numa linha própria e exatamente no formato:
+COORDENADAS ESTIMADAS: <latitude>, <longitude>
+(graus decimais; omita a linha se não houver base técnica para estimar)
+
+Fonte principal da inferência:
+Metadados
+Análise visual
+Cruzamento entre ambos
+Grau geral de confiança (em %)
+Observação crítica sobre a confiabilidade do resultado (quando aplicável)
+
+⚠️ Esta seção deve ser direta, objetiva e conclusiva.
+Nenhuma explicação longa deve aparecer aqui.
+
+2. VERIFICAÇÃO E ANÁLISE DE METADADOS
+
+Informe explicitamente:
+Se existem ou não metadados na imagem
+Caso existam, liste:
+Coordenadas GPS
+Data e hora de captura
+Dispositivo ou câmera
+
+Avalie:
+
+Consistência interna
+
+Indícios de remoção ou alteração
+
+Classifique os metadados como:
+
+Confiáveis
+
+Parcialmente confiáveis
+
+Inconclusivos
+
+⚠️ Se houver GPS válido e consistente, ele deve ser considerado a base principal da conclusão, salvo forte evidência contrária.
+
+3. OBSERVAÇÕES VISUAIS OBJETIVAS
+
+Descreva somente o que é visível, sem interpretação:
+
+Vegetação
+
+Solo
+
+Construções
+
+Infraestrutura
+
+Relevo
+
+Clima aparente
+
+Elementos culturais ou estruturais visíveis
+
+Nenhuma inferência deve aparecer nesta seção.
+
+4. CRUZAMENTO ENTRE METADADOS E ANÁLISE VISUAL
+
+Avalie se os elementos visuais confirmam ou contradizem os metadados
+
+Aponte convergências e divergências
+
+Caso haja conflito:
+
+Explique qual evidência tem maior peso
+
+Justifique tecnicamente a decisão
+
+5. INFERÊNCIA GEOGRÁFICA COMPLEMENTAR
+
+Somente execute esta etapa se:
+
+Não houver metadados
+OU
+
+Os metadados forem inconclusivos
+OU
+
+A validação visual for necessária
+
+Indique:
+
+Regiões compatíveis
+
+Classificação de probabilidade:
+
+Alta
+
+Média
+
+Baixa
+
+6. LIMITAÇÕES DA ANÁLISE
+
+Liste objetivamente os fatores que reduzem a precisão:
+
+Resolução da imagem
+
+Ângulo ou enquadramento
+
+Iluminação
+
+Ausência de referências claras
+
+Possível compressão ou edição
+
+⛔ RESTRIÇÕES ABSOLUTAS
+
+Proibido usar linguagem vaga sem justificativa
+
+Proibido pular etapas
+
+Proibido ignorar metadados existentes
+
+Proibido substituir evidência por opinião
+
+Proibido apresentar hipóteses como fatos
+"""
+
+
+class PoolModelos:
+    """
+    GenerativeModel já configurados, reaproveitados por (API key, modelo).
+    O genai.configure é global no SDK, então só é refeito quando a chave muda.
+    O SDK guarda um único cliente assíncrono por processo, mas ele fica preso
+    ao event loop em que nasceu; por isso cada loop tem os próprios modelos,
+    ligados a um cliente assíncrono criado para aquele loop. Isso usa partes
+    internas do SDK (_async_client e _client_manager), por isso a versão do
+    google-generativeai é fixada no requirements.txt.
+    """
+
+    def __init__(self, instrucoes: str = INSTRUCOES_SISTEMA):
+        self.instrucoes = instrucoes
+        self._modelos = {}  # (chave, modelo) -> GenerativeModel
+        self._por_loop = weakref.WeakKeyDictionary()  # loop -> {(chave, modelo): GenerativeModel}
+        self._clientes_async = weakref.WeakKeyDictionary()  # loop -> {chave: GenerativeServiceAsyncClient}
+        self._chave_configurada = None
+        self._lock = threading.Lock()
+
+    def configurar(self, api_key: str):
+        chave = CatalogoModelos._chave(api_key)
+        with self._lock:
+            if chave != self._chave_configurada:
+                genai.configure(api_key=api_key)
+                self._chave_configurada = chave
+
+    def _obter(self, modelos: dict, api_key: str, modelo: str):
+        self.configurar(api_key)
+        chave = (CatalogoModelos._chave(api_key), modelo)
+        with self._lock:
+            instancia = modelos.get(chave)
+            if instancia is None:
+                instancia = modelos[chave] = genai.GenerativeModel(
+                    model_name=modelo,
+                    system_instruction=self.instrucoes if aceita_instrucao_sistema(modelo) else None
+                )
+        return instancia
+
+    def obter(self, api_key: str, modelo: str):
+        return self._obter(self._modelos, api_key, modelo)
+
+    def obter_async(self, api_key: str, modelo: str):
+        """Modelo para generate_content_async no event loop em execução."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            modelos = self._por_loop.setdefault(loop, {})
+        instancia = self._obter(modelos, api_key, modelo)
+        if instancia._async_client is None:
+            instancia._async_client = self._cliente_async(loop, api_key)
+        return instancia
+
+    def _cliente_async(self, loop, api_key: str):
+        chave = CatalogoModelos._chave(api_key)
+        with self._lock:
+            clientes = self._clientes_async.setdefault(loop, {})
+            if chave not in clientes:
+                # Mesma configuração do genai.configure, mas sem o cache global do SDK
+                clientes[chave] = genai_client._client_manager.make_client("generative_async")
+            return clientes[chave]
+
+    def conteudo(self, modelo: str, conteudo: list) -> list:
+        """Partes do prompt para o modelo; sem system_instruction, as instruções vão na frente."""
+        if aceita_instrucao_sistema(modelo):
+            return conteudo
+        return [self.instrucoes, *conteudo]
+
+    def invalidar(self):
+        with self._lock:
+            self._modelos.clear()
+            self._por_loop.clear()
+            self._clientes_async.clear()
+            self._chave_configurada = None
+
+
+pool_modelos = PoolModelos()
+invocador = Invocador()
+
+# =========================================================
+# ÍNDICE DE QUASE-DUPLICATAS (HASH PERCEPTUAL)
+# =========================================================
+indice_perceptual = IndiceHamming()
+
+
+def buscar_semelhantes(img_file, distancia: int = DISTANCIA_PADRAO):
+    """
+    Retorna [(distancia, sha256)] de evidências já analisadas que são
+    versões redimensionadas/recomprimidas da imagem enviada.
+    """
+    if img_file is None:
+        return []
+    try:
+        with abrir_evidencia(img_file) as conteudo:
+            sha = hashlib.sha256(conteudo).hexdigest()
+            img = PIL.Image.open(abrir_leitor(conteudo))
+            validar_dimensoes(img)
+            # Mesmo caminho de redução da indexação: a distância mede a imagem, não o preparo
+            valor = phash(_imagem_para_hash(img, conteudo))
+        return [(d, ref) for d, ref in indice_perceptual.buscar(valor, distancia) if ref != sha]
+    except Exception:
+        return []
+
+
+def _hash_perceptual(img) -> int | None:
+    """pHash da imagem de _imagem_para_hash, já produzida pelo preparo."""
+    try:
+        with metricas.span("hash_perceptual"):
+            return phash(img)
+    except Exception as e:
+        metricas.contar("visionscan_falhas_total", ajuda="Erros tratados sem interromper o fluxo, por etapa",
+                        etapa="hash_perceptual")
+        log.warning("Falha ao calcular hash perceptual: %s", e)
+        return None
+
+
+def _registrar_hash_perceptual(preparo):
+    # Só análises bem-sucedidas entram no índice de quase-duplicatas
+    if preparo.phash is None:
+        return
+    try:
+        indice_perceptual.adicionar(preparo.phash, preparo.sha256)
+    except Exception as e:
+        metricas.contar("visionscan_falhas_total", ajuda="Erros tratados sem interromper o fluxo, por etapa",
+                        etapa="indexar_hash_perceptual")
+        log.warning("Falha ao indexar hash perceptual: %s", e)
+
+
+# =========================================================
+# ÍNDICE GEOGRÁFICO (EXIF OU ESTIMATIVA DO MODELO)
+# =========================================================
+indice_geografico = IndiceGeografico()
+
+
+def _registrar_localizacao(sha256: str, coordenadas_exif, relatorio: str) -> dict | None:
+    """Indexa o ponto da evidência: GPS do EXIF quando existe, senão a estimativa do laudo."""
+    origem, coordenadas = "exif", coordenadas_exif
+    if coordenadas is None:
+        origem, coordenadas = "modelo", coordenadas_do_laudo(relatorio)
+    if coordenadas is None:
+        return None
+    lat, lon = coordenadas
+    try:
+        indice_geografico.adicionar(lat, lon, sha256, origem)
+    except Exception as e:
+        metricas.contar("visionscan_falhas_total", ajuda="Erros tratados sem interromper o fluxo, por etapa",
+                        etapa="indexar_localizacao")
+        log.warning("Falha ao indexar localização: %s", e)
+    return {"lat": lat, "lon": lon, "origem": origem, "geohash": geohash(lat, lon)}
+
+
+def casos_proximos(lat: float, lon: float, raio_km: float = RAIO_PADRAO_KM, excluir: str | None = None):
+    """Evidências já analisadas a até `raio_km` do ponto, da mais próxima à mais distante."""
+    with metricas.span("busca_geografica") as span:
+        resultados = indice_geografico.buscar_raio(lat, lon, raio_km, excluir=excluir)
+        span.anotar(pontos=len(indice_geografico), encontrados=len(resultados))
+    return resultados
+
+
+# =========================================================
+# MOTOR DE PERÍCIA OSINT (Atualizado)
+# =========================================================
+class PreparoPericia(NamedTuple):
+    """Resultado das etapas locais da perícia, comum às versões síncrona e assíncrona."""
+    laudo_em_cache: str | None
+    chave_cache: str
+    modelo: str
+    conteudo: list | None
+    sha256: str
+    exif_info: str
+    coordenadas: tuple | None
+    phash: int | None = None
+
+
+def _preparar_pericia(img_file, api_key: str) -> PreparoPericia:
+    """Leitura, escolha do modelo, consulta ao cache, EXIF e preparo da imagem (sem rede, exceto o catálogo frio)."""
+    # Upload exposto sem cópia (buffer em memória ou mmap) só durante o preparo
+    with abrir_evidencia(img_file) as original_bytes:
+        return _preparar_do_buffer(original_bytes, api_key)
+
+
+def _preparar_do_buffer(original_bytes, api_key: str) -> PreparoPericia:
+    sha256 = hashlib.sha256(original_bytes).hexdigest()
+    # Image.open só interpreta o cabeçalho: dimensões recusadas antes de decodificar
+    img = PIL.Image.open(abrir_leitor(original_bytes))
+    validar_dimensoes(img)
+
+    metricas.observar("visionscan_imagem_bytes", len(original_bytes), limites=BUCKETS_BYTES,
+                      ajuda="Tamanho das imagens recebidas", formato=img.format or "?")
+
+    # EXIF vem direto dos cabeçalhos, sem passar pelo PIL
+    with metricas.span("exif"):
+        exif_info, coordenadas = _extrair_exif(original_bytes)
+
+    # Modelo preferido vem do catálogo em cache (sem list_models() por análise)
+    with metricas.span("selecao_modelo") as span:
+        modelo_escolhido = catalogo_modelos.escolher(api_key)
+        span.anotar(modelo=modelo_escolhido)
+
+    # Mesma imagem + mesmo prompt + mesmo modelo = mesmo laudo
+    chave_cache = CacheResultados.chave(original_bytes, PROMPT_VERSAO, modelo_escolhido)
+    laudo_em_cache = cache_resultados.obter(chave_cache)
+    metricas.contar("visionscan_cache_laudos_total", ajuda="Consultas ao cache de laudos",
+                    resultado="hit" if laudo_em_cache is not None else "miss")
+    if laudo_em_cache is not None:
+        return PreparoPericia(laudo_em_cache, chave_cache, modelo_escolhido, None, sha256, exif_info, coordenadas)
+
+    img_part, reduzida = _preparar_imagem(img, original_bytes)
+    valor_phash = _hash_perceptual(reduzida)
+
+    # As instruções fixas vão no system_instruction do modelo do pool (ou no prompt, via pool_modelos.conteudo)
+    return PreparoPericia(None, chave_cache, modelo_escolhido, [exif_info, img_part], sha256, exif_info,
+                          coordenadas, valor_phash)
+
+
+def _registrar_uso(span, response, modelo: str):
+    """Anota o consumo de tokens da resposta no span e nos contadores por modelo."""
+    uso = getattr(response, "usage_metadata", None)
+    if uso is None:
+        return
+    entrada = getattr(uso, "prompt_token_count", None)
+    saida = getattr(uso, "candidates_token_count", None)
+    span.anotar(tokens_entrada=entrada, tokens_saida=saida)
+    for tipo, valor in (("entrada", entrada), ("saida", saida)):
+        if valor:
+            metricas.contar("visionscan_tokens_total", valor, ajuda="Tokens consumidos por modelo",
+                            modelo=modelo, tipo=tipo)
+
+
+def _anotar_vencedora(span, vencedora, preparo: PreparoPericia):
+    span.rotulos["modelo"] = vencedora.modelo
+    span.anotar(tentativa=vencedora.tentativa, hedge=vencedora.hedge,
+                modelo_solicitado=preparo.modelo if vencedora.modelo != preparo.modelo else None)
+    metricas.contar("visionscan_geracao_vencedora_total", ajuda="Qual tentativa produziu o laudo",
+                    modelo=vencedora.modelo, tentativa=str(vencedora.tentativa),
+                    hedge=str(vencedora.hedge).lower())
+
+
+def _gravar_cache(preparo: PreparoPericia, vencedora, relatorio: str):
+    # Laudo de um modelo substituto não entra na chave do modelo preferido
+    if vencedora.modelo == preparo.modelo:
+        cache_resultados.gravar(preparo.chave_cache, relatorio)
+
+
+def erro_pericia(e: Exception, api_key: str) -> str:
+    if isinstance(e, (EvidenciaRejeitada, PIL.Image.DecompressionBombError)):
+        metricas.contar("visionscan_evidencias_rejeitadas_total", ajuda="Uploads recusados pela política de ingestão")
+        return f"❌ Imagem rejeitada: {e}"
+    # Modelo removido/renomeado no provedor: força nova listagem na próxima análise
+    if "not found" in str(e).lower():
+        catalogo_modelos.invalidar(api_key)
+    return f"❌ Erro na análise: {str(e)}"
+
+
+def _chamada_stream(api_key: str, preparo: PreparoPericia):
+    def _chamar(modelo, timeout):
+        # Só se repete até chegar o primeiro trecho; depois disso o texto já foi exibido
+        response = pool_modelos.obter(api_key, modelo).generate_content(
+            pool_modelos.conteudo(modelo, preparo.conteudo), stream=True, request_options={"timeout": timeout}
+        )
+        trechos = iter(response)
+        return response, trechos, next(trechos, None)
+    return _chamar
+
+
+def _textos(primeiro, trechos):
+    for chunk in itertools.chain([primeiro] if primeiro else [], trechos):
+        if chunk.text:
+            yield chunk.text
+
+
+def analisar_evidencia(img_file, api_key: str, ao_trecho=None) -> dict:
+    """
+    Perícia completa devolvendo, além do laudo, modelo, sha256, resumo EXIF
+    e tempos por etapa. Erros são propagados (usado pela CLI, pela fila e por
+    executar_pericia). Com `ao_trecho`, gera em stream e repassa cada trecho.
+    """
+    inicio = time.perf_counter()
+    preparo = _preparar_pericia(img_file, api_key)
+    fim_preparo = time.perf_counter()
+
+    relatorio, vencedora = preparo.laudo_em_cache, None
+    if relatorio is None:
+        def _chamar(modelo, timeout):
+            return pool_modelos.obter(api_key, modelo).generate_content(
+                pool_modelos.conteudo(modelo, preparo.conteudo), request_options={"timeout": timeout}
+            )
+
+        alternativas = catalogo_modelos.alternativas(api_key)
+        with metricas.span("geracao", modelo=preparo.modelo) as span:
+            if ao_trecho is None:
+                response, vencedora = invocador.executar(_chamar, preparo.modelo, alternativas)
+                relatorio = response.text
+            else:
+                (response, trechos, primeiro), vencedora = invocador.executar(
+                    _chamada_stream(api_key, preparo), preparo.modelo, alternativas
+                )
+                partes = []
+                for texto in _textos(primeiro, trechos):
+                    partes.append(texto)
+                    ao_trecho(texto)
+                relatorio = "".join(partes)
+            _anotar_vencedora(span, vencedora, preparo)
+            _registrar_uso(span, response, vencedora.modelo)
+        _gravar_cache(preparo, vencedora, relatorio)
+        _registrar_hash_perceptual(preparo)
+    localizacao = _registrar_localizacao(preparo.sha256, preparo.coordenadas, relatorio)
+    fim = time.perf_counter()
+
+    return {
+        "relatorio": relatorio,
+        "modelo": vencedora.modelo if vencedora else preparo.modelo,
+        "tentativa": vencedora._asdict() if vencedora else None,
+        "sha256": preparo.sha256,
+        "exif": preparo.exif_info.strip(),
+        "localizacao": localizacao,
+        "em_cache": preparo.laudo_em_cache is not None,
+        "tempos": {
+            "preparo_s": round(fim_preparo - inicio, 4),
+            "geracao_s": round(fim - fim_preparo, 4),
+            "total_s": round(fim - inicio, 4)
+        }
+    }
+
+
+def executar_pericia(img_file, api_key: str) -> str:
+    if img_file is None:
+        return "❌ Nenhuma imagem foi fornecida para análise."
+    
+    try:
+        return analisar_evidencia(img_file, api_key)["relatorio"]
+        
+    except Exception as e:
+        return erro_pericia(e, api_key)
+
+
+def executar_pericia_stream(img_file, api_key: str):
+    """
+    Gera o laudo em trechos à medida que o modelo responde (stream=True).
+    O texto completo só vai para o cache quando a resposta termina inteira.
+    """
+    if img_file is None:
+        yield "❌ Nenhuma imagem foi fornecida para análise."
+        return
+
+    partes = []
+    try:
+        preparo = _preparar_pericia(img_file, api_key)
+        if preparo.laudo_em_cache is not None:
+            yield preparo.laudo_em_cache
+            return
+
+        with metricas.span("geracao", modelo=preparo.modelo) as span:
+            (response, trechos, primeiro), vencedora = invocador.executar(
+                _chamada_stream(api_key, preparo), preparo.modelo, catalogo_modelos.alternativas(api_key)
+            )
+            _anotar_vencedora(span, vencedora, preparo)
+            for texto in _textos(primeiro, trechos):
+                partes.append(texto)
+                yield texto
+            _registrar_uso(span, response, vencedora.modelo)
+
+        _gravar_cache(preparo, vencedora, "".join(partes))
+        _registrar_hash_perceptual(preparo)
+        _registrar_localizacao(preparo.sha256, preparo.coordenadas, "".join(partes))
+
+    except Exception as e:
+        erro = erro_pericia(e, api_key)
+        yield f"\n\n{erro}" if partes else erro
+
+
+async def executar_pericia_async(img_file, api_key: str) -> str:
+    """
+    Versão assíncrona de executar_pericia. As etapas de CPU rodam em
+    asyncio.to_thread e a geração usa generate_content_async, então um único
+    event loop sustenta centenas de análises em andamento.
+    """
+    if img_file is None:
+        return "❌ Nenhuma imagem foi fornecida para análise."
+
+    try:
+        preparo = await asyncio.to_thread(_preparar_pericia, img_file, api_key)
+        if preparo.laudo_em_cache is not None:
+            return preparo.laudo_em_cache
+
+        def _chamar(modelo, timeout):
+            return pool_modelos.obter_async(api_key, modelo).generate_content_async(
+                pool_modelos.conteudo(modelo, preparo.conteudo), request_options={"timeout": timeout}
+            )
+
+        with metricas.span("geracao", modelo=preparo.modelo) as span:
+            response, vencedora = await invocador.executar_async(
+                _chamar, preparo.modelo, catalogo_modelos.alternativas(api_key)
+            )
+            _anotar_vencedora(span, vencedora, preparo)
+            _registrar_uso(span, response, vencedora.modelo)
+        _gravar_cache(preparo, vencedora, response.text)
+        _registrar_hash_perceptual(preparo)
+        _registrar_localizacao(preparo.sha256, preparo.coordenadas, response.text)
+        return response.text
+
+    except Exception as e:
+        return erro_pericia(e, api_key)
+
+
+async def executar_pericia_lote_async(arquivos, api_key: str, max_concorrencia: int = 100):
+    """Roda várias perícias no mesmo event loop, com no máximo `max_concorrencia` em voo."""
+    semaforo = asyncio.Semaphore(max_concorrencia)
+
+    async def _uma(arquivo):
+        async with semaforo:
+            return await executar_pericia_async(arquivo, api_key)
+
+    return await asyncio.gather(*(_uma(arquivo) for arquivo in arquivos))
+
+    
+# =========================================================
+# ANÁLISE EM LOTE (CONCORRÊNCIA LIMITADA)
+# =========================================================
+MAX_WORKERS_LOTE = 4
+
+
+def _analisar_ou_erro(img_file, api_key: str):
+    if img_file is None:
+        return "❌ Nenhuma imagem foi fornecida para análise."
+    try:
+        return analisar_evidencia(img_file, api_key)
+    except Exception as e:
+        return erro_pericia(e, api_key)
+
+
+def analisar_lote(arquivos, api_key: str, max_workers: int = MAX_WORKERS_LOTE):
+    """
+    Executa analisar_evidencia para vários arquivos em um pool limitado de threads.
+    Gera (indice, resultado) na ordem de conclusão, para o chamador atualizar
+    o progresso da sua própria thread (o Streamlit não aceita chamadas de workers).
+    `resultado` é o dict de analisar_evidencia, ou a mensagem de erro da imagem.
+    """
+    if not arquivos:
+        return
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(arquivos))),
+                            thread_name_prefix="pericia-lote") as pool:
+        futuros = {
+            pool.submit(_analisar_ou_erro, arquivo, api_key): i
+            for i, arquivo in enumerate(arquivos)
+        }
+        for futuro in as_completed(futuros):
+            yield futuros[futuro], futuro.result()
+
+
+def executar_pericia_lote(arquivos, api_key: str, max_workers: int = MAX_WORKERS_LOTE):
+    """Como analisar_lote, mas gera só o texto do laudo (ou do erro) de cada imagem."""
+    for i, resultado in analisar_lote(arquivos, api_key, max_workers):
+        yield i, resultado["relatorio"] if isinstance(resultado, dict) else resultado
+
+
+def pericia_bem_sucedida(resultado: str) -> bool:
+    return bool(resultado) and not resultado.startswith("❌")
@@ -0,0 +1,144 @@
+import hashlib
+import io
+import logging
+import threading
+from collections import OrderedDict
+
+import PIL.Image
+import PIL.ImageOps
+
+from ingestao import abrir_evidencia, abrir_leitor, reservar_decodificacao, validar_dimensoes
+from metricas import BUCKETS_BYTES, metricas
+
+log = logging.getLogger(__name__)
+
+# =========================================================
+# PRÉ-VISUALIZAÇÃO DAS EVIDÊNCIAS
+# =========================================================
+LADO_PREVIA = 1280  # maior lado da miniatura exibida na página
+QUALIDADE_PREVIA = 80
+MAX_BYTES_PREVIAS = 64 * 1024 * 1024
+_MAX_IDS = 1024
+
+
+class CachePrevias:
+    """
+    Miniaturas já codificadas, endereçadas pelo sha256 do upload, em LRU
+    limitado por bytes. Os reruns do Streamlit exibem a miniatura em vez de
+    reenviar o original ao navegador; o file_id do upload é memorizado para
+    não refazer o hash do arquivo inteiro a cada rerun.
+    """
+
+    def __init__(self, max_bytes: int = MAX_BYTES_PREVIAS):
+        self.max_bytes = max_bytes
+        self._previas = OrderedDict()  # sha256 -> (mime, bytes)
+        self._hashes = OrderedDict()  # file_id -> sha256
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def hash_do_upload(self, file_id):
+        with self._lock:
+            return self._hashes.get(file_id) if file_id is not None else None
+
+    def lembrar_hash(self, file_id, sha256: str):
+        if file_id is None:
+            return
+        with self._lock:
+            self._hashes[file_id] = sha256
+            self._hashes.move_to_end(file_id)
+            while len(self._hashes) > _MAX_IDS:
+                self._hashes.popitem(last=False)
+
+    def obter(self, sha256: str):
+        with self._lock:
+            previa = self._previas.get(sha256)
+            if previa is None:
+                self.misses += 1
+                return None
+            self._previas.move_to_end(sha256)
+            self.hits += 1
+            return previa
+
+    def gravar(self, sha256: str, previa):
+        with self._lock:
+            anterior = self._previas.pop(sha256, None)
+            if anterior is not None:
+                self._bytes -= len(anterior[1])
+            self._previas[sha256] = previa
+            self._bytes += len(previa[1])
+            while self._bytes > self.max_bytes and len(self._previas) > 1:
+                _, (_, dados) = self._previas.popitem(last=False)
+                self._bytes -= len(dados)
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            consultas = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "taxa_acerto": self.hits / consultas if consultas else 0.0,
+                "entradas": len(self._previas),
+                "bytes": self._bytes
+            }
+
+
+cache_previas = CachePrevias()
+
+
+def gerar_previa(conteudo, lado: int = LADO_PREVIA):
+    """Miniatura WebP (ou JPEG, sem suporte a WebP) com o maior lado limitado a `lado`. Retorna (mime, bytes)."""
+    img = PIL.Image.open(abrir_leitor(conteudo))
+    validar_dimensoes(img)
+    escala = min(1.0, lado / max(img.width, img.height))
+    alvo = (max(1, round(img.width * escala)), max(1, round(img.height * escala)))
+    # JPEG decodifica direto em 1/2..1/8 da resolução; o resto decodifica inteiro
+    img.draft("RGB", alvo)
+    modo = "RGBA" if img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info else "RGB"
+
+    with reservar_decodificacao(img, alvo[0] * alvo[1], modo):
+        img = PIL.ImageOps.exif_transpose(img)
+        img = img.convert(modo)
+        img.thumbnail((lado, lado), PIL.Image.LANCZOS, reducing_gap=3.0)
+
+    buffer = io.BytesIO()
+    try:
+        img.save(buffer, format="WEBP", quality=QUALIDADE_PREVIA, method=4)
+        return "image/webp", buffer.getvalue()
+    except (KeyError, OSError):
+        buffer = io.BytesIO()
+        img.convert("RGB").save(buffer, format="JPEG", quality=QUALIDADE_PREVIA, optimize=True)
+        return "image/jpeg", buffer.getvalue()
+
+
+def previa_evidencia(img_file, cache: CachePrevias = cache_previas) -> bytes | None:
+    """
+    Bytes da miniatura do upload, gerada uma vez por conteúdo. None se a
+    imagem não puder ser pré-visualizada (a análise reporta o motivo).
+    """
+    file_id = getattr(img_file, "file_id", None)
+    sha256 = cache.hash_do_upload(file_id)
+    if sha256 is not None:
+        previa = cache.obter(sha256)
+        if previa is not None:
+            return previa[1]
+
+    try:
+        with abrir_evidencia(img_file) as conteudo:
+            sha256 = hashlib.sha256(conteudo).hexdigest()
+            cache.lembrar_hash(file_id, sha256)
+            previa = cache.obter(sha256)
+            if previa is None:
+                with metricas.span("previa") as span:
+                    previa = gerar_previa(conteudo)
+                    span.anotar(bytes_original=len(conteudo), bytes_previa=len(previa[1]))
+                metricas.observar("visionscan_previa_bytes", len(previa[1]), limites=BUCKETS_BYTES,
+                                  ajuda="Tamanho das miniaturas enviadas ao navegador")
+                cache.gravar(sha256, previa)
+    except Exception as e:
+        metricas.contar("visionscan_falhas_total", ajuda="Erros tratados sem interromper o fluxo, por etapa",
+                        etapa="previa")
+        log.warning("Pré-visualização indisponível: %s", e)
+        return None
+    return previa[1]
@@ -0,0 +1,287 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import NamedTuple
+
+from metricas import metricas
+
+# =========================================================
+# CHAMADAS RESILIENTES AO MODELO
+# =========================================================
+PRAZO_PADRAO = 90.0  # segundos por análise, somando todas as tentativas
+TENTATIVAS_MAX = 4
+ESPERA_BASE = 0.5
+ESPERA_MAX = 8.0
+# Requisição duplicada quando a primeira passa do p95 do modelo (desligado por padrão: custa tokens)
+HEDGE_PADRAO = os.environ.get("VISIONSCAN_HEDGE") == "1"
+ATRASO_HEDGE_PADRAO = 20.0  # usado enquanto não há histórico suficiente para o p95
+AMOSTRAS_MIN_HEDGE = 20
+CODIGOS_REPETIVEIS = {408, 429, 500, 502, 503, 504}
+
+
+class PrazoEsgotado(TimeoutError):
+    pass
+
+
+class Vencedora(NamedTuple):
+    """Qual tentativa produziu a resposta."""
+    modelo: str
+    tentativa: int
+    hedge: bool
+
+
+def _codigo(e: Exception):
+    codigo = getattr(e, "code", None)
+    try:
+        return int(codigo)
+    except (TypeError, ValueError):
+        return None
+
+
+def erro_repetivel(e: Exception) -> bool:
+    """429/5xx, timeouts e falhas de conexão valem nova tentativa."""
+    codigo = _codigo(e)
+    if codigo is not None:
+        return codigo in CODIGOS_REPETIVEIS
+    return isinstance(e, (TimeoutError, ConnectionError))
+
+
+def falha_do_servico(e: Exception) -> bool:
+    """Só timeouts, erros repetíveis e 5xx contam no disjuntor; um 400 é culpa da requisição, não do modelo."""
+    codigo = _codigo(e)
+    return erro_repetivel(e) or (codigo is not None and codigo >= 500)
+
+
+def modelo_indisponivel(e: Exception) -> bool:
+    """Modelo removido ou renomeado: não adianta repetir, só trocar de modelo."""
+    return _codigo(e) == 404 or "not found" in str(e).lower()
+
+
+class Disjuntor:
+    """
+    Circuit breaker por modelo: abre após `limite_falhas` falhas seguidas e,
+    passado o resfriamento, libera uma única tentativa de teste (meio-aberto).
+    """
+
+    def __init__(self, limite_falhas: int = 5, resfriamento: float = 30.0):
+        self.limite_falhas = limite_falhas
+        self.resfriamento = resfriamento
+        self._estados = {}  # modelo -> [falhas seguidas, aberto_ate]
+        self._lock = threading.Lock()
+
+    def disponivel(self, modelo: str) -> bool:
+        with self._lock:
+            falhas, aberto_ate = self._estados.get(modelo, (0, 0.0))
+            if falhas < self.limite_falhas:
+                return True
+            agora = time.monotonic()
+            if agora < aberto_ate:
+                return False
+            # Meio-aberto: esta chamada é o teste; as próximas esperam outro resfriamento
+            self._estados[modelo] = [falhas, agora + self.resfriamento]
+            return True
+
+    def sucesso(self, modelo: str):
+        with self._lock:
+            self._estados.pop(modelo, None)
+
+    def falha(self, modelo: str):
+        with self._lock:
+            falhas, aberto_ate = self._estados.get(modelo, (0, 0.0))
+            falhas += 1
+            if falhas == self.limite_falhas:
+                aberto_ate = time.monotonic() + self.resfriamento
+                metricas.contar("visionscan_disjuntor_aberto_total", ajuda="Aberturas do circuit breaker por modelo",
+                                modelo=modelo)
+            self._estados[modelo] = [falhas, aberto_ate]
+
+    def estado(self, modelo: str) -> str:
+        with self._lock:
+            falhas, aberto_ate = self._estados.get(modelo, (0, 0.0))
+        if falhas < self.limite_falhas:
+            return "fechado"
+        return "aberto" if time.monotonic() < aberto_ate else "meio-aberto"
+
+
+class Invocador:
+    """
+    Executa a chamada ao modelo com prazo total, backoff exponencial com
+    jitter em erros repetíveis, hedge opcional após o p95 e troca para o
+    próximo modelo preferido quando o disjuntor do atual está aberto.
+
+    `chamar(modelo, timeout)` (ou a corrotina equivalente) faz uma tentativa.
+    """
+
+    def __init__(self, disjuntor: Disjuntor | None = None, prazo: float = PRAZO_PADRAO,
+                 tentativas: int = TENTATIVAS_MAX, hedge: bool = HEDGE_PADRAO):
+        self.disjuntor = disjuntor or Disjuntor()
+        self.prazo = prazo
+        self.tentativas = tentativas
+        self.hedge = hedge
+        self._executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="geracao-hedge")
+
+    def _proximo(self, modelo: str, alternativas, descartados: set) -> str | None:
+        """Próximo modelo a tentar, ou None quando todos já foram descartados."""
+        candidatos = [m for m in [modelo, *alternativas] if m not in descartados]
+        for candidato in candidatos:
+            if self.disjuntor.disponivel(candidato):
+                return candidato
+        # Todos abertos: insiste no primeiro em vez de falhar sem tentar
+        return candidatos[0] if candidatos else None
+
+    def atraso_hedge(self, modelo: str) -> float:
+        p95 = metricas.quantil("visionscan_geracao_tentativa_segundos", 0.95,
+                               amostras_min=AMOSTRAS_MIN_HEDGE, modelo=modelo)
+        return p95 if p95 is not None and p95 != float("inf") else ATRASO_HEDGE_PADRAO
+
+    def _espera(self, numero: int) -> float:
+        # "Full jitter": espalha as novas tentativas de clientes concorrentes
+        return random.uniform(0, min(ESPERA_MAX, ESPERA_BASE * 2 ** (numero - 1)))
+
+    def _registrar(self, modelo: str, inicio: float, resultado: str):
+        metricas.observar("visionscan_geracao_tentativa_segundos", time.perf_counter() - inicio,
+                          ajuda="Latência de cada tentativa de geração", modelo=modelo)
+        metricas.contar("visionscan_geracao_tentativas_total", ajuda="Tentativas de geração por resultado",
+                        modelo=modelo, resultado=resultado)
+
+    def _tentar(self, chamar, modelo: str, limite: float):
+        restante = limite - time.monotonic()
+        inicio = time.perf_counter()
+        try:
+            resultado = chamar(modelo, restante)
+        except Exception:
+            self._registrar(modelo, inicio, "erro")
+            raise
+        self._registrar(modelo, inicio, "ok")
+        return resultado
+
+    def _uma(self, chamar, modelo: str, limite: float):
+        """Uma tentativa, duplicada se passar do p95 sem resposta. Retorna (resultado, venceu_o_hedge)."""
+        restante = limite - time.monotonic()
+        atraso = self.atraso_hedge(modelo) if self.hedge else None
+        if atraso is None or atraso >= restante:
+            return self._tentar(chamar, modelo, limite), False
+
+        primeira = self._executor.submit(self._tentar, chamar, modelo, limite)
+        feitos, _ = wait([primeira], timeout=atraso)
+        if feitos:
+            return primeira.result(), False
+
+        metricas.contar("visionscan_hedge_total", ajuda="Requisições duplicadas por passar do p95", modelo=modelo)
+        segunda = self._executor.submit(self._tentar, chamar, modelo, limite)
+        pendentes, erro = {primeira, segunda}, None
+        while pendentes:
+            # A perdedora segue em segundo plano; chamadas HTTP síncronas não são canceláveis
+            feitos, pendentes = wait(pendentes, timeout=max(0.0, limite - time.monotonic()),
+                                     return_when=FIRST_COMPLETED)
+            if not feitos:
+                raise PrazoEsgotado(f"prazo de {self.prazo:.0f} s esgotado")
+            for futuro in feitos:
+                if futuro.exception() is None:
+                    return futuro.result(), futuro is segunda
+                erro = futuro.exception()
+        raise erro
+
+    def executar(self, chamar, modelo: str, alternativas=(), prazo: float | None = None):
+        """Retorna (resultado, Vencedora). Erros não repetíveis propagam na hora."""
+        limite = time.monotonic() + (prazo or self.prazo)
+        descartados, ultimo_erro = set(), None
+        for numero in range(1, self.tentativas + 1):
+            if time.monotonic() >= limite:
+                break
+            atual = self._proximo(modelo, alternativas, descartados)
+            if atual is None:
+                break
+            try:
+                resultado, hedge = self._uma(chamar, atual, limite)
+            except Exception as e:
+                ultimo_erro = e
+                if falha_do_servico(e):
+                    self.disjuntor.falha(atual)
+                if modelo_indisponivel(e):
+                    descartados.add(atual)
+                    continue
+                if not erro_repetivel(e):
+                    raise
+                espera = self._espera(numero)
+                if time.monotonic() + espera >= limite:
+                    break
+                time.sleep(espera)
+                continue
+            self.disjuntor.sucesso(atual)
+            return resultado, Vencedora(atual, numero, hedge)
+        if ultimo_erro is not None and not isinstance(ultimo_erro, PrazoEsgotado) and time.monotonic() < limite:
+            raise ultimo_erro
+        raise PrazoEsgotado(f"prazo de {prazo or self.prazo:.0f} s esgotado") from ultimo_erro
+
+    async def _tentar_async(self, chamar, modelo: str, limite: float):
+        restante = limite - time.monotonic()
+        inicio = time.perf_counter()
+        try:
+            resultado = await asyncio.wait_for(chamar(modelo, restante), timeout=max(0.0, restante))
+        except Exception:
+            self._registrar(modelo, inicio, "erro")
+            raise
+        self._registrar(modelo, inicio, "ok")
+        return resultado
+
+    async def _uma_async(self, chamar, modelo: str, limite: float):
+        restante = limite - time.monotonic()
+        atraso = self.atraso_hedge(modelo) if self.hedge else None
+        if atraso is None or atraso >= restante:
+            return await self._tentar_async(chamar, modelo, limite), False
+
+        primeira = asyncio.ensure_future(self._tentar_async(chamar, modelo, limite))
+        feitos, _ = await asyncio.wait({primeira}, timeout=atraso)
+        if feitos:
+            return primeira.result(), False
+
+        metricas.contar("visionscan_hedge_total", ajuda="Requisições duplicadas por passar do p95", modelo=modelo)
+        segunda = asyncio.ensure_future(self._tentar_async(chamar, modelo, limite))
+        pendentes, erro = {primeira, segunda}, None
+        try:
+            while pendentes:
+                feitos, pendentes = await asyncio.wait(pendentes, return_when=asyncio.FIRST_COMPLETED)
+                for tarefa in feitos:
+                    if tarefa.exception() is None:
+                        return tarefa.result(), tarefa is segunda
+                    erro = tarefa.exception()
+            raise erro
+        finally:
+            for tarefa in pendentes:
+                tarefa.cancel()
+
+    async def executar_async(self, chamar, modelo: str, alternativas=(), prazo: float | None = None):
+        """Versão assíncrona de executar; `chamar` devolve uma corrotina."""
+        limite = time.monotonic() + (prazo or self.prazo)
+        descartados, ultimo_erro = set(), None
+        for numero in range(1, self.tentativas + 1):
+            if time.monotonic() >= limite:
+                break
+            atual = self._proximo(modelo, alternativas, descartados)
+            if atual is None:
+                break
+            try:
+                resultado, hedge = await self._uma_async(chamar, atual, limite)
+            except Exception as e:
+                ultimo_erro = e
+                if falha_do_servico(e):
+                    self.disjuntor.falha(atual)
+                if modelo_indisponivel(e):
+                    descartados.add(atual)
+                    continue
+                if not erro_repetivel(e):
+                    raise
+                espera = self._espera(numero)
+                if time.monotonic() + espera >= limite:
+                    break
+                await asyncio.sleep(espera)
+                continue
+            self.disjuntor.sucesso(atual)
+            return resultado, Vencedora(atual, numero, hedge)
+        if ultimo_erro is not None and not isinstance(ultimo_erro, PrazoEsgotado) and time.monotonic() < limite:
+            raise ultimo_erro
+        raise PrazoEsgotado(f"prazo de {prazo or self.prazo:.0f} s esgotado") from ultimo_erro
@@ -0,0 +1,29 @@
+-- =========================================================
+-- DÉBITO ATÔMICO DE CRÉDITOS
+-- =========================================================
+-- Decrementa os créditos do usuário autenticado somente se o saldo cobre a
+-- quantidade e devolve o novo saldo na mesma instrução (UPDATE ... RETURNING).
+-- Sessões concorrentes ficam serializadas pelo lock da linha, então o saldo
+-- nunca fica negativo. O usuário vem do JWT da sessão (auth.uid()), nunca de
+-- um parâmetro do cliente: ninguém debita créditos de outra conta.
+-- Retorna NULL sem usuário autenticado, sem perfil ou com saldo insuficiente.
+
+create or replace function public.consumir_creditos(
+    p_quantidade integer default 1
+)
+returns integer
+language sql
+security definer
+set search_path = public
+as $$
+    update public.users
+       set credits = credits - p_quantidade
+     where id = auth.uid()
+       and p_quantidade >= 0
+       and credits >= p_quantidade
+    returning credits;
+$$;
+
+-- O Supabase concede execute em novas funções a anon por privilégio padrão
+revoke all on function public.consumir_creditos(integer) from public, anon;
+grant execute on function public.consumir_creditos(integer) to authenticated;
@@ -0,0 +1,42 @@
+-- =========================================================
+-- HISTÓRICO DE PERÍCIAS
+-- =========================================================
+-- Um registro por análise concluída. A listagem usa paginação por chave
+-- (user_id, created_at, id): cada página parte do último item da anterior
+-- pelo índice abaixo, sem OFFSET, então o custo não cresce com o histórico.
+-- `resumo` e `tempo_total_s` existem para a listagem não precisar ler o
+-- laudo completo, que só é buscado quando o usuário abre o item.
+-- Com RLS, cada usuário autenticado só lê e grava as próprias perícias; o
+-- worker da fila grava pelo service_role, que ignora as políticas.
+
+create table if not exists public.pericias (
+    id uuid primary key default gen_random_uuid(),
+    user_id uuid not null references public.users (id) on delete cascade,
+    created_at timestamptz not null default now(),
+    nome_arquivo text,
+    sha256 text not null,
+    modelo text,
+    tempo_total_s real,
+    tempos jsonb,
+    exif text,
+    resumo text,
+    relatorio text not null
+);
+
+create index if not exists pericias_user_created_idx
+    on public.pericias (user_id, created_at desc, id desc);
+
+alter table public.pericias enable row level security;
+
+drop policy if exists pericias_select_dono on public.pericias;
+create policy pericias_select_dono on public.pericias
+    for select to authenticated
+    using (user_id = (select auth.uid()));
+
+drop policy if exists pericias_insert_dono on public.pericias;
+create policy pericias_insert_dono on public.pericias
+    for insert to authenticated
+    with check (user_id = (select auth.uid()));
+
+revoke all on public.pericias from anon;
+grant select, insert on public.pericias to authenticated, service_role;
@@ -0,0 +1,17 @@
+-- =========================================================
+-- LOCALIZAÇÃO DAS PERÍCIAS
+-- =========================================================
+-- Coordenadas da evidência (GPS do EXIF ou estimativa do modelo) e o
+-- geohash de precisão 9. Prefixos do geohash são células da grade, então
+-- "casos na mesma região" vira uma busca por prefixo no índice abaixo.
+
+alter table public.pericias
+    add column if not exists lat double precision,
+    add column if not exists lon double precision,
+    add column if not exists geohash text,
+    add column if not exists origem_localizacao text
+        check (origem_localizacao in ('exif', 'modelo'));
+
+create index if not exists pericias_geohash_idx
+    on public.pericias (geohash text_pattern_ops)
+    where geohash is not null;
@@ -0,0 +1,32 @@
+-- =========================================================
+-- PERFIL NO LOGIN EM UMA IDA AO BANCO
+-- =========================================================
+-- Cria o perfil do usuário autenticado na primeira entrada (plano free,
+-- 1 crédito) e devolve a linha, nova ou existente, na mesma instrução
+-- (INSERT ... ON CONFLICT ... RETURNING). O id, o email e o nome vêm do JWT
+-- da sessão (auth.uid()/auth.jwt()), nunca de parâmetros do cliente.
+-- Não retorna linhas quando chamada sem usuário autenticado.
+
+create or replace function public.garantir_perfil()
+returns setof public.users
+language sql
+security definer
+set search_path = public
+as $$
+    insert into public.users as u (id, email, name, plan, credits)
+    select auth.uid(),
+           auth.jwt() ->> 'email',
+           coalesce(
+               auth.jwt() -> 'user_metadata' ->> 'name',
+               split_part(auth.jwt() ->> 'email', '@', 1)
+           ),
+           'free',
+           1
+     where auth.uid() is not null
+    on conflict (id) do update
+       set email = excluded.email
+    returning u.*;
+$$;
+
+revoke all on function public.garantir_perfil() from public, anon;
+grant execute on function public.garantir_perfil() to authenticated;
@@ -0,0 +1,27 @@
+-- =========================================================
+-- ESTORNO DE CRÉDITOS
+-- =========================================================
+-- O crédito de uma análise é reservado no envio para a fila (consumir_creditos)
+-- e devolvido por aqui quando a análise termina em erro. Quem chama é o worker
+-- da fila, fora de qualquer sessão, então o usuário vem por parâmetro: a
+-- função só é concedida ao service_role, nunca aos clientes.
+-- Retorna o novo saldo, ou NULL se o usuário não existe.
+
+create or replace function public.estornar_creditos(
+    p_user_id uuid,
+    p_quantidade integer default 1
+)
+returns integer
+language sql
+security definer
+set search_path = public
+as $$
+    update public.users
+       set credits = credits + p_quantidade
+     where id = p_user_id
+       and p_quantidade >= 0
+    returning credits;
+$$;
+
+revoke all on function public.estornar_creditos(uuid, integer) from public, anon, authenticated;
+grant execute on function public.estornar_creditos(uuid, integer) to service_role;
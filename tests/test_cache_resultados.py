@@ -0,0 +1,76 @@
+import os
+import time
+import zlib
+
+from cache_resultados import CacheResultados
+
+
+def _chave(n):
+    return CacheResultados.chave(f"imagem {n}".encode(), "v1", "modelo")
+
+
+def test_chave_depende_do_prompt_e_do_modelo():
+    assert CacheResultados.chave(b"x", "v1", "a") == CacheResultados.chave(b"x", "v1", "a")
+    assert CacheResultados.chave(b"x", "v1", "a") != CacheResultados.chave(b"x", "v2", "a")
+    assert CacheResultados.chave(b"x", "v1", "a") != CacheResultados.chave(b"x", "v1", "b")
+
+
+def test_lru_descarta_o_menos_usado(tmp_path):
+    cache = CacheResultados(str(tmp_path), max_memoria=2)
+    cache.gravar(_chave(1), "laudo 1")
+    cache.gravar(_chave(2), "laudo 2")
+    assert cache.obter(_chave(1)) == "laudo 1"  # 1 passa a ser o mais recente
+    cache.gravar(_chave(3), "laudo 3")
+
+    assert list(cache._memoria) == [_chave(1), _chave(3)]
+    # O descartado da memória continua no disco
+    assert cache.obter(_chave(2)) == "laudo 2"
+    assert cache.estatisticas()["hits_disco"] == 1
+    assert list(cache._memoria) == [_chave(3), _chave(2)]
+
+
+def test_ida_e_volta_pelo_disco(tmp_path):
+    relatorio = "## Laudo\n\nCâmera: Canon — coordenadas 23°33′S " * 20
+    cache = CacheResultados(str(tmp_path))
+    cache.gravar(_chave(1), relatorio)
+
+    caminho = cache._caminho(_chave(1))
+    with open(caminho, "rb") as f:
+        assert zlib.decompress(f.read()).decode("utf-8") == relatorio
+
+    # Outro processo (novo objeto) lê o mesmo diretório
+    reaberto = CacheResultados(str(tmp_path))
+    assert reaberto.estatisticas()["bytes_disco"] == os.path.getsize(caminho)
+    assert reaberto.obter(_chave(1)) == relatorio
+    assert reaberto.obter(_chave(2)) is None
+    estatisticas = reaberto.estatisticas()
+    assert (estatisticas["hits_disco"], estatisticas["misses"]) == (1, 1)
+
+
+def test_entrada_corrompida_conta_como_miss(tmp_path):
+    cache = CacheResultados(str(tmp_path), max_memoria=0)
+    cache.gravar(_chave(1), "laudo")
+    with open(cache._caminho(_chave(1)), "wb") as f:
+        f.write(b"nao e zlib")
+    assert cache.obter(_chave(1)) is None
+
+
+def test_poda_o_disco_pelos_menos_usados(tmp_path):
+    relatorios = {n: f"laudo {n} " + "x" * 2000 for n in range(5)}
+    tamanho = len(zlib.compress(relatorios[0].encode(), 6))
+    limite = int(tamanho * 4.5)
+    cache = CacheResultados(str(tmp_path), max_memoria=0, max_bytes_disco=limite)
+
+    agora = time.time()
+    for n in range(4):
+        cache.gravar(_chave(n), relatorios[n])
+        os.utime(cache._caminho(_chave(n)), (agora - 100 + n, agora - 100 + n))
+    assert cache.estatisticas()["bytes_disco"] == 4 * tamanho
+
+    # A leitura renova a entrada 0: a menos usada passa a ser a 1
+    assert cache.obter(_chave(0)) == relatorios[0]
+    cache.gravar(_chave(4), relatorios[4])
+
+    restantes = {n for n in range(5) if os.path.exists(cache._caminho(_chave(n)))}
+    assert restantes == {0, 2, 3, 4}
+    assert cache.estatisticas()["bytes_disco"] == 4 * tamanho <= limite * 0.9
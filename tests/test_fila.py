@@ -0,0 +1,137 @@
+import io
+import logging
+import threading
+import time
+
+import pytest
+
+import fila
+from fila import CONCLUIDO, ERRO, EXECUTANDO, PENDENTE, FilaPericias
+from metricas import metricas
+
+
+class AnaliseFalsa:
+    """Substitui analisar_evidencia: conta as chamadas e pode segurar o worker."""
+
+    def __init__(self):
+        self.chamadas = 0
+        self.iniciada = threading.Event()
+        self.liberar = threading.Event()
+        self.liberar.set()
+
+    def __call__(self, f, api_key, ao_trecho=None):
+        self.chamadas += 1
+        conteudo = f.read()
+        self.iniciada.set()
+        self.liberar.wait(5)
+        return {"relatorio": f"laudo de {len(conteudo)} bytes"}
+
+
+@pytest.fixture
+def analise(monkeypatch):
+    analise = AnaliseFalsa()
+    monkeypatch.setattr(fila, "analisar_evidencia", analise)
+    return analise
+
+
+@pytest.fixture
+def falhas():
+    return []
+
+
+@pytest.fixture
+def fila_teste(tmp_path, analise, falhas):
+    fila_teste = FilaPericias(str(tmp_path), max_workers=2, ao_falhar=falhas.append)
+    yield fila_teste
+    if fila_teste._executor is not None:
+        fila_teste._executor.shutdown(wait=True)
+
+
+def _esperar_workers(fila_teste):
+    fila_teste._executor.shutdown(wait=True)
+    fila_teste._executor = None
+
+
+def _inserir_job(fila_teste, status, cobrado=False, com_entrada=True, concluido_em=None):
+    """Grava um job como um processo anterior teria deixado."""
+    job_id = f"job-{status}-{time.monotonic_ns()}"
+    if com_entrada:
+        with open(fila_teste._caminho_entrada(job_id), "wb") as f:
+            f.write(b"evidencia")
+    with fila_teste._conectar() as con:
+        con.execute(
+            "INSERT INTO jobs (id, status, criado_em, concluido_em, cobrado) VALUES (?, ?, ?, ?, ?)",
+            (job_id, status, time.time(), concluido_em, int(cobrado))
+        )
+    return job_id
+
+
+def test_job_reivindicado_nao_roda_duas_vezes(fila_teste, analise):
+    analise.liberar.clear()
+    job_id = fila_teste.enviar(io.BytesIO(b"evidencia"), "chave", cobrado=True)
+    assert analise.iniciada.wait(5)
+    assert fila_teste.obter(job_id)["status"] == EXECUTANDO
+
+    # Um segundo worker (ex.: um retomar() atrasado) encontra o job já reivindicado
+    fila_teste._executar(job_id, "chave")
+    analise.liberar.set()
+    _esperar_workers(fila_teste)
+
+    assert analise.chamadas == 1
+    job = fila_teste.obter(job_id)
+    assert job["status"] == CONCLUIDO
+    assert job["resultado"] == {"relatorio": "laudo de 9 bytes"}
+
+
+def test_retomar_reagenda_executando_e_falha_entrada_perdida(fila_teste, analise, falhas):
+    interrompido = _inserir_job(fila_teste, EXECUTANDO, cobrado=True)
+    perdido = _inserir_job(fila_teste, PENDENTE, cobrado=True, com_entrada=False)
+
+    assert fila_teste.retomar("chave") == 1
+    _esperar_workers(fila_teste)
+
+    assert analise.chamadas == 1
+    assert fila_teste.obter(interrompido)["status"] == CONCLUIDO
+    job = fila_teste.obter(perdido)
+    assert job["status"] == ERRO
+    assert [j["id"] for j in falhas] == [perdido]
+    assert fila_teste.retomar("chave") == 0
+
+
+def test_retomar_repete_estorno_pendente(fila_teste, falhas):
+    sem_estorno = _inserir_job(fila_teste, ERRO, cobrado=True, com_entrada=False, concluido_em=time.time())
+    _inserir_job(fila_teste, ERRO, cobrado=False, com_entrada=False, concluido_em=time.time())
+
+    fila_teste.retomar("chave")
+    assert [j["id"] for j in falhas] == [sem_estorno]
+
+
+def test_liberar_cobranca_uma_vez(fila_teste):
+    job_id = _inserir_job(fila_teste, ERRO, cobrado=True, com_entrada=False, concluido_em=time.time())
+    assert fila_teste.liberar_cobranca(job_id) is True
+    assert fila_teste.liberar_cobranca(job_id) is False
+    assert fila_teste.obter(job_id)["cobrado"] is False
+
+    concluido = _inserir_job(fila_teste, CONCLUIDO, cobrado=True, com_entrada=False, concluido_em=time.time())
+    assert fila_teste.liberar_cobranca(concluido) is False
+
+
+def _falhas_contadas(etapa):
+    prefixo = f'visionscan_falhas_total{{etapa="{etapa}"}} '
+    linhas = [l for l in metricas.exportar_prometheus().splitlines() if l.startswith(prefixo)]
+    return float(linhas[0][len(prefixo):]) if linhas else 0.0
+
+
+def test_erro_no_gancho_vira_contador_e_aviso(tmp_path, analise, caplog):
+    def gancho_quebrado(job):
+        raise RuntimeError("supabase fora do ar")
+
+    fila_teste = FilaPericias(str(tmp_path), ao_concluir=gancho_quebrado)
+    antes = _falhas_contadas("pos_processamento_job")
+    with caplog.at_level(logging.WARNING, logger="fila"):
+        job_id = fila_teste.enviar(io.BytesIO(b"evidencia"), "chave")
+        _esperar_workers(fila_teste)
+
+    assert fila_teste.obter(job_id)["status"] == CONCLUIDO
+    assert _falhas_contadas("pos_processamento_job") == antes + 1
+    assert any(job_id in r.getMessage() and "supabase fora do ar" in r.getMessage() for r in caplog.records)
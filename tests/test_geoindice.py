@@ -0,0 +1,84 @@
+import hashlib
+import random
+
+import numpy as np
+import pytest
+
+from geoindice import IndiceGeografico, RAIO_TERRA_KM, geohash, haversine_km
+
+
+def _ref(n):
+    return hashlib.sha256(str(n).encode()).hexdigest()
+
+
+def test_geohash_valores_conhecidos():
+    assert geohash(57.64911, 10.40744, 11) == "u4pruydqqvj"
+    assert geohash(-23.5505, -46.6333, 5) == "6gyf4"
+    # Pontos próximos compartilham o prefixo da célula
+    assert geohash(-23.5505, -46.6333)[:6] == geohash(-23.5510, -46.6330)[:6]
+
+
+def test_haversine_km():
+    um_grau = RAIO_TERRA_KM * np.pi / 180
+    distancias = haversine_km(0.0, 0.0, np.array([1.0, 0.0, 0.0, 0.0]), np.array([0.0, 1.0, 180.0, 0.0]))
+    assert distancias == pytest.approx([um_grau, um_grau, RAIO_TERRA_KM * np.pi, 0.0])
+    # Paris -> Londres
+    assert float(haversine_km(48.8566, 2.3522, 51.5074, -0.1278)) == pytest.approx(343.5, abs=1.0)
+    # Através do antimeridiano
+    assert float(haversine_km(0.0, 179.9, 0.0, -179.9)) == pytest.approx(0.2 * um_grau)
+
+
+def _forca_bruta(pontos, lat, lon, raio_km):
+    refs = [ref for ref, (plat, plon) in pontos.items() if float(haversine_km(lat, lon, plat, plon)) <= raio_km]
+    return sorted(refs)
+
+
+def test_buscar_raio_com_insercoes_intercaladas():
+    aleatorio = random.Random(7)
+    indice = IndiceGeografico(arquivo=None)
+    pontos = {}
+    for rodada in range(5):
+        for n in range(rodada * 200, (rodada + 1) * 200):
+            lat = -23.55 + aleatorio.uniform(-0.05, 0.05)
+            lon = -46.63 + aleatorio.uniform(-0.05, 0.05)
+            pontos[_ref(n)] = (lat, lon)
+            assert indice.adicionar(lat, lon, _ref(n))
+        # Consulta entre lotes de inserção: os novos são intercalados, não reordenados do zero
+        resultado = indice.buscar_raio(-23.55, -46.63, 2.0)
+        assert sorted(r["ref"] for r in resultado) == _forca_bruta(pontos, -23.55, -46.63, 2.0)
+        distancias = [r["distancia_km"] for r in resultado]
+        assert distancias == sorted(distancias)
+
+    lats, _, ordem = indice._arrays()
+    assert np.all(np.diff(lats) >= 0)
+    assert sorted(ordem.tolist()) == list(range(len(indice)))
+
+
+def test_buscar_raio_reanalise_e_antimeridiano():
+    indice = IndiceGeografico(arquivo=None)
+    indice.adicionar(10.0, 179.99, _ref(1))
+    indice.adicionar(10.0, -179.99, _ref(2))
+    indice.adicionar(40.0, 0.0, _ref(3))
+    assert [r["ref"] for r in indice.buscar_raio(10.0, 180.0, 5.0)] == [_ref(1), _ref(2)]
+
+    assert not indice.adicionar(40.0, 0.0, _ref(3))
+    assert indice.adicionar(10.0, 180.0, _ref(3), origem="modelo")
+    resultado = indice.buscar_raio(10.0, 180.0, 5.0, excluir=_ref(1))
+    assert [r["ref"] for r in resultado] == [_ref(3), _ref(2)]
+    assert resultado[0]["origem"] == "modelo"
+    assert indice.buscar_raio(40.0, 0.0, 5.0) == []
+
+
+def test_recarrega_do_arquivo(tmp_path):
+    arquivo = str(tmp_path / "geo.bin")
+    indice = IndiceGeografico(arquivo)
+    indice.adicionar(-23.55, -46.63, _ref(1))
+    indice.adicionar(-23.56, -46.64, _ref(2))
+    indice.adicionar(-23.57, -46.65, _ref(1))
+    with open(arquivo, "ab") as f:
+        f.write(b"\x00" * 10)  # registro truncado
+
+    recarregado = IndiceGeografico(arquivo)
+    assert len(recarregado) == 2
+    resultado = recarregado.buscar_raio(-23.57, -46.65, 0.5)
+    assert [r["ref"] for r in resultado] == [_ref(1)]
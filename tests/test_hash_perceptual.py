@@ -0,0 +1,88 @@
+import io
+import random
+
+import numpy as np
+import PIL.Image
+import pytest
+
+import pericia
+from hash_perceptual import IndiceHamming, distancia_hamming
+
+
+def _ref(n):
+    return f"{n:064x}"
+
+
+def _vizinho(valor, bits, aleatorio):
+    for bit in aleatorio.sample(range(64), bits):
+        valor ^= 1 << bit
+    return valor
+
+
+def test_encontra_vizinhos_dentro_do_raio():
+    aleatorio = random.Random(3)
+    indice = IndiceHamming(arquivo=None)
+    base = aleatorio.getrandbits(64)
+    for d in range(0, 11):
+        indice.adicionar(_vizinho(base, d, aleatorio), _ref(d))
+
+    for d in range(0, 11):
+        encontrados = indice.buscar(base, d)
+        assert sorted(ref for _, ref in encontrados) == sorted(_ref(i) for i in range(d + 1))
+        assert [dist for dist, _ in encontrados] == sorted(dist for dist, _ in encontrados)
+
+
+@pytest.mark.parametrize("distancia", [0, 1, 2, 3, 5, 8])
+def test_sem_falsos_negativos(distancia):
+    # Com 4 blocos de 16 bits, d <= 3 só visita o próprio bucket de cada bloco
+    aleatorio = random.Random(distancia)
+    indice = IndiceHamming(arquivo=None)
+    hashes = []
+    for n in range(300):
+        valor = aleatorio.getrandbits(64)
+        hashes.append(valor)
+        indice.adicionar(valor, _ref(n))
+        for k in range(3):
+            vizinho = _vizinho(valor, aleatorio.randint(0, distancia + 2), aleatorio)
+            hashes.append(vizinho)
+            indice.adicionar(vizinho, _ref(1000 + 3 * n + k))
+
+    for consulta in hashes[::7]:
+        esperados = sorted(d for d in (distancia_hamming(consulta, h) for h in hashes) if d <= distancia)
+        assert sorted(d for d, _ in indice.buscar(consulta, distancia)) == esperados
+
+
+def test_recarrega_do_arquivo_append_only(tmp_path):
+    arquivo = str(tmp_path / "phash.bin")
+    indice = IndiceHamming(arquivo)
+    indice.adicionar(0x0123456789ABCDEF, _ref(1))
+    indice.adicionar(0x0123456789ABCDEF, _ref(1))  # repetido não é regravado
+    indice.adicionar(0xFEDCBA9876543210, _ref(2))
+    with open(arquivo, "ab") as f:
+        f.write(b"\x01" * 7)  # registro truncado por uma queda no meio da escrita
+    assert (tmp_path / "phash.bin").stat().st_size == 2 * IndiceHamming._REGISTRO.size + 7
+
+    recarregado = IndiceHamming(arquivo)
+    assert len(recarregado) == 2
+    assert recarregado.buscar(0x0123456789ABCDEF ^ 0b101, 2) == [(2, _ref(1))]
+
+
+def _evidencia(largura, altura, formato):
+    # Blocos aleatórios com bordas duras: a redução (LANCZOS vs. bilinear direto) muda o pHash
+    blocos = np.random.default_rng(0).integers(0, 256, (altura // 40, largura // 40, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    PIL.Image.fromarray(blocos).resize((largura, altura), PIL.Image.NEAREST).save(buffer, formato)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("largura, altura, formato", [(800, 600, "JPEG"), (3000, 2000, "PNG")])
+def test_busca_usa_o_mesmo_hash_da_indexacao(monkeypatch, largura, altura, formato):
+    conteudo = _evidencia(largura, altura, formato)
+    monkeypatch.setattr(pericia, "indice_perceptual", IndiceHamming(arquivo=None))
+
+    # Indexação: o hash sai da imagem devolvida pelo preparo
+    img = PIL.Image.open(io.BytesIO(conteudo))
+    _, para_hash = pericia._preparar_imagem(img, conteudo)
+    pericia.indice_perceptual.adicionar(pericia._hash_perceptual(para_hash), _ref(1))
+
+    assert pericia.buscar_semelhantes(io.BytesIO(conteudo), distancia=0) == [(0, _ref(1))]
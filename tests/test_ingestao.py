@@ -0,0 +1,95 @@
+import io
+import threading
+import time
+
+import PIL.Image
+import pytest
+
+from ingestao import (
+    LIMITE_PIXELS,
+    EvidenciaRejeitada,
+    LeitorBuffer,
+    OrcamentoMemoria,
+    bytes_por_pixel,
+    orcamento_processo,
+    reservar_decodificacao,
+    validar_orcamento
+)
+
+
+class _Cabecalho:
+    """Só as dimensões e o modo, como o PIL.Image.open antes do load()."""
+
+    def __init__(self, modo, largura, altura):
+        self.mode, self.width, self.height = modo, largura, altura
+
+
+def test_leitura_depois_do_fim_devolve_eof():
+    leitor = io.BufferedReader(LeitorBuffer(b"xx"))
+    leitor.seek(10)
+    assert leitor.read(4) == b""
+    leitor.seek(1)
+    assert leitor.read(4) == b"x"
+
+
+@pytest.mark.parametrize("modo, esperado", [
+    ("1", 1), ("L", 1), ("P", 1), ("I;16", 2), ("I", 4), ("F", 4), ("LA", 4), ("RGB", 4), ("RGBA", 4)
+])
+def test_bytes_por_pixel(modo, esperado):
+    assert bytes_por_pixel(modo) == esperado
+
+
+def test_orcamento_recusa_o_que_o_limite_de_pixels_aceita():
+    largura, altura = 10_000, LIMITE_PIXELS // 10_000
+    validar_orcamento(_Cabecalho("RGB", largura, altura), 2_000_000)
+    for modo in ("RGBA", "I;16"):
+        with pytest.raises(EvidenciaRejeitada):
+            validar_orcamento(_Cabecalho(modo, largura, altura), 2_000_000)
+
+
+def test_limite_de_pixels_sem_alterar_o_pillow():
+    # O limite das evidências não vaza para outros usos do Pillow no processo
+    assert PIL.Image.MAX_IMAGE_PIXELS != LIMITE_PIXELS
+    with pytest.raises(EvidenciaRejeitada):
+        with reservar_decodificacao(_Cabecalho("L", 10_000, LIMITE_PIXELS // 10_000 + 1), 1, "L", orcamento=2**40):
+            pytest.fail("decodificação acima do limite de pixels")
+    assert orcamento_processo.em_uso() == 0
+    with reservar_decodificacao(_Cabecalho("L", 10_000, LIMITE_PIXELS // 10_000), 1, "L", orcamento=2**40):
+        pass
+
+
+def test_reservas_simultaneas_esperam_pelo_total():
+    orcamento = OrcamentoMemoria(total=100)
+    liberar = threading.Event()
+    ordem = []
+
+    def primeira():
+        with orcamento.reservar(80):
+            ordem.append("primeira")
+            liberar.wait(5)
+
+    def segunda():
+        with orcamento.reservar(50):
+            ordem.append(("segunda", orcamento.em_uso()))
+
+    t1 = threading.Thread(target=primeira)
+    t1.start()
+    while orcamento.em_uso() < 80:
+        time.sleep(0.01)
+    t2 = threading.Thread(target=segunda)
+    t2.start()
+    time.sleep(0.1)
+    assert ordem == ["primeira"]
+
+    liberar.set()
+    t1.join(5)
+    t2.join(5)
+    assert ordem == ["primeira", ("segunda", 50)]
+
+
+def test_reserva_aninhada_na_mesma_thread_nao_espera():
+    orcamento = OrcamentoMemoria(total=100)
+    with orcamento.reservar(90):
+        with orcamento.reservar(90):
+            assert orcamento.em_uso() == 180
+    assert orcamento.em_uso() == 0
@@ -0,0 +1,124 @@
+import io
+import random
+
+import PIL.Image
+import pytest
+
+from metadados import TAG_EXIF_IFD, TAG_GPS_IFD, ler_metadados, ler_tiff
+
+TAG_MAKE, TAG_MODEL, TAG_DATETIME = 0x010F, 0x0110, 0x0132
+TAG_DATETIME_ORIGINAL = 0x9003
+
+
+def _exif(endian="<", lat=None, lon=None):
+    exif = PIL.Image.Exif()
+    exif.endian = endian
+    exif[TAG_MAKE] = "Canon"
+    exif[TAG_MODEL] = "EOS 5D"
+    exif[TAG_DATETIME] = "2024:05:17 10:30:00"
+    exif.get_ifd(TAG_EXIF_IFD)[TAG_DATETIME_ORIGINAL] = "2024:05:17 10:29:59"
+    if lat is not None:
+        gps = exif.get_ifd(TAG_GPS_IFD)
+        gps[1], gps[2] = lat[0], lat[1]
+        gps[3], gps[4] = lon[0], lon[1]
+    return exif
+
+
+def _bloco_tiff(exif):
+    # Exif.tobytes() vem com o prefixo "Exif\0\0" do APP1
+    return exif.tobytes()[6:]
+
+
+def _imagem(formato, exif):
+    buffer = io.BytesIO()
+    PIL.Image.new("RGB", (16, 12), "gray").save(buffer, formato, exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("formato", ["JPEG", "PNG", "WEBP"])
+def test_marca_modelo_e_data(formato):
+    meta = ler_metadados(_imagem(formato, _exif()))
+    assert meta.formato == formato
+    assert meta.base["Make"] == "Canon"
+    assert meta.base["Model"] == "EOS 5D"
+    assert meta.base["DateTime"] == "2024:05:17 10:30:00"
+    assert meta.exif["DateTimeOriginal"] == "2024:05:17 10:29:59"
+    assert meta.coordenadas is None
+
+
+@pytest.mark.parametrize("ref_lat, ref_lon, sinal_lat, sinal_lon", [
+    ("N", "E", 1, 1), ("S", "W", -1, -1), ("S", "E", -1, 1), ("N", "W", 1, -1)
+])
+def test_sinal_das_coordenadas_gps(ref_lat, ref_lon, sinal_lat, sinal_lon):
+    exif = _exif(lat=(ref_lat, (23.0, 33.0, 1.8)), lon=(ref_lon, (46.0, 37.0, 59.88)))
+    meta = ler_metadados(_imagem("JPEG", exif))
+    lat, lon = meta.coordenadas
+    assert lat == pytest.approx(sinal_lat * (23 + 33 / 60 + 1.8 / 3600), abs=1e-6)
+    assert lon == pytest.approx(sinal_lon * (46 + 37 / 60 + 59.88 / 3600), abs=1e-6)
+    assert meta.gps["GPSLatitudeRef"] == ref_lat
+
+
+@pytest.mark.parametrize("endian, cabecalho", [("<", b"II*\x00"), (">", b"MM\x00*")])
+def test_cabecalhos_tiff_nas_duas_ordens(endian, cabecalho):
+    bloco = _bloco_tiff(_exif(endian, lat=("S", (10.0, 30.0, 0.0)), lon=("W", (50.0, 15.0, 0.0))))
+    assert bloco.startswith(cabecalho)
+
+    base, exif, gps = ler_tiff(bloco)
+    assert (base["Make"], base["Model"]) == ("Canon", "EOS 5D")
+    assert exif["DateTimeOriginal"] == "2024:05:17 10:29:59"
+    assert gps["GPSLatitude"] == pytest.approx((10.0, 30.0, 0.0))
+
+    # TIFF inteiro como arquivo também é reconhecido pelo cabeçalho
+    tiff = io.BytesIO()
+    PIL.Image.new("RGB", (4, 4)).save(tiff, "TIFF", exif=bloco)
+    meta = ler_metadados(tiff.getvalue())
+    assert meta.formato == "TIFF"
+    assert meta.coordenadas == pytest.approx((-10.5, -50.25))
+
+
+def _corrompidos():
+    jpeg = _imagem("JPEG", _exif(lat=("N", (1.0, 2.0, 3.0)), lon=("E", (4.0, 5.0, 6.0))))
+    inicio_exif = jpeg.index(b"Exif\x00\x00") + 6
+    bloco = _bloco_tiff(_exif())
+    sem_ifd = bytearray(bloco)
+    sem_ifd[4:8] = (0xFFFFFF00).to_bytes(4, "little")
+    entradas_demais = bytearray(bloco)
+    entradas_demais[8:10] = (0xFFFF).to_bytes(2, "little")
+    return {
+        "vazio": b"",
+        "so_soi": b"\xff\xd8",
+        "app1_truncado": jpeg[:inicio_exif + 10],
+        "marcador_invalido": b"\xff\xd8\x00\x00",
+        "png_truncado": _imagem("PNG", _exif())[:40],
+        "webp_sem_chunks": b"RIFF\x00\x00\x00\x00WEBP",
+        "tiff_so_cabecalho": b"II*\x00",
+        "ifd_fora_do_arquivo": bytes(sem_ifd),
+        "contagem_maior_que_o_ifd": bytes(entradas_demais[:40]),
+        "lixo": bytes(range(256)) * 4,
+    }
+
+
+@pytest.mark.parametrize("nome, dados", _corrompidos().items())
+def test_segmentos_truncados_ou_corrompidos(nome, dados):
+    meta = ler_metadados(dados)
+    assert meta.coordenadas is None
+    if nome != "contagem_maior_que_o_ifd":
+        assert meta.vazio()
+
+
+def test_bloco_tiff_truncado_em_qualquer_ponto():
+    bloco = _bloco_tiff(_exif("<", lat=("N", (1.0, 2.0, 3.0)), lon=("E", (4.0, 5.0, 6.0))))
+    for corte in range(len(bloco)):
+        base, exif, gps = ler_tiff(bloco[:corte])
+        assert isinstance(base, dict) and isinstance(exif, dict) and isinstance(gps, dict)
+
+
+@pytest.mark.parametrize("formato", ["JPEG", "PNG", "WEBP"])
+def test_bytes_corrompidos_nao_levantam(formato):
+    aleatorio = random.Random(formato)
+    original = _imagem(formato, _exif(lat=("N", (1.0, 2.0, 3.0)), lon=("E", (4.0, 5.0, 6.0))))
+    for _ in range(500):
+        dados = bytearray(original)
+        for _ in range(aleatorio.randint(1, 4)):
+            dados[aleatorio.randrange(len(dados))] = aleatorio.randrange(256)
+        ler_metadados(bytes(dados))
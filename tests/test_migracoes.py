@@ -0,0 +1,338 @@
+"""
+Testes das migrações do Supabase contra um Postgres de verdade.
+
+Usa o Postgres de VISIONSCAN_TEST_PG_DSN (conexão de superusuário) ou, sem
+ela, um servidor embutido do pacote pgserver. O esquema `auth` e os papéis
+do Supabase são recriados com o mínimo que as migrações usam: auth.uid() e
+auth.jwt() leem o JWT das configurações da transação, como o PostgREST faz.
+"""
+import glob
+import json
+import os
+import threading
+import uuid
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+MIGRACOES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "..", "supabase", "migrations", "*.sql")))
+BANCO_TESTE = "visionscan_teste"
+
+ESQUEMA_SUPABASE = """
+do $$
+begin
+    create role anon nologin;
+exception when duplicate_object then null;
+end $$;
+do $$
+begin
+    create role authenticated nologin;
+exception when duplicate_object then null;
+end $$;
+do $$
+begin
+    create role service_role nologin bypassrls;
+exception when duplicate_object then null;
+end $$;
+
+create schema if not exists auth;
+
+create or replace function auth.uid() returns uuid
+language sql stable as $$
+    select nullif(current_setting('request.jwt.claim.sub', true), '')::uuid
+$$;
+
+create or replace function auth.jwt() returns jsonb
+language sql stable as $$
+    select coalesce(nullif(current_setting('request.jwt.claims', true), ''), '{}')::jsonb
+$$;
+
+grant usage on schema auth, public to anon, authenticated, service_role;
+-- Privilégios padrão de um projeto Supabase: as migrações precisam revogar o que não querem expor
+alter default privileges in schema public grant all on tables to anon, authenticated, service_role;
+alter default privileges in schema public grant all on functions to anon, authenticated, service_role;
+
+create table public.users (
+    id uuid primary key,
+    email text,
+    name text,
+    plan text,
+    credits integer not null default 0
+);
+grant select on public.users to authenticated, service_role;
+"""
+
+
+def _dsn_servidor():
+    dsn = os.environ.get("VISIONSCAN_TEST_PG_DSN")
+    if dsn:
+        return dsn
+    pgserver = pytest.importorskip("pgserver")
+    return pgserver.get_server(os.path.join(os.path.dirname(__file__), ".pgdata"), cleanup_mode="stop").get_uri()
+
+
+def _trocar_banco(dsn, banco):
+    return psycopg2.extensions.make_dsn(dsn, dbname=banco)
+
+
+@pytest.fixture(scope="module")
+def dsn():
+    try:
+        servidor = _dsn_servidor()
+        admin = psycopg2.connect(servidor)
+    except Exception as e:
+        pytest.skip(f"Postgres indisponível: {e}")
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(f"drop database if exists {BANCO_TESTE}")
+        cur.execute(f"create database {BANCO_TESTE}")
+    admin.close()
+
+    dsn_teste = _trocar_banco(servidor, BANCO_TESTE)
+    conn = psycopg2.connect(dsn_teste)
+    with conn, conn.cursor() as cur:
+        cur.execute(ESQUEMA_SUPABASE)
+        for caminho in MIGRACOES:
+            with open(caminho, encoding="utf-8") as f:
+                cur.execute(f.read())
+    conn.close()
+    return dsn_teste
+
+
+@pytest.fixture
+def usuario(dsn):
+    """Fábrica de usuários de teste (removidos no fim do teste)."""
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    criados = []
+
+    def criar(credits=0, perfil=True):
+        uid = str(uuid.uuid4())
+        if perfil:
+            with conn.cursor() as cur:
+                cur.execute("insert into public.users (id, email, plan, credits) values (%s, %s, 'free', %s)",
+                            (uid, f"{uid}@teste", credits))
+        criados.append(uid)
+        return uid
+
+    yield criar
+    with conn.cursor() as cur:
+        cur.execute("delete from public.users where id = any(%s::uuid[])", (criados,))
+    conn.close()
+
+
+def conectar(dsn, papel, uid=None, email=None):
+    """Conexão que age como o PostgREST: papel do JWT e o `sub` (e as claims) nas configurações."""
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f"set role {papel}")
+        if uid is not None:
+            cur.execute("select set_config('request.jwt.claim.sub', %s, false)", (uid,))
+            claims = json.dumps({"sub": uid, "email": email})
+            cur.execute("select set_config('request.jwt.claims', %s, false)", (claims,))
+    return conn
+
+
+def chamar(conn, sql, params=()):
+    with conn.cursor() as cur:
+        cur.execute(sql, params)
+        return cur.fetchone()[0] if cur.description else None
+
+
+def saldo(dsn, uid):
+    conn = psycopg2.connect(dsn)
+    try:
+        return chamar(conn, "select credits from public.users where id = %s", (uid,))
+    finally:
+        conn.close()
+
+
+# =========================================================
+# consumir_creditos
+# =========================================================
+
+def test_debito_devolve_novo_saldo(dsn, usuario):
+    uid = usuario(credits=3)
+    conn = conectar(dsn, "authenticated", uid)
+    assert chamar(conn, "select public.consumir_creditos(2)") == 1
+    assert chamar(conn, "select public.consumir_creditos()") == 0
+    conn.close()
+    assert saldo(dsn, uid) == 0
+
+
+def test_saldo_insuficiente_nao_altera(dsn, usuario):
+    uid = usuario(credits=1)
+    conn = conectar(dsn, "authenticated", uid)
+    assert chamar(conn, "select public.consumir_creditos(2)") is None
+    conn.close()
+    assert saldo(dsn, uid) == 1
+
+
+def test_quantidade_negativa_recusada(dsn, usuario):
+    uid = usuario(credits=1)
+    conn = conectar(dsn, "authenticated", uid)
+    assert chamar(conn, "select public.consumir_creditos(-5)") is None
+    conn.close()
+    assert saldo(dsn, uid) == 1
+
+
+def test_usuario_desconhecido(dsn, usuario):
+    usuario(credits=5)
+    conn = conectar(dsn, "authenticated", str(uuid.uuid4()))
+    assert chamar(conn, "select public.consumir_creditos(1)") is None
+    conn.close()
+
+
+def test_sem_usuario_autenticado(dsn, usuario):
+    usuario(credits=5)
+    conn = conectar(dsn, "authenticated")
+    assert chamar(conn, "select public.consumir_creditos(1)") is None
+    conn.close()
+
+
+def test_so_debita_a_propria_conta(dsn, usuario):
+    vitima, atacante = usuario(credits=5), usuario(credits=0)
+    conn = conectar(dsn, "authenticated", atacante)
+    assert chamar(conn, "select public.consumir_creditos(1)") is None
+    conn.close()
+    assert saldo(dsn, vitima) == 5
+
+
+def test_anon_nao_executa(dsn, usuario):
+    uid = usuario(credits=5)
+    conn = conectar(dsn, "anon", uid)
+    with pytest.raises(psycopg2.errors.InsufficientPrivilege):
+        chamar(conn, "select public.consumir_creditos(1)")
+    conn.close()
+    assert saldo(dsn, uid) == 5
+
+
+def test_debitos_concorrentes_nao_gastam_o_mesmo_saldo(dsn, usuario):
+    creditos, sessoes = 5, 16
+    uid = usuario(credits=creditos)
+    conexoes = [conectar(dsn, "authenticated", uid) for _ in range(sessoes)]
+    largada = threading.Barrier(sessoes)
+    resultados = [None] * sessoes
+
+    def debitar(i):
+        largada.wait()
+        resultados[i] = chamar(conexoes[i], "select public.consumir_creditos(1)")
+
+    threads = [threading.Thread(target=debitar, args=(i,)) for i in range(sessoes)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for conn in conexoes:
+        conn.close()
+
+    aceitos = [r for r in resultados if r is not None]
+    assert len(aceitos) == creditos
+    assert sorted(aceitos) == list(range(creditos))
+    assert saldo(dsn, uid) == 0
+
+
+# =========================================================
+# pericias (RLS)
+# =========================================================
+
+def _inserir_pericia(conn, uid):
+    chamar(conn, "insert into public.pericias (user_id, sha256, relatorio) values (%s, 'x', 'laudo')", (uid,))
+
+
+def test_pericias_isoladas_por_usuario(dsn, usuario):
+    dono, outro = usuario(), usuario()
+    conn = conectar(dsn, "authenticated", dono)
+    _inserir_pericia(conn, dono)
+    with pytest.raises(psycopg2.errors.InsufficientPrivilege):
+        _inserir_pericia(conn, outro)
+    conn.close()
+
+    conn = conectar(dsn, "authenticated", outro)
+    assert chamar(conn, "select count(*) from public.pericias where user_id = %s", (dono,)) == 0
+    conn.close()
+
+
+def test_pericias_sem_acesso_anon(dsn, usuario):
+    uid = usuario()
+    conn = conectar(dsn, "anon", uid)
+    with pytest.raises(psycopg2.errors.InsufficientPrivilege):
+        chamar(conn, "select count(*) from public.pericias")
+    conn.close()
+
+
+def test_pericias_service_role_grava_para_o_dono(dsn, usuario):
+    uid = usuario()
+    conn = conectar(dsn, "service_role")
+    _inserir_pericia(conn, uid)
+    assert chamar(conn, "select count(*) from public.pericias where user_id = %s", (uid,)) == 1
+    conn.close()
+
+
+# =========================================================
+# estornar_creditos
+# =========================================================
+
+def test_estorno_pelo_service_role(dsn, usuario):
+    uid = usuario(credits=0)
+    conn = conectar(dsn, "service_role")
+    assert chamar(conn, "select public.estornar_creditos(%s, 1)", (uid,)) == 1
+    assert chamar(conn, "select public.estornar_creditos(%s, -3)", (uid,)) is None
+    conn.close()
+    assert saldo(dsn, uid) == 1
+
+
+@pytest.mark.parametrize("papel", ["anon", "authenticated"])
+def test_estorno_negado_aos_clientes(dsn, usuario, papel):
+    uid = usuario(credits=0)
+    conn = conectar(dsn, papel, uid)
+    with pytest.raises(psycopg2.errors.InsufficientPrivilege):
+        chamar(conn, "select public.estornar_creditos(%s, 10)", (uid,))
+    conn.close()
+    assert saldo(dsn, uid) == 0
+
+
+# =========================================================
+# garantir_perfil
+# =========================================================
+
+def _perfil(conn):
+    with conn.cursor() as cur:
+        cur.execute("select id::text, email, name, plan, credits from public.garantir_perfil()")
+        return cur.fetchall()
+
+
+def test_perfil_criado_no_primeiro_login(dsn, usuario):
+    uid = usuario(perfil=False)
+    conn = conectar(dsn, "authenticated", uid, email="ana@teste")
+    assert _perfil(conn) == [(uid, "ana@teste", "ana", "free", 1)]
+    conn.close()
+    assert saldo(dsn, uid) == 1
+
+
+def test_perfil_existente_mantem_creditos(dsn, usuario):
+    uid = usuario(credits=7)
+    conn = conectar(dsn, "authenticated", uid, email=f"{uid}@teste")
+    assert _perfil(conn) == [(uid, f"{uid}@teste", None, "free", 7)]
+    assert _perfil(conn) == [(uid, f"{uid}@teste", None, "free", 7)]
+    conn.close()
+    assert saldo(dsn, uid) == 7
+
+
+def test_perfil_sem_usuario_autenticado(dsn, usuario):
+    conn = conectar(dsn, "authenticated")
+    assert _perfil(conn) == []
+    conn.close()
+
+
+def test_perfil_anon_nao_executa(dsn, usuario):
+    uid = usuario(perfil=False)
+    conn = conectar(dsn, "anon", uid, email="anon@teste")
+    with pytest.raises(psycopg2.errors.InsufficientPrivilege):
+        _perfil(conn)
+    conn.close()
+    conn = psycopg2.connect(dsn)
+    assert chamar(conn, "select count(*) from public.users where id = %s", (uid,)) == 0
+    conn.close()
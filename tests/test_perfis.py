@@ -0,0 +1,81 @@
+import pytest
+
+import logic
+from logic import CachePerfis, geracao_perfis, invalidar_perfil
+
+
+class Relogio:
+    def __init__(self):
+        self.agora = 1000.0
+
+    def __call__(self):
+        return self.agora
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    relogio = Relogio()
+    monkeypatch.setattr(logic.time, "monotonic", relogio)
+    return relogio
+
+
+def _carregador(perfis):
+    lidos = []
+
+    def carregar(email):
+        lidos.append(email)
+        return dict(perfis[email])
+    carregar.lidos = lidos
+    return carregar
+
+
+def test_ttl_expira_a_entrada(relogio):
+    cache = CachePerfis(ttl=30.0)
+    carregar = _carregador({"a@x": {"credits": 1}})
+    assert cache.obter("a@x", carregar) == {"credits": 1}
+    relogio.agora += 29
+    cache.obter("a@x", carregar)
+    assert carregar.lidos == ["a@x"]
+    relogio.agora += 2
+    cache.obter("a@x", carregar)
+    assert carregar.lidos == ["a@x", "a@x"]
+
+
+def test_atualizar_aplica_campos_sem_reler(relogio):
+    cache = CachePerfis(ttl=30.0)
+    carregar = _carregador({"a@x": {"credits": 5, "plan": "free"}})
+    cache.obter("a@x", carregar)
+    cache.atualizar("a@x", credits=4)
+    assert cache.obter("a@x", carregar) == {"credits": 4, "plan": "free"}
+    assert carregar.lidos == ["a@x"]
+    # Sem entrada não há o que atualizar: o próximo obter lê do banco
+    cache.atualizar("b@x", credits=9)
+    assert cache.estatisticas()["perfis"] == 1
+
+
+def test_invalidar_um_usuario_mantem_os_outros(relogio):
+    cache = CachePerfis(ttl=60.0, geracao=geracao_perfis)
+    carregar = _carregador({"a@x": {"credits": 1}, "b@x": {"credits": 2}})
+    cache.obter("a@x", carregar)
+    cache.obter("b@x", carregar)
+
+    invalidar_perfil("a@x")
+    cache.obter("a@x", carregar)
+    cache.obter("b@x", carregar)
+    assert carregar.lidos == ["a@x", "b@x", "a@x"]
+
+
+def test_invalidar_todos_envelhece_todas_as_sessoes(relogio):
+    caches = [CachePerfis(ttl=60.0, geracao=geracao_perfis) for _ in range(2)]
+    carregar = _carregador({"a@x": {"credits": 1}, "b@x": {"credits": 2}})
+    for cache in caches:
+        cache.obter("a@x", carregar)
+        cache.obter("b@x", carregar)
+    invalidar_perfil("a@x")
+
+    invalidar_perfil()
+    del carregar.lidos[:]
+    for cache in caches:
+        cache.obter("a@x", carregar)
+        cache.obter("b@x", carregar)
+    assert carregar.lidos == ["a@x", "b@x"] * 2
@@ -0,0 +1,68 @@
+import asyncio
+import io
+
+import google.generativeai as genai
+import PIL.Image
+import pytest
+
+import pericia
+from cache_resultados import CacheResultados
+from geoindice import IndiceGeografico
+from hash_perceptual import IndiceHamming
+
+
+class ClienteAsyncFalso:
+    """GenerativeServiceAsyncClient preso ao loop em que foi criado, como o do gRPC."""
+
+    def __init__(self, criados):
+        self.loop = asyncio.get_running_loop()
+        self.chamadas = 0
+        criados.append(self)
+
+    async def generate_content(self, request, **opcoes):
+        if asyncio.get_running_loop() is not self.loop:
+            raise RuntimeError("cliente usado fora do event loop em que foi criado")
+        self.chamadas += 1
+        return genai.protos.GenerateContentResponse(candidates=[{
+            "content": {"role": "model", "parts": [{"text": "laudo"}]},
+            "finish_reason": "STOP"
+        }])
+
+
+@pytest.fixture
+def clientes(monkeypatch, tmp_path):
+    criados = []
+    monkeypatch.setattr(pericia.genai_client._client_manager, "make_client",
+                        lambda nome: ClienteAsyncFalso(criados))
+    monkeypatch.setattr(pericia, "pool_modelos", pericia.PoolModelos())
+    monkeypatch.setattr(pericia, "cache_resultados", CacheResultados(str(tmp_path / "cache")))
+    monkeypatch.setattr(pericia, "indice_perceptual", IndiceHamming(arquivo=None))
+    monkeypatch.setattr(pericia, "indice_geografico", IndiceGeografico(arquivo=None))
+    monkeypatch.setattr(pericia.catalogo_modelos, "escolher", lambda api_key: pericia.MODELO_PADRAO)
+    monkeypatch.setattr(pericia.catalogo_modelos, "alternativas", lambda api_key: [])
+    return criados
+
+
+def _evidencia(cor):
+    buffer = io.BytesIO()
+    PIL.Image.new("RGB", (64, 48), cor).save(buffer, "PNG")
+    buffer.seek(0)
+    return buffer
+
+
+def test_cada_event_loop_usa_o_proprio_cliente(clientes):
+    primeiro = asyncio.run(pericia.executar_pericia_async(_evidencia("red"), "chave"))
+    segundo = asyncio.run(pericia.executar_pericia_async(_evidencia("blue"), "chave"))
+
+    assert (primeiro, segundo) == ("laudo", "laudo")
+    assert len(clientes) == 2
+    assert [cliente.chamadas for cliente in clientes] == [1, 1]
+
+
+def test_mesmo_loop_reaproveita_o_cliente(clientes):
+    async def lote():
+        return await pericia.executar_pericia_lote_async([_evidencia("red"), _evidencia("green")], "chave")
+
+    assert asyncio.run(lote()) == ["laudo", "laudo"]
+    assert len(clientes) == 1
+    assert clientes[0].chamadas == 2
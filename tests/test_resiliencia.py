@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from resiliencia import Disjuntor, Invocador
+
+
+class ErroApi(Exception):
+    def __init__(self, code, mensagem="erro"):
+        super().__init__(mensagem)
+        self.code = code
+
+
+def _falhar(erro):
+    def chamar(modelo, timeout):
+        raise erro
+    return chamar
+
+
+def _invocador():
+    invocador = Invocador(Disjuntor(limite_falhas=2))
+    invocador._espera = lambda numero: 0.0
+    return invocador
+
+
+def test_erro_da_requisicao_nao_abre_o_disjuntor():
+    invocador = _invocador()
+    for _ in range(5):
+        with pytest.raises(ErroApi):
+            invocador.executar(_falhar(ErroApi(400)), "a")
+    assert invocador.disjuntor.estado("a") == "fechado"
+
+
+def test_erro_do_servico_abre_o_disjuntor():
+    invocador = _invocador()
+    with pytest.raises(ErroApi):
+        invocador.executar(_falhar(ErroApi(503)), "a")
+    assert invocador.disjuntor.estado("a") == "aberto"
+
+
+def test_para_quando_todos_os_modelos_foram_descartados():
+    invocador = _invocador()
+    chamados = []
+
+    def chamar(modelo, timeout):
+        chamados.append(modelo)
+        raise ErroApi(404, "model not found")
+
+    with pytest.raises(ErroApi):
+        invocador.executar(chamar, "a", ["b"])
+    assert chamados == ["a", "b"]
+
+
+def test_para_quando_todos_os_modelos_foram_descartados_async():
+    invocador = _invocador()
+    chamados = []
+
+    async def chamar(modelo, timeout):
+        chamados.append(modelo)
+        raise ErroApi(404, "model not found")
+
+    with pytest.raises(ErroApi):
+        asyncio.run(invocador.executar_async(chamar, "a", ["b"]))
+    assert chamados == ["a", "b"]
+    assert invocador.disjuntor.estado("a") == "fechado"